@@ -144,6 +144,12 @@ def vae_decode_fake(latents):
 
 @torch.no_grad()
 def vae_decode(latents, vae, image_mode=False):
+    from diffusers_helper.models.latent_decoders import LatentDecoder
+
+    # Any latent -> pixel decoder can stand in for the full VAE
+    if isinstance(vae, LatentDecoder):
+        return vae.decode(latents)
+
     latents = latents / vae.config.scaling_factor
 
     if not image_mode:
@@ -156,6 +162,51 @@ def vae_decode(latents, vae, image_mode=False):
     return image
 
 
+@torch.no_grad()
+def vae_decode_chunked(latents, vae, chunk_latent_frames=None, overlap_latent_frames=None, windows=None):
+    """
+    Decodes a long latent video in overlapping temporal windows into a HistoryPixelStore, cross-fading
+    the overlaps the same way `soft_append_bcthw` does between sections.
+
+    Each window is quantized into the preallocated uint8 frames as soon as it is decoded, only the frames
+    the next window blends into stay in float. The windows are either evenly spaced chunks, or the given
+    (start, end) latent ranges, e.g. the ones the section loop decodes, which gives the same frames as
+    decoding section by section.
+    """
+    from diffusers_helper.pixel_history import HistoryPixelStore
+
+    num_latent_frames = latents.shape[2]
+    if windows is None:
+        if num_latent_frames <= chunk_latent_frames:
+            windows = [(0, num_latent_frames)]
+        else:
+            stride = chunk_latent_frames - overlap_latent_frames
+            assert stride > 0, f"Overlap ({overlap_latent_frames}) must be smaller than the chunk ({chunk_latent_frames})"
+
+            starts = list(range(0, num_latent_frames - chunk_latent_frames, stride)) + [num_latent_frames - chunk_latent_frames]
+            windows = [(start, start + chunk_latent_frames) for start in starts]
+    else:
+        windows = sorted(windows)
+        assert windows[0][0] == 0 and windows[-1][1] == num_latent_frames, f"Windows {windows} do not cover the {num_latent_frames} latent frames"
+
+    # The first latent of a window decodes to a single frame, latent k > 0 to frames 4k-3..4k
+    num_frames = (num_latent_frames - 1) * 4 + 1
+    history = None
+    written_end = 0
+    for i, (start, end) in enumerate(windows):
+        pixels = vae_decode(latents[:, :, start:end], vae).cpu()
+        pixel_start = start * 4
+        pixel_end = pixel_start + pixels.shape[2]
+        next_start = windows[i + 1][0] * 4 if i + 1 < len(windows) else pixel_end
+
+        if history is None:
+            history = HistoryPixelStore(pixels[:, :, :0], capacity_frames=num_frames)
+        history.append(pixels, written_end - pixel_start, keep_frames=max(pixel_end - next_start, 0))
+        written_end = max(written_end, pixel_end)
+
+    return history
+
+
 @torch.no_grad()
 def vae_encode(image, vae):
     latents = vae.encode(image.to(device=vae.device, dtype=vae.dtype)).latent_dist.sample()
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+
+def _raw_parameter(module: torch.nn.Module, name: str) -> Optional[torch.Tensor]:
+    # Read the stored tensor, DynamicSwap modules return a device copy from getattr
+    return module.__dict__['_parameters'].get(name)
+
+
+def _lora_layers(transformer: torch.nn.Module):
+    """(name, module) of the PEFT LoRA layers of the transformer"""
+    for name, module in transformer.named_modules():
+        if hasattr(module, 'base_layer') and isinstance(getattr(module, 'lora_A', None), torch.nn.ModuleDict):
+            yield name, module
+
+
+def _compute_delta(module: torch.nn.Module, adapter_names: List[str], device: torch.device, dtype: torch.dtype) -> Optional[torch.Tensor]:
+    """Sum of scaling * B @ A over the adapters of a layer, rounded to the dtype of the base weight"""
+    delta = None
+    for adapter_name in adapter_names:
+        if adapter_name not in module.lora_A:
+            continue
+        if getattr(module, 'use_dora', {}).get(adapter_name):
+            raise ValueError(f"Adapter '{adapter_name}' uses DoRA, which cannot be fused")
+        lora_a = _raw_parameter(module.lora_A[adapter_name], 'weight').to(device=device, dtype=torch.float32)
+        lora_b = _raw_parameter(module.lora_B[adapter_name], 'weight').to(device=device, dtype=torch.float32)
+        scaling = module.scaling[adapter_name]
+        if isinstance(scaling, torch.Tensor):
+            scaling = scaling.item()
+        layer_delta = (lora_b @ lora_a) * scaling
+        delta = layer_delta if delta is None else delta + layer_delta
+    if delta is None:
+        return None
+    # Always rounded the same way, so a delta from the cache fuses to the exact same weights
+    return delta.to(dtype)
+
+
+class LoraDeltaCache:
+    """Combined per layer deltas of recently fused LoRA sets, in host memory under max_bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> {layer name: delta}
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            deltas = self.entries.get(key)
+            if deltas is not None:
+                self.entries.move_to_end(key)
+            return deltas
+
+    def put(self, key, deltas: Dict[str, torch.Tensor]):
+        size = sum(d.numel() * d.element_size() for d in deltas.values())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.entries[key] = deltas
+            self.sizes[key] = size
+            while sum(self.sizes.values()) > self.max_bytes and len(self.entries) > 1:
+                evicted, _ = self.entries.popitem(last=False)
+                del self.sizes[evicted]
+
+
+def get_fused_key(transformer: torch.nn.Module):
+    """Key of the LoRA set fused into the transformer weights, or None"""
+    state = getattr(transformer, 'lora_fusion', None)
+    return state["key"] if state else None
+
+
+def _layer_bytes(weight: torch.Tensor) -> int:
+    return weight.numel() * weight.element_size()
+
+
+def fuse_loras(transformer: torch.nn.Module, adapter_names: List[str], key: Tuple, device: torch.device,
+               delta_cache: Optional[LoraDeltaCache] = None, max_backup_bytes: Optional[int] = None) -> bool:
+    """
+    Merges the active LoRA adapters into the base weights of the transformer.
+
+    The adapters must be loaded and scaled with set_adapters first. The layers are marked as merged, so
+    PEFT runs only the base layer and the steps cost the same as without LoRAs.
+
+    unfuse_loras restores the original weights bit for bit. While the deltas are kept in delta_cache, a
+    layer is restored by subtracting its delta again, plus the few elements where rounding made the
+    subtraction differ from the original, which are checked here and kept on the CPU. Otherwise the
+    original weights are copied to the CPU. Either way the backup is capped by max_backup_bytes, over
+    it the fusion is undone and a ValueError raised, the LoRAs then have to run as adapters.
+
+    Args:
+        transformer: The transformer with the adapters loaded
+        adapter_names: Adapters to fuse
+        key: Identifies the LoRA set and weights, e.g. ((file digest, weight), ...)
+        device: Where the deltas are computed
+        delta_cache: Keeps the combined deltas, so fusing the same key again skips the matmuls
+        max_backup_bytes: Host memory for the backup, see get_fusion_backup_max_bytes
+
+    Returns:
+        True if the weights are fused with key
+    """
+    if get_fused_key(transformer) == key:
+        return True
+    unfuse_loras(transformer)
+    if max_backup_bytes is None:
+        max_backup_bytes = get_fusion_backup_max_bytes()
+
+    start_time = time.perf_counter()
+    layers = []
+    for name, module in _lora_layers(transformer):
+        weight = _raw_parameter(module.base_layer, 'weight')
+        if weight is not None and any(adapter_name in module.lora_A for adapter_name in adapter_names):
+            layers.append((name, module, weight))
+    fused_bytes = sum(_layer_bytes(weight) for _, _, weight in layers)
+
+    cached = delta_cache.get(key) if delta_cache is not None else None
+    # Layers are restored by subtraction only when the deltas stay around, so they are collected when they fit
+    deltas = {} if cached is None and delta_cache is not None and fused_bytes <= delta_cache.max_bytes else None
+    kept_deltas = cached if cached is not None else deltas
+    if kept_deltas is None and fused_bytes > max_backup_bytes:
+        raise ValueError(f"The original weights of the fused layers take {fused_bytes / 1024 ** 2:.0f} MB, over the "
+                         f"{max_backup_bytes / 1024 ** 2:.0f} MB backup budget (FRAMEPACK_LORA_FUSION_BACKUP_MB)")
+
+    # Per layer: a CPU copy of the original weight, or (flat indices, original values) fixing the subtraction
+    originals = {}
+    fixes = {}
+    backup_bytes = 0
+    transformer.lora_fusion = {"key": key, "originals": originals, "fixes": fixes, "deltas": kept_deltas, "device": device}
+    try:
+        for name, module, weight in layers:
+            if cached is not None:
+                delta = cached.get(name)
+            else:
+                delta = _compute_delta(module, adapter_names, device, weight.dtype)
+            if delta is None:
+                continue
+            original = weight.detach().to(device=device)
+            delta = delta.to(device=device, dtype=torch.float32)
+            merged = (original.to(torch.float32) + delta).to(weight.dtype)
+
+            layer_backup = _layer_bytes(weight)
+            indices = None
+            if kept_deltas is not None:
+                restored = (merged.to(torch.float32) - delta).to(weight.dtype)
+                indices = (restored != original).reshape(-1).nonzero().view(-1)
+                fix_bytes = indices.numel() * (4 + weight.element_size())
+                if fix_bytes < layer_backup:
+                    layer_backup = fix_bytes
+                else:
+                    indices = None
+            backup_bytes += layer_backup
+            if backup_bytes > max_backup_bytes:
+                raise ValueError(f"Restoring the fused layers needs more than the {max_backup_bytes / 1024 ** 2:.0f} MB "
+                                 f"backup budget (FRAMEPACK_LORA_FUSION_BACKUP_MB)")
+            if indices is not None:
+                fixes[name] = (indices.to(device='cpu', dtype=torch.int32), original.reshape(-1)[indices].cpu())
+            else:
+                originals[name] = weight.detach().to('cpu', copy=True)
+            if deltas is not None:
+                deltas[name] = delta.to(weight.dtype).cpu()
+
+            weight.data.copy_(merged)
+            module.merged_adapters = [adapter_name for adapter_name in adapter_names if adapter_name in module.lora_A]
+    except Exception:
+        # Leave the transformer as it was
+        unfuse_loras(transformer)
+        raise
+
+    if deltas is not None:
+        delta_cache.put(key, deltas)
+    print(f"Fused LoRAs {adapter_names} into {len(originals) + len(fixes)} layers{' (cached deltas)' if cached is not None else ''}, "
+          f"{backup_bytes / 1024 ** 2:.0f} MB kept to restore them: {time.perf_counter() - start_time:.2f}s")
+    return True
+
+
+def unfuse_loras(transformer: torch.nn.Module):
+    """Restores the original base weights, see fuse_loras"""
+    state = getattr(transformer, 'lora_fusion', None)
+    if not state:
+        return
+    originals, fixes, deltas = state["originals"], state["fixes"], state["deltas"]
+    for name, module in _lora_layers(transformer):
+        weight = _raw_parameter(module.base_layer, 'weight')
+        original = originals.get(name)
+        fix = fixes.get(name)
+        if original is not None:
+            weight.data.copy_(original)
+        elif fix is not None:
+            device = state["device"]
+            restored = (weight.detach().to(device=device, dtype=torch.float32) - deltas[name].to(device=device, dtype=torch.float32)).to(weight.dtype)
+            indices, values = fix
+            restored.view(-1)[indices.to(device=device, dtype=torch.long)] = values.to(device)
+            weight.data.copy_(restored)
+        if original is not None or fix is not None or getattr(module, 'merged_adapters', None):
+            module.merged_adapters = []
+    transformer.lora_fusion = None
+    print(f"Restored the original weights of {len(originals) + len(fixes)} layers")
+
+
+def get_fusion_backup_max_bytes():
+    """Host memory for what restores the weights of fused LoRAs, FRAMEPACK_LORA_FUSION_BACKUP_MB"""
+    return int(float(os.environ.get("FRAMEPACK_LORA_FUSION_BACKUP_MB", "4096")) * 1024 * 1024)
+
+
+def get_delta_cache_max_bytes():
+    """Host memory for the combined deltas of fused LoRA sets, FRAMEPACK_LORA_FUSION_CACHE_MB"""
+    return int(float(os.environ.get("FRAMEPACK_LORA_FUSION_CACHE_MB", "4096")) * 1024 * 1024)
+
+
+_delta_cache = None
+_delta_cache_lock = threading.Lock()
+
+
+def get_delta_cache():
+    global _delta_cache
+    with _delta_cache_lock:
+        if _delta_cache is None:
+            _delta_cache = LoraDeltaCache(get_delta_cache_max_bytes())
+        return _delta_cache
@@ -12,19 +12,17 @@ FALLBACK_CLASS_ALIASES = {
     "HunyuanVideoTransformer3DModelPacked": "HunyuanVideoTransformer3DModel",
 }
 
-def load_lora(transformer: torch.nn.Module, lora_path: Path, weight_name: str) -> Tuple[torch.nn.Module, str]:
+def load_lora_state_dict(lora_path: Path, weight_name: str) -> Dict[str, torch.Tensor]:
     """
-    Load LoRA weights into the transformer model.
+    Read a LoRA file and convert it to the diffusers format, without touching the transformer.
 
     Args:
-        transformer: The transformer model to which LoRA weights will be applied.
         lora_path: Path to the folder containing the LoRA weights file.
         weight_name: Filename of the weight to load.
 
     Returns:
-        A tuple containing the modified transformer and the canonical adapter name.
+        The converted state dict, on the CPU.
     """
-    
     state_dict = _fetch_state_dict(
         lora_path,
         weight_name,
@@ -39,13 +37,38 @@ def load_lora(transformer: torch.nn.Module, lora_path: Path, weight_name: str) -
         None,
         None)
 
-    state_dict = _convert_hunyuan_video_lora_to_diffusers(state_dict)
-    
+    return _convert_hunyuan_video_lora_to_diffusers(state_dict)
+
+
+def get_adapter_name(weight_name: str) -> str:
+    """
+    Canonical adapter name of a LoRA file.
+    """
     # should weight_name even be Optional[str] or just str?
     # For now, we assume it is never None
     # The module name in the state_dict must not include a . in the name
     # See https://github.com/pytorch/pytorch/pull/6639/files#diff-4be56271f7bfe650e3521c81fd363da58f109cd23ee80d243156d2d6ccda6263R133-R134
-    adapter_name = str(PurePath(weight_name).with_suffix('')).replace('.', '_DOT_')
+    return str(PurePath(weight_name).with_suffix('')).replace('.', '_DOT_')
+
+
+def load_lora(transformer: torch.nn.Module, lora_path: Path, weight_name: str, state_dict: Optional[Dict[str, torch.Tensor]] = None) -> Tuple[torch.nn.Module, str]:
+    """
+    Load LoRA weights into the transformer model.
+
+    Args:
+        transformer: The transformer model to which LoRA weights will be applied.
+        lora_path: Path to the folder containing the LoRA weights file.
+        weight_name: Filename of the weight to load.
+        state_dict: Already converted state dict (see load_lora_state_dict), read from the file when None.
+
+    Returns:
+        A tuple containing the modified transformer and the canonical adapter name.
+    """
+    
+    if state_dict is None:
+        state_dict = load_lora_state_dict(lora_path, weight_name)
+    
+    adapter_name = get_adapter_name(weight_name)
     if '_DOT_' in adapter_name:
         print(
             f"LoRA file '{weight_name}' contains a '.' in the name. " +
@@ -1,12 +1,47 @@
 # By lllyasviel
 
 
+import os
+import threading
+import time
+import weakref
+
 import torch
 
 
 cpu = torch.device('cpu')
-gpu = torch.device(f'cuda:{torch.cuda.current_device()}')
-gpu_complete_modules = []
+# Default device for single device callers, workers of a device pool pass their own device explicitly
+gpu = torch.device(f'cuda:{torch.cuda.current_device()}') if torch.cuda.is_available() else cpu
+# Models loaded as complete, per device, so one worker never unloads another worker's models
+gpu_complete_modules = {}
+
+
+def get_worker_devices():
+    """
+    Devices to run one job worker on each, from FRAMEPACK_DEVICES.
+
+    "auto" (the default) selects every visible CUDA device, or the CPU when there is none.
+    Otherwise a comma separated list such as "cuda:0,cuda:1" or "cpu".
+    """
+    spec = os.environ.get("FRAMEPACK_DEVICES", "auto").strip()
+    if spec == "auto":
+        if torch.cuda.is_available():
+            return [torch.device(f'cuda:{i}') for i in range(torch.cuda.device_count())]
+        return [cpu]
+
+    devices = []
+    for name in spec.split(','):
+        name = name.strip()
+        if name:
+            devices.append(torch.device(name))
+    return devices or [gpu]
+
+
+def _device_key(device):
+    device = torch.device(device)
+    if device.type == 'cuda' and device.index is None:
+        return torch.device(f'cuda:{torch.cuda.current_device()}')
+    return device
 
 
 class DynamicSwapInstaller:
@@ -71,6 +106,11 @@ def fake_diffusers_current_device(model: torch.nn.Module, target_device: torch.d
 def get_cuda_free_memory_gb(device=None):
     if device is None:
         device = gpu
+    device = torch.device(device)
+
+    if device.type != 'cuda':
+        import psutil
+        return psutil.virtual_memory().available / (1024 ** 3)
 
     memory_stats = torch.cuda.memory_stats(device)
     bytes_active = memory_stats['active_bytes.all.current']
@@ -81,6 +121,18 @@ def get_cuda_free_memory_gb(device=None):
     return bytes_total_available / (1024 ** 3)
 
 
+def get_device_total_memory_gb(device=None):
+    if device is None:
+        device = gpu
+    device = torch.device(device)
+
+    if device.type != 'cuda':
+        import psutil
+        return psutil.virtual_memory().total / (1024 ** 3)
+
+    return torch.cuda.get_device_properties(device).total_memory / (1024 ** 3)
+
+
 def move_model_to_device_with_memory_preservation(model, target_device, preserved_memory_gb=0):
     print(f'Moving {model.__class__.__name__} to {target_device} with preserved memory: {preserved_memory_gb} GB')
 
@@ -113,22 +165,239 @@ def offload_model_from_device_for_memory_preservation(model, target_device, pres
     return
 
 
-def unload_complete_models(*args):
-    for m in gpu_complete_modules + list(args):
-        m.to(device=cpu)
+def _tensor_bytes(t):
+    return t.numel() * t.element_size()
+
+
+class PinnedHostArena:
+    """
+    Pinned host buffers for the models swapped whole between the CPU and a device.
+
+    The buffers of a model are allocated on its first offload and reused by every later one, so offloads
+    copy into page-locked memory instead of allocating new pageable tensors, and reloads from them are
+    asynchronous copies the following kernels are queued behind. Models that do not fit in max_bytes are
+    moved with a plain .to(). The bytes and time of each swap are recorded, see swap_bandwidth_report().
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.buffers = weakref.WeakKeyDictionary()  # model -> {tensor name: pinned tensor}
+        self.skipped = weakref.WeakSet()
+        self.stats = {"load": [0, 0, 0.0], "unload": [0, 0, 0.0]}  # direction -> [swaps, bytes, seconds]
+        self.pending = []  # (model name, bytes, start event, end event) of the loads still running
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _tensors(model):
+        """(module, kind, qualified name, name, tensor) of each parameter and buffer, shared tensors once"""
+        seen = set()
+        for module_name, module in model.named_modules():
+            for kind in ('_parameters', '_buffers'):
+                for name, t in module.__dict__[kind].items():
+                    if t is None or id(t) in seen:
+                        continue
+                    seen.add(id(t))
+                    yield module, kind, f'{module_name}.{name}' if module_name else name, name, t
+
+    @staticmethod
+    def _assign(module, kind, name, t, data):
+        if kind == '_parameters':
+            t.data = data
+        else:
+            module._buffers[name] = data
+
+    def _release(self, nbytes):
+        with self.lock:
+            self.used_bytes -= nbytes
+
+    def _buffers_for(self, model):
+        """The pinned buffers of a model, allocated on first use, None if it does not fit in the arena"""
+        with self.lock:
+            if model in self.buffers:
+                return self.buffers[model]
+            if model in self.skipped:
+                return None
+            tensors = list(self._tensors(model))
+            nbytes = sum(_tensor_bytes(t) for _, _, _, _, t in tensors)
+            if self.used_bytes + nbytes > self.max_bytes:
+                self.skipped.add(model)
+                print(f'Pinned swap arena: {model.__class__.__name__} ({nbytes / (1024 ** 3):.2f} GB) does not fit, using pageable copies')
+                return None
+            self.used_bytes += nbytes
+
+        buffers = {key: torch.empty_like(t, device=cpu, pin_memory=True) for _, _, key, _, t in tensors}
+        with self.lock:
+            self.buffers[model] = buffers
+        weakref.finalize(model, self._release, nbytes)
+        print(f'Pinned swap arena: allocated {nbytes / (1024 ** 3):.2f} GB for {model.__class__.__name__} ({self.used_bytes / (1024 ** 3):.2f} GB used)')
+        return buffers
+
+    def _record(self, direction, nbytes, seconds):
+        with self.lock:
+            stats = self.stats[direction]
+            stats[0] += 1
+            stats[1] += nbytes
+            stats[2] += seconds
+
+    def _collect_pending(self):
+        """Adds the loads whose copies have finished to the stats"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        still_running = []
+        for entry in pending:
+            name, nbytes, start_event, end_event = entry
+            if end_event.query():
+                self._record('load', nbytes, start_event.elapsed_time(end_event) / 1000)
+            else:
+                still_running.append(entry)
+        with self.lock:
+            self.pending = still_running + self.pending
+
+    def offload(self, model):
+        """Moves a model to its pinned host buffers, waits for the copies so the CPU can use them"""
+        self._collect_pending()
+        buffers = self._buffers_for(model)
+        devices = set()
+        nbytes = 0
+        start_time = time.perf_counter()
+        for module, kind, key, name, t in self._tensors(model):
+            if t.device.type == 'cpu':
+                continue
+            devices.add(t.device)
+            host = buffers.get(key) if buffers is not None else None
+            if host is None or host.shape != t.shape or host.dtype != t.dtype:
+                host = t.detach().to(cpu)
+            else:
+                host.copy_(t.detach(), non_blocking=True)
+            self._assign(module, kind, name, t, host)
+            nbytes += _tensor_bytes(host)
+        for device in devices:
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+        seconds = time.perf_counter() - start_time
+        if nbytes:
+            self._record('unload', nbytes, seconds)
+        return nbytes, seconds
+
+    def load(self, model, target_device):
+        """Starts copying a model to the device without waiting, work queued after it on the device runs once it is there"""
+        self._collect_pending()
+        timed = target_device.type == 'cuda'
+        if timed:
+            start_event = torch.cuda.Event(enable_timing=True)
+            end_event = torch.cuda.Event(enable_timing=True)
+            start_event.record(torch.cuda.current_stream(target_device))
+        nbytes = 0
+        for module, kind, key, name, t in self._tensors(model):
+            if t.device == target_device:
+                continue
+            self._assign(module, kind, name, t, t.detach().to(target_device, non_blocking=True))
+            nbytes += _tensor_bytes(t)
+        if timed and nbytes:
+            end_event.record(torch.cuda.current_stream(target_device))
+            with self.lock:
+                self.pending.append((model.__class__.__name__, nbytes, start_event, end_event))
+        return nbytes
+
+    def swap_bandwidth_report(self):
+        """Swaps, size and bandwidth per direction since the start of the process"""
+        self._collect_pending()
+        with self.lock:
+            stats = {direction: list(values) for direction, values in self.stats.items()}
+        parts = []
+        for direction, (swaps, nbytes, seconds) in stats.items():
+            if swaps:
+                parts.append(f'{direction} {swaps} swaps, {nbytes / (1024 ** 3):.2f} GB at {nbytes / (1024 ** 3) / max(seconds, 1e-9):.1f} GB/s')
+        return '; '.join(parts) if parts else 'no swaps'
+
+
+def get_pinned_arena_max_bytes():
+    """Pinned host memory for whole model swaps, FRAMEPACK_PINNED_SWAP_MB (0 disables the arena)"""
+    return int(float(os.environ.get('FRAMEPACK_PINNED_SWAP_MB', '8192')) * 1024 * 1024)
+
+
+_pinned_arena = None
+_pinned_arena_lock = threading.Lock()
+
+
+def get_pinned_arena():
+    """The process wide PinnedHostArena, None without CUDA or when disabled"""
+    global _pinned_arena
+    with _pinned_arena_lock:
+        if _pinned_arena is None and torch.cuda.is_available() and get_pinned_arena_max_bytes() > 0:
+            _pinned_arena = PinnedHostArena(get_pinned_arena_max_bytes())
+        return _pinned_arena
+
+
+def swap_bandwidth_report():
+    arena = get_pinned_arena()
+    return arena.swap_bandwidth_report() if arena is not None else 'pinned swap arena disabled'
+
+
+def unload_complete_models(*args, device=None):
+    if device is None:
+        modules = [m for ms in gpu_complete_modules.values() for m in ms]
+        gpu_complete_modules.clear()
+    else:
+        modules = gpu_complete_modules.pop(_device_key(device), [])
+
+    arena = get_pinned_arena()
+    for m in modules + list(args):
+        if arena is not None:
+            nbytes, seconds = arena.offload(m)
+            if nbytes:
+                print(f'Unloaded {m.__class__.__name__} as complete: {nbytes / (1024 ** 3):.2f} GB in {seconds:.3f}s ({nbytes / (1024 ** 3) / max(seconds, 1e-9):.1f} GB/s).')
+                continue
+        else:
+            m.to(device=cpu)
         print(f'Unloaded {m.__class__.__name__} as complete.')
 
-    gpu_complete_modules.clear()
     torch.cuda.empty_cache()
     return
 
 
 def load_model_as_complete(model, target_device, unload=True):
+    target_device = _device_key(target_device)
     if unload:
-        unload_complete_models()
+        unload_complete_models(device=target_device)
 
-    model.to(device=target_device)
-    print(f'Loaded {model.__class__.__name__} to {target_device} as complete.')
+    arena = get_pinned_arena()
+    if arena is not None and target_device.type == 'cuda':
+        nbytes = arena.load(model, target_device)
+        print(f'Loading {model.__class__.__name__} to {target_device} as complete ({nbytes / (1024 ** 3):.2f} GB, async).')
+    else:
+        model.to(device=target_device)
+        print(f'Loaded {model.__class__.__name__} to {target_device} as complete.')
 
-    gpu_complete_modules.append(model)
+    gpu_complete_modules.setdefault(_device_key(target_device), []).append(model)
     return
+
+
+activation_peaks_gb = {}
+
+
+def start_activation_peak_tracking(device=None):
+    if device is None:
+        device = gpu
+
+    if device.type != 'cuda':
+        return 0
+
+    torch.cuda.synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    return torch.cuda.memory_allocated(device)
+
+
+def record_activation_peak(bucket, baseline_bytes, device=None):
+    if device is None:
+        device = gpu
+
+    if device.type != 'cuda':
+        return 0.0
+
+    torch.cuda.synchronize(device)
+    peak_gb = (torch.cuda.max_memory_allocated(device) - baseline_bytes) / (1024 ** 3)
+    activation_peaks_gb[bucket] = max(peak_gb, activation_peaks_gb.get(bucket, 0.0))
+    print(f'Peak activation memory for bucket {bucket}: {peak_gb:.2f} GB (max seen: {activation_peaks_gb[bucket]:.2f} GB)')
+    return peak_gb
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+def get_default_cache_path():
+    home_root = os.environ.get("FRAMEPACK_HOME", os.path.expanduser("~/.cache/framepack"))
+    return os.path.join(home_root, "attention_autotune.json")
+
+
+class AttentionAutotuner:
+    """
+    Picks the fastest attention backend per (kind, device, seq_len bucket, heads, head_dim, dtype).
+
+    The first time a shape is seen every available backend is benchmarked on the real inputs.
+    Backends that fail while tuning are discarded for that shape, so the hot path can call the
+    winner directly without any try/except fallback. Decisions are persisted to a JSON file and
+    reused across processes and restarts. When disabled, callers keep the fixed priority order with a
+    fallback to the next backend on errors.
+    """
+
+    def __init__(self, cache_path=None, enabled=True, seq_len_bucket=1024, warmup=1, repeats=3):
+        self.cache_path = cache_path or get_default_cache_path()
+        self.enabled = enabled
+        self.seq_len_bucket = seq_len_bucket
+        self.warmup = warmup
+        self.repeats = repeats
+
+        self.decisions = {}
+        self.device_names = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            self.decisions = {k: v for k, v in data.items() if isinstance(v, dict) and "backend" in v}
+            print(f"Loaded {len(self.decisions)} attention autotune decisions from {self.cache_path}")
+        except Exception as e:
+            print(f"Error loading attention autotune cache: {e}")
+            self.decisions = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+
+            # Merge with decisions written by other processes in the meantime
+            merged = {}
+            if os.path.exists(self.cache_path):
+                try:
+                    with open(self.cache_path, "r") as f:
+                        merged = json.load(f)
+                except Exception:
+                    merged = {}
+            merged.update(self.decisions)
+
+            temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(merged, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            print(f"Error saving attention autotune cache: {e}")
+
+    def bucket(self, seq_len):
+        return ((int(seq_len) + self.seq_len_bucket - 1) // self.seq_len_bucket) * self.seq_len_bucket
+
+    def make_key(self, kind, q):
+        # Dense queries are (B, L, H, C), packed varlen queries are (B * L, H, C)
+        L, H, C = q.shape[-3:]
+        device_name = self.device_names.get(q.device)
+        if device_name is None:
+            device_name = torch.cuda.get_device_name(q.device) if q.device.type == "cuda" else q.device.type
+            self.device_names[q.device] = device_name
+        dtype = str(q.dtype).replace("torch.", "")
+        return f"{kind}|{device_name}|L{self.bucket(L)}|H{H}|D{C}|{dtype}"
+
+    @staticmethod
+    def _synchronize(device):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    def _benchmark(self, fn, args, device):
+        for _ in range(self.warmup):
+            fn(*args)
+        self._synchronize(device)
+
+        start = time.perf_counter()
+        for _ in range(self.repeats):
+            fn(*args)
+        self._synchronize(device)
+        return (time.perf_counter() - start) / self.repeats
+
+    def select(self, kind, candidates, q, *args):
+        """
+        Returns the name of the backend to use for this call.
+
+        Args:
+            kind: "dense" or "varlen", so both call signatures are tuned separately
+            candidates: Ordered dict of available backend name -> callable, in fallback priority order
+            q: The query tensor, used to build the shape key
+            *args: The full argument list passed to the candidate callables
+
+        Returns:
+            The backend name
+        """
+        if not self.enabled:
+            return next(iter(candidates))
+
+        key = self.make_key(kind, q)
+
+        decision = self.decisions.get(key)
+        if decision is not None and decision["backend"] in candidates:
+            return decision["backend"]
+
+        with self.lock:
+            decision = self.decisions.get(key)
+            if decision is not None and decision["backend"] in candidates:
+                return decision["backend"]
+
+            timings = {}
+            for name, fn in candidates.items():
+                try:
+                    timings[name] = self._benchmark(fn, (q, *args), q.device)
+                except Exception as e:
+                    print(f"Attention autotune: backend '{name}' unavailable for {key}: {e}")
+
+            if not timings:
+                raise NotImplementedError(f'No attention backend works for {key}!')
+
+            backend = min(timings, key=timings.get)
+            self.decisions[key] = {
+                "backend": backend,
+                "timings_ms": {name: round(t * 1000.0, 4) for name, t in timings.items()},
+            }
+
+            summary = ", ".join(f"{name}={t * 1000.0:.3f}ms" for name, t in sorted(timings.items(), key=lambda x: x[1]))
+            print(f"Attention autotune: {key} -> {backend} ({summary})")
+
+            self._save()
+            return backend
@@ -1,3 +1,4 @@
+import os
 from typing import Optional, Tuple
 
 import torch
@@ -17,6 +18,7 @@ from diffusers.models.modeling_outputs import Transformer2DModelOutput
 from diffusers.models.modeling_utils import ModelMixin
 from diffusers_helper.dit_common import LayerNorm
 from diffusers_helper.models.mag_cache import MagCache
+from diffusers_helper.models.attention_autotuner import AttentionAutotuner
 from utils import args
 
 
@@ -33,14 +35,17 @@ if torch.backends.cuda.cudnn_sdp_enabled():
 
 print("Currently enabled native sdp backends:", enabled_backends)
 
-major, minor = torch.cuda.get_device_capability()
-print(f"CUDA Capability: {major}.{minor}")
+if torch.cuda.is_available():
+    major, minor = torch.cuda.get_device_capability()
+    print(f"CUDA Capability: {major}.{minor}")
 
 xformers_attn_func = None
 flash_attn_varlen_func = None
 flash_attn_func = None
 sageattn_varlen = None
 sageattn = None
+sdpa_kernel = None
+SDPBackend = None
 
 try:
     # raise NotImplementedError
@@ -60,6 +65,11 @@ try:
 except:
     pass
 
+try:
+    from torch.nn.attention import sdpa_kernel, SDPBackend
+except:
+    pass
+
 # --- Attention Summary ---
 print("\n--- Attention Configuration ---")
 has_sage = sageattn is not None and sageattn_varlen is not None
@@ -88,6 +98,8 @@ else:
     print("⚠️  No attention library found. Using native PyTorch Scaled Dot Product Attention.")
     print("   - For better performance, consider installing one of:")
     print("     SAGE Attention (highest performance), Flash Attention (high performance), or xFormers.")
+if os.getenv("FRAMEPACK_ATTN_AUTOTUNE", "1") != "0":
+    print("   - Autotuning enabled: the fastest backend is benchmarked and cached per attention shape.")
 print("-------------------------------\n")
 
 
@@ -118,7 +130,7 @@ def get_cu_seqlens(text_mask, img_len):
     max_len = text_mask.shape[1] + img_len
 
     cu_seqlens = torch.zeros([2 * batch_size + 1],
-                             dtype=torch.int32, device="cuda")
+                             dtype=torch.int32, device=text_mask.device)
 
     for i in range(batch_size):
         s = text_len[i] + img_len
@@ -139,7 +151,94 @@ def apply_rotary_emb_transposed(x, freqs_cis):
     return out
 
 
-def attn_varlen_func(q_o, k_o, v_o, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv):
+def _sdpa_attn_func(q, k, v):
+    return F.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)).transpose(1, 2)
+
+
+def _make_sdpa_kernel_attn_func(backend):
+    def attn_func(q, k, v):
+        with sdpa_kernel(backend):
+            return _sdpa_attn_func(q, k, v)
+    return attn_func
+
+
+# Device -> (cu_seqlens, version, bounds) of the last packed batch seen on that device
+_cu_seqlens_bounds = {}
+
+
+def _get_cu_seqlens_bounds(cu_seqlens):
+    # Every block of a forward pass gets the same cu_seqlens tensor, so it is read back to the host once
+    # per forward instead of syncing the device in each attention call.
+    cached = _cu_seqlens_bounds.get(cu_seqlens.device)
+    if cached is not None and cached[0] is cu_seqlens and cached[1] == cu_seqlens._version:
+        return cached[2]
+    bounds = cu_seqlens.tolist()
+    _cu_seqlens_bounds[cu_seqlens.device] = (cu_seqlens, cu_seqlens._version, bounds)
+    return bounds
+
+
+def _sdpa_varlen_attn_func(q, k, v, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv):
+    # Runs SDPA once per packed sequence, which is exactly what the varlen kernels compute.
+    out = torch.zeros_like(q)
+    bounds_q = _get_cu_seqlens_bounds(cu_seqlens_q)
+    bounds_kv = _get_cu_seqlens_bounds(cu_seqlens_kv)
+    for i in range(len(bounds_q) - 1):
+        sq, eq = bounds_q[i], bounds_q[i + 1]
+        skv, ekv = bounds_kv[i], bounds_kv[i + 1]
+        if eq <= sq or ekv <= skv:
+            continue
+        out[sq:eq] = _sdpa_attn_func(q[None, sq:eq], k[None, skv:ekv], v[None, skv:ekv])[0]
+    return out
+
+
+# Candidates are listed in the old fixed priority order, which is also used when autotuning is disabled.
+dense_attn_backends = {}
+if sageattn is not None:
+    dense_attn_backends['sage'] = lambda q, k, v: sageattn(q, k, v, tensor_layout='NHD')
+if flash_attn_func is not None:
+    dense_attn_backends['flash'] = flash_attn_func
+if xformers_attn_func is not None:
+    dense_attn_backends['xformers'] = xformers_attn_func
+dense_attn_backends['sdpa'] = _sdpa_attn_func
+if sdpa_kernel is not None:
+    dense_attn_backends['sdpa_flash'] = _make_sdpa_kernel_attn_func(SDPBackend.FLASH_ATTENTION)
+    dense_attn_backends['sdpa_mem_efficient'] = _make_sdpa_kernel_attn_func(SDPBackend.EFFICIENT_ATTENTION)
+    dense_attn_backends['sdpa_math'] = _make_sdpa_kernel_attn_func(SDPBackend.MATH)
+
+# xFormers is not a candidate here: its dense kernel ignores cu_seqlens and gives wrong results for packed batches.
+varlen_attn_backends = {}
+if sageattn_varlen is not None:
+    varlen_attn_backends['sage'] = sageattn_varlen
+if flash_attn_varlen_func is not None:
+    varlen_attn_backends['flash'] = flash_attn_varlen_func
+varlen_attn_backends['sdpa'] = _sdpa_varlen_attn_func
+
+attention_autotuner = AttentionAutotuner(enabled=os.getenv("FRAMEPACK_ATTN_AUTOTUNE", "1") != "0")
+
+
+def _run_attn_backend(kind, candidates, q, *args):
+    if not attention_autotuner.enabled:
+        # Without autotuning nothing has been validated for this shape, try the backends in priority order
+        for name, fn in candidates.items():
+            try:
+                return fn(q, *args)
+            except Exception as e:
+                print(f"Attention backend '{name}' error: {e}. Continuing with fallback.")
+        raise NotImplementedError(f'No {kind} attention backend works for query shape {tuple(q.shape)}!')
+
+    backend = attention_autotuner.select(kind, candidates, q, *args)
+    return candidates[backend](q, *args)
+
+
+def chunked_feed_forward(ff, hidden_states, chunk_size=None):
+    # Every op in a feed-forward is per-token, so running it on sequence chunks gives the same output
+    # while only one chunk's 4x wide hidden activation is alive at a time.
+    if chunk_size is None or hidden_states.shape[1] <= chunk_size:
+        return ff(hidden_states)
+    return torch.cat([ff(chunk) for chunk in hidden_states.split(chunk_size, dim=1)], dim=1)
+
+
+def attn_varlen_func(q_o, k_o, v_o, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv, query_chunk_size=None):
     with torch.no_grad():
         q = q_o
         k = k_o
@@ -151,34 +250,17 @@ def attn_varlen_func(q_o, k_o, v_o, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, m
             k = k_o.to(args.target_precision)
             v = v_o.to(args.target_precision)
 
-        def process_chunk(q_chunk, k_chunk, v_chunk):
-            out = F.scaled_dot_product_attention(q_chunk.transpose(1, 2),
-                                                 k_chunk.transpose(1, 2),
-                                                 v_chunk.transpose(1, 2)).transpose(1, 2)
-            return out
-
         if cu_seqlens_q is None and cu_seqlens_kv is None and max_seqlen_q is None and max_seqlen_kv is None:
-            if sageattn is not None:
-                try:
-                    return sageattn(q, k, v, tensor_layout='NHD').to(q_o.dtype)
-                except Exception as e:
-                    print(
-                        f"SageAttention Error: {e}. Continuing with fallback.")
-
-            if flash_attn_func is not None:
-                try:
-                    return flash_attn_func(q, k, v).to(q_o.dtype)
-                except Exception as e:
-                    print(
-                        f"FlashAttention Error: {e}. Continuing with fallback.")
-
-            if xformers_attn_func is not None:
-                try:
-                    return xformers_attn_func(q, k, v).to(q_o.dtype)
-                except Exception as e:
-                    print(f"xFormers Error: {e}. Continuing with fallback.")
-
-            return process_chunk(q, k, v).to(q_o.dtype)
+            if query_chunk_size is not None and q.shape[1] > query_chunk_size:
+                # Each query row attends to the full key/value sequence, so chunking queries is exact
+                # and bounds the attention scores to (chunk, L) instead of (L, L).
+                x = torch.empty_like(q)
+                for start in range(0, q.shape[1], query_chunk_size):
+                    q_chunk = q[:, start:start + query_chunk_size]
+                    x[:, start:start + query_chunk_size] = _run_attn_backend('dense', dense_attn_backends, q_chunk, k, v)
+                return x.to(q_o.dtype)
+
+            return _run_attn_backend('dense', dense_attn_backends, q, k, v).to(q_o.dtype)
 
         B, L, H, C = q.shape
 
@@ -186,44 +268,14 @@ def attn_varlen_func(q_o, k_o, v_o, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, m
         k = k.flatten(0, 1)
         v = v.flatten(0, 1)
 
-        if sageattn_varlen is not None:
-            try:
-                x = sageattn_varlen(q, k, v, cu_seqlens_q,
-                                    cu_seqlens_kv, max_seqlen_q, max_seqlen_kv)
-                return x.unflatten(0, (B, L))
-            except Exception as e:
-                print(f"SageAttention Error: {e}. Continuing with fallback.")
-
-        if flash_attn_varlen_func is not None:
-            try:
-                x = flash_attn_varlen_func(
-                    q, k, v, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv)
-                return x.unflatten(0, (B, L))
-            except Exception as e:
-                print(f"FlashAttention Error: {e}. Continuing with fallback.")
-
-        if flash_attn_unpadded_func is not None:
-            try:
-                x = flash_attn_unpadded_func(
-                    q, k, v, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv, 0.0)
-                return x.unflatten(0, (B, L))
-            except Exception as e:
-                print(
-                    f"FlashAttention 1 Error: {e}. Continuing with fallback.")
-
-        if xformers_attn_func is not None:
-            print("Warning: Calling standard xformers attention for variable length sequence. This might be incorrect. Padding/unpadding or a dedicated varlen function might be needed.")
-
-            try:
-                x = xformers_attn_func(q, k, v)
-                return x.unflatten(0, (B, L))
-            except Exception as e:
-                print(f"xFormers Error: {e}. Continuing with fallback.")
-
-        raise NotImplementedError('No Attn Installed!')
+        x = _run_attn_backend('varlen', varlen_attn_backends, q, k, v, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv)
+        return x.unflatten(0, (B, L))
 
 
 class HunyuanAttnProcessorFlashAttnDouble:
+    def __init__(self):
+        self.query_chunk_size = None
+
     def __call__(self, attn, hidden_states, encoder_hidden_states, attention_mask, image_rotary_emb):
         cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv = attention_mask
 
@@ -257,7 +309,7 @@ class HunyuanAttnProcessorFlashAttnDouble:
         value = torch.cat([value, encoder_value], dim=1)
 
         hidden_states = attn_varlen_func(
-            query, key, value, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv)
+            query, key, value, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv, query_chunk_size=self.query_chunk_size)
         hidden_states = hidden_states.flatten(-2)
 
         txt_length = encoder_hidden_states.shape[1]
@@ -272,6 +324,9 @@ class HunyuanAttnProcessorFlashAttnDouble:
 
 
 class HunyuanAttnProcessorFlashAttnSingle:
+    def __init__(self):
+        self.query_chunk_size = None
+
     def __call__(self, attn, hidden_states, encoder_hidden_states, attention_mask, image_rotary_emb):
         cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv = attention_mask
 
@@ -297,7 +352,7 @@ class HunyuanAttnProcessorFlashAttnSingle:
             key[:, :-txt_length], image_rotary_emb), key[:, -txt_length:]], dim=1)
 
         hidden_states = attn_varlen_func(
-            query, key, value, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv)
+            query, key, value, cu_seqlens_q, cu_seqlens_kv, max_seqlen_q, max_seqlen_kv, query_chunk_size=self.query_chunk_size)
         hidden_states = hidden_states.flatten(-2)
 
         hidden_states, encoder_hidden_states = hidden_states[:,
@@ -671,6 +726,7 @@ class HunyuanVideoSingleTransformerBlock(nn.Module):
         self.proj_mlp = nn.Linear(hidden_size, mlp_dim)
         self.act_mlp = nn.GELU(approximate="tanh")
         self.proj_out = nn.Linear(hidden_size + mlp_dim, hidden_size)
+        self.ff_chunk_size = None
 
     def forward(
         self,
@@ -688,7 +744,7 @@ class HunyuanVideoSingleTransformerBlock(nn.Module):
 
         # 1. Input normalization
         norm_hidden_states, gate = self.norm(hidden_states, emb=temb)
-        mlp_hidden_states = self.act_mlp(self.proj_mlp(norm_hidden_states))
+        full_norm_hidden_states = norm_hidden_states
 
         norm_hidden_states, norm_encoder_hidden_states = (
             norm_hidden_states[:, :-text_seq_length, :],
@@ -704,9 +760,22 @@ class HunyuanVideoSingleTransformerBlock(nn.Module):
         )
         attn_output = torch.cat([attn_output, context_attn_output], dim=1)
 
-        # 3. Modulation and residual connection
-        hidden_states = torch.cat([attn_output, mlp_hidden_states], dim=2)
-        hidden_states = gate * self.proj_out(hidden_states)
+        # 3. MLP, modulation and residual connection
+        if self.ff_chunk_size is None:
+            mlp_hidden_states = self.act_mlp(self.proj_mlp(full_norm_hidden_states))
+            hidden_states = torch.cat([attn_output, mlp_hidden_states], dim=2)
+            hidden_states = gate * self.proj_out(hidden_states)
+        else:
+            # Same per-token math as above, but only one chunk of the 4x wide MLP activation is alive at a time
+            chunk_size = self.ff_chunk_size
+            hidden_states = torch.cat([
+                self.proj_out(torch.cat([
+                    attn_output[:, start:start + chunk_size],
+                    self.act_mlp(self.proj_mlp(full_norm_hidden_states[:, start:start + chunk_size])),
+                ], dim=2))
+                for start in range(0, full_norm_hidden_states.shape[1], chunk_size)
+            ], dim=1)
+            hidden_states = gate * hidden_states
         hidden_states = hidden_states + residual
 
         hidden_states, encoder_hidden_states = (
@@ -754,6 +823,7 @@ class HunyuanVideoTransformerBlock(nn.Module):
             hidden_size, elementwise_affine=False, eps=1e-6)
         self.ff_context = FeedForward(
             hidden_size, mult=mlp_ratio, activation_fn="gelu-approximate")
+        self.ff_chunk_size = None
 
     def forward(
         self,
@@ -789,8 +859,8 @@ class HunyuanVideoTransformerBlock(nn.Module):
             (1 + c_scale_mlp) + c_shift_mlp
 
         # 4. Feed-forward
-        ff_output = self.ff(norm_hidden_states)
-        context_ff_output = self.ff_context(norm_encoder_hidden_states)
+        ff_output = chunked_feed_forward(self.ff, norm_hidden_states, self.ff_chunk_size)
+        context_ff_output = chunked_feed_forward(self.ff_context, norm_encoder_hidden_states, self.ff_chunk_size)
 
         hidden_states = hidden_states + gate_mlp * ff_output
         encoder_hidden_states = encoder_hidden_states + c_gate_mlp * context_ff_output
@@ -920,6 +990,8 @@ class HunyuanVideoTransformer3DModelPacked(ModelMixin, ConfigMixin, PeftAdapterM
         self.use_gradient_checkpointing = False
         self.enable_teacache = False
         self.magcache: MagCache = None
+        self.ff_chunk_size = None
+        self.attn_chunk_size = None
 
         if has_image_proj:
             self.install_image_projection(image_proj_dim)
@@ -964,11 +1036,38 @@ class HunyuanVideoTransformer3DModelPacked(ModelMixin, ConfigMixin, PeftAdapterM
     def uninstall_magcache(self):
         self.magcache = None
 
-    def install_magcache(self, magcache: MagCache):
-        self.magcache = magcache
+    def enable_chunked_execution(self, ff_chunk_size, attn_chunk_size=None):
+        """
+        Runs the feed-forward (and optionally the attention queries) of every block in sequence chunks.
+        Outputs are the same as the unchunked path, only the activation peak is lower.
+        """
+        for block in list(self.transformer_blocks) + list(self.single_transformer_blocks):
+            block.ff_chunk_size = ff_chunk_size
+            block.attn.processor.query_chunk_size = attn_chunk_size
+        self.ff_chunk_size = ff_chunk_size
+        self.attn_chunk_size = attn_chunk_size
+        print(f'Chunked execution enabled: ff_chunk_size = {ff_chunk_size}, attn_chunk_size = {attn_chunk_size}')
+
+    def disable_chunked_execution(self):
+        for block in list(self.transformer_blocks) + list(self.single_transformer_blocks):
+            block.ff_chunk_size = None
+            block.attn.processor.query_chunk_size = None
+        self.ff_chunk_size = None
+        self.attn_chunk_size = None
+
+    def get_chunk_size_for_memory_budget(self, preserved_memory_gb, batch_size=1, budget_fraction=0.25, multiple=256):
+        """
+        Largest sequence chunk whose MLP activation fits in a fraction of the preserved GPU memory.
 
-    def uninstall_magcache(self):
-        self.magcache = None
+        The widest per-token activation is in the single stream blocks: proj_mlp output, its GELU and the
+        concat with the attention output that goes into proj_out.
+        """
+        mlp_dim = self.single_transformer_blocks[0].proj_mlp.out_features
+        element_size = self.single_transformer_blocks[0].proj_mlp.weight.element_size()
+        bytes_per_token = (2 * mlp_dim + self.inner_dim + mlp_dim) * element_size * batch_size
+        budget_bytes = preserved_memory_gb * budget_fraction * (1024 ** 3)
+        chunk_size = int(budget_bytes // bytes_per_token) // multiple * multiple
+        return max(multiple, chunk_size)
 
     def gradient_checkpointing_method(self, block, *args):
         if self.use_gradient_checkpointing:
@@ -0,0 +1,178 @@
+import os
+from abc import ABC, abstractmethod
+
+import torch
+import torch.nn as nn
+
+
+class LatentDecoder(ABC):
+    """
+    Turns HunyuanVideo latents (B, 16, T, H/8, W/8), already multiplied by the VAE scaling factor,
+    into pixels (B, 3, (T - 1) * 4 + 1, H, W) in [-1, 1].
+
+    `vae_decode` accepts a LatentDecoder wherever it accepts the full VAE, so the decoder used for
+    section outputs and previews can be swapped by configuration.
+    """
+
+    name = "decoder"
+    # Whether the decoder is heavy enough to be swapped on/off the GPU in low VRAM mode
+    requires_model_swap = False
+
+    @abstractmethod
+    def decode(self, latents):
+        pass
+
+
+class VAELatentDecoder(LatentDecoder):
+    """The full AutoencoderKLHunyuanVideo decoder."""
+
+    name = "vae"
+    requires_model_swap = True
+
+    def __init__(self, vae):
+        self.vae = vae
+
+    @torch.no_grad()
+    def decode(self, latents):
+        from diffusers_helper.hunyuan import vae_decode
+        return vae_decode(latents, self.vae)
+
+
+class ModuleLatentDecoder(LatentDecoder):
+    """
+    Wraps any latent -> pixel nn.Module that follows the LatentDecoder shape contract.
+    The module is kept on `device` and run in `dtype`; outputs are returned in the latent dtype.
+    """
+
+    name = "module"
+
+    def __init__(self, module, device=None, dtype=torch.float16, name=None):
+        self.module = module.eval().requires_grad_(False)
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.dtype = dtype if self.device.type == "cuda" else torch.float32
+        self.module.to(device=self.device, dtype=self.dtype)
+        if name is not None:
+            self.name = name
+
+    @torch.no_grad()
+    def decode(self, latents):
+        pixels = self.module(latents.to(device=self.device, dtype=self.dtype))
+        return pixels.to(dtype=latents.dtype)
+
+
+class TinyDecoderBlock(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        # Mixes each frame with its neighbours before the spatial convolutions
+        self.temporal = nn.Conv3d(channels, channels, kernel_size=(3, 1, 1), padding=(1, 0, 0))
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.act = nn.ReLU()
+
+    def forward(self, x, num_frames):
+        x = x + self.temporal(x.unflatten(0, (-1, num_frames)).transpose(1, 2)).transpose(1, 2).flatten(0, 1)
+        return x + self.conv2(self.act(self.conv1(self.act(x))))
+
+
+class TinyTemporalDecoder(nn.Module):
+    """
+    Small convolutional decoder trained to approximate the HunyuanVideo VAE decoder.
+
+    Each latent frame is upsampled 8x spatially and expanded into 4 pixel frames; the first latent
+    frame only produces a single pixel frame, matching the causal VAE frame count.
+    Weights are loaded from a safetensors file with `from_pretrained`.
+    """
+
+    def __init__(self, latent_channels=16, channels=(256, 128, 64, 64), out_channels=3, temporal_upscale=4):
+        super().__init__()
+        self.out_channels = out_channels
+        self.temporal_upscale = temporal_upscale
+
+        self.conv_in = nn.Conv2d(latent_channels, channels[0], 3, padding=1)
+        self.blocks = nn.ModuleList([TinyDecoderBlock(c) for c in channels])
+        self.upsamples = nn.ModuleList([
+            nn.Sequential(nn.Upsample(scale_factor=2, mode="nearest"), nn.Conv2d(channels[i], channels[i + 1], 3, padding=1))
+            for i in range(len(channels) - 1)
+        ])
+        self.conv_out = nn.Conv2d(channels[-1], out_channels * temporal_upscale, 3, padding=1)
+
+    def forward(self, latents):
+        B, C, T, H, W = latents.shape
+        x = latents.transpose(1, 2).flatten(0, 1)
+        x = self.conv_in(x)
+
+        for i, block in enumerate(self.blocks):
+            x = block(x, T)
+            if i < len(self.upsamples):
+                x = self.upsamples[i](x)
+
+        x = self.conv_out(torch.relu(x))
+        x = x.unflatten(1, (self.temporal_upscale, self.out_channels))
+        x = x.unflatten(0, (B, T)).flatten(1, 2)
+        x = x[:, self.temporal_upscale - 1:]
+        return torch.tanh(x).transpose(1, 2)
+
+    @classmethod
+    def from_pretrained(cls, path, **kwargs):
+        from safetensors.torch import load_file
+
+        model = cls(**kwargs)
+        model.load_state_dict(load_file(path))
+        return model
+
+
+class LinearLatentDecoder(LatentDecoder):
+    """
+    Zero-weight fallback: the per-channel linear latent -> RGB projection used for step previews,
+    upsampled to full resolution.
+    """
+
+    name = "linear"
+
+    @torch.no_grad()
+    def decode(self, latents):
+        from diffusers_helper.hunyuan import vae_decode_fake
+
+        pixels = vae_decode_fake(latents) * 2.0 - 1.0
+        first, rest = pixels[:, :, :1], pixels[:, :, 1:]
+        if rest.shape[2] > 0:
+            rest = rest.repeat_interleave(4, dim=2)
+            pixels = torch.cat([first, rest], dim=2)
+        return nn.functional.interpolate(pixels, scale_factor=(1, 8, 8), mode="nearest")
+
+
+_tiny_decoder_cache = {}
+
+
+def get_latent_decoder(kind, vae=None, tiny_decoder_path=None, device=None):
+    """
+    Returns the decoder selected by configuration.
+
+    Args:
+        kind: "vae", "tiny" or "linear"
+        vae: The full VAE, required for "vae"
+        tiny_decoder_path: Path to the TinyTemporalDecoder weights, required for "tiny"
+        device: Device the tiny decoder runs on
+
+    Returns:
+        A LatentDecoder
+    """
+    if kind == "vae":
+        return VAELatentDecoder(vae)
+
+    if kind == "linear":
+        return LinearLatentDecoder()
+
+    if kind == "tiny":
+        if not tiny_decoder_path or not os.path.exists(tiny_decoder_path):
+            print(f"Tiny decoder weights not found at '{tiny_decoder_path}', falling back to the linear preview decoder")
+            return LinearLatentDecoder()
+
+        key = (tiny_decoder_path, str(device))
+        if key not in _tiny_decoder_cache:
+            module = TinyTemporalDecoder.from_pretrained(tiny_decoder_path)
+            _tiny_decoder_cache[key] = ModuleLatentDecoder(module, device=device, name="tiny")
+            print(f"Loaded tiny decoder from {tiny_decoder_path}")
+        return _tiny_decoder_cache[key]
+
+    raise ValueError(f"Unknown latent decoder: {kind}")
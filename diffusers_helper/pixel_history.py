@@ -0,0 +1,127 @@
+import torch
+
+from diffusers_helper.utils import soft_append_bcthw, save_bthwc_uint8_as_mp4
+
+
+def bcthw_to_bthwc_uint8(x):
+    # Same rounding as save_bcthw_as_mp4, so finalizing early does not change the written video
+    x = torch.clamp(x.float(), -1., 1.) * 127.5 + 127.5
+    return x.to(torch.uint8).permute(0, 2, 3, 4, 1)
+
+
+class HistoryPixelStore:
+    """
+    Decoded history frames for the section loop.
+
+    Frames that can no longer be blended are kept as uint8 (B, T, H, W, C) in a preallocated buffer that
+    grows in chunks, towards the end for models that append sections (F1) or towards the start for models
+    that prepend them (Original). Only the `overlapped_frames` edge on the growing side stays in float, so
+    each section copies just the new frames instead of rebuilding the whole history with `torch.cat`.
+    """
+
+    def __init__(self, pixels, chunk_frames=256, capacity_frames=None):
+        self.chunk_frames = chunk_frames
+        self.capacity_frames = capacity_frames  # Size of the first buffer when the final length is known
+        self.edge = pixels.cpu()
+        self.direction = None
+
+        self.buffer = None
+        self.start = 0
+        self.end = 0
+
+    @property
+    def num_frames(self):
+        return (self.end - self.start) + self.edge.shape[2]
+
+    @property
+    def shape(self):
+        b, c, _, h, w = self.edge.shape
+        return torch.Size((b, c, self.num_frames, h, w))
+
+    def _set_direction(self, direction):
+        if self.direction is None:
+            self.direction = direction
+        assert self.direction == direction, f"History was grown with {self.direction}, cannot {direction}"
+
+    def _reserve(self, num_frames):
+        """Makes room for `num_frames` more frames on the growing side of the buffer."""
+        b, c, _, h, w = self.edge.shape
+
+        if self.buffer is None:
+            capacity = max(num_frames, self.capacity_frames or num_frames + self.chunk_frames)
+            self.buffer = torch.empty((b, capacity, h, w, c), dtype=torch.uint8)
+            self.start = self.end = 0 if self.direction == 'append' else capacity
+            return
+
+        capacity = self.buffer.shape[1]
+        if self.direction == 'append' and self.end + num_frames <= capacity:
+            return
+        if self.direction == 'prepend' and self.start - num_frames >= 0:
+            return
+
+        # Grow geometrically so the total copy volume stays linear in the video length
+        used = self.end - self.start
+        new_capacity = max(capacity * 2, used + num_frames + self.chunk_frames)
+        new_buffer = torch.empty((b, new_capacity, h, w, c), dtype=torch.uint8)
+        new_start = 0 if self.direction == 'append' else new_capacity - used
+        new_buffer[:, new_start:new_start + used] = self.buffer[:, self.start:self.end]
+        self.buffer = new_buffer
+        self.start = new_start
+        self.end = new_start + used
+
+    def _finalize(self, pixels):
+        n = pixels.shape[2]
+        if n == 0:
+            return
+        self._reserve(n)
+        if self.direction == 'append':
+            self.buffer[:, self.end:self.end + n] = bcthw_to_bthwc_uint8(pixels)
+            self.end += n
+        else:
+            self.buffer[:, self.start - n:self.start] = bcthw_to_bthwc_uint8(pixels)
+            self.start -= n
+
+    def append(self, current_pixels, overlapped_frames, keep_frames=None):
+        """
+        Equivalent to `soft_append_bcthw(history, current, overlapped_frames)`.
+        `keep_frames` is the float edge kept for the next blend, `overlapped_frames` by default.
+        """
+        self._set_direction('append')
+        blended = soft_append_bcthw(self.edge, current_pixels.cpu(), overlapped_frames)
+        keep = min(overlapped_frames if keep_frames is None else keep_frames, blended.shape[2])
+        self._finalize(blended[:, :, :blended.shape[2] - keep])
+        self.edge = blended[:, :, blended.shape[2] - keep:].clone()
+        return self
+
+    def prepend(self, current_pixels, overlapped_frames):
+        """Equivalent to `soft_append_bcthw(current, history, overlapped_frames)`."""
+        self._set_direction('prepend')
+        blended = soft_append_bcthw(current_pixels.cpu(), self.edge, overlapped_frames)
+        keep = min(overlapped_frames, blended.shape[2])
+        self._finalize(blended[:, :, keep:])
+        self.edge = blended[:, :, :keep].clone()
+        return self
+
+    def frames_uint8(self):
+        """
+        Returns the whole history as a uint8 (B, T, H, W, C) view into the buffer.
+        The float edge is quantized into the free space next to the finalized frames, nothing else is copied.
+        """
+        if self.buffer is None:
+            return bcthw_to_bthwc_uint8(self.edge).contiguous()
+
+        n = self.edge.shape[2]
+        self._reserve(n)
+        if self.direction == 'append':
+            self.buffer[:, self.end:self.end + n] = bcthw_to_bthwc_uint8(self.edge)
+            return self.buffer[:, self.start:self.end + n]
+
+        self.buffer[:, self.start - n:self.start] = bcthw_to_bthwc_uint8(self.edge)
+        return self.buffer[:, self.start - n:self.end]
+
+    def to_bcthw(self):
+        """Materializes the history as a float (B, C, T, H, W) tensor in [-1, 1]."""
+        return self.frames_uint8().permute(0, 4, 1, 2, 3).float() / 127.5 - 1.0
+
+    def save_mp4(self, output_filename, fps=30, crf=0):
+        return save_bthwc_uint8_as_mp4(self.frames_uint8(), output_filename, fps=fps, crf=crf)
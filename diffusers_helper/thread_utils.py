@@ -1,76 +1,148 @@
-import time
+import asyncio
 
-from threading import Thread, Lock
+from collections import deque
+from threading import Thread, Lock, Condition
 
 
 class Listener:
-    task_queue = []
+    task_queue = deque()
     lock = Lock()
+    has_tasks = Condition(lock)
     thread = None
-    
+
     @classmethod
     def _process_tasks(cls):
         while True:
-            task = None
-            with cls.lock:
-                if cls.task_queue:
-                    task = cls.task_queue.pop(0)
-                    
-            if task is None:
-                time.sleep(0.001)
-                continue
-                
+            with cls.has_tasks:
+                # Sleeps until a task is added instead of polling
+                cls.has_tasks.wait_for(lambda: cls.task_queue)
+                task = cls.task_queue.popleft()
+
             func, args, kwargs = task
             try:
                 func(*args, **kwargs)
             except Exception as e:
                 print(f"Error in listener thread: {e}")
-    
+
     @classmethod
     def add_task(cls, func, *args, **kwargs):
-        with cls.lock:
+        with cls.has_tasks:
             cls.task_queue.append((func, args, kwargs))
+            cls.has_tasks.notify()
 
-        if cls.thread is None:
-            cls.thread = Thread(target=cls._process_tasks, daemon=True)
-            cls.thread.start()
+            if cls.thread is None:
+                cls.thread = Thread(target=cls._process_tasks, daemon=True)
+                cls.thread.start()
 
 
 def async_run(func, *args, **kwargs):
     Listener.add_task(func, *args, **kwargs)
 
 
+def _get_flag(item):
+    return item[0] if isinstance(item, tuple) and item else item
+
+
 class FIFOQueue:
-    def __init__(self):
-        self.queue = []
+    """
+    Thread-safe FIFO queue with blocking waits.
+
+    Items whose flag (the first element of a tuple item, or the item itself) is in `coalesce_flags` are
+    latest-value: pushing one while an item with the same flag is the newest pending entry replaces it,
+    so a slow consumer only ever sees the most recent progress. Every other item is lossless.
+
+    With `maxsize`, pushing a lossless item into a full queue blocks until there is room (or `timeout`
+    expires), while a coalescible item that cannot replace a pending one is dropped.
+    """
+
+    def __init__(self, maxsize=None, coalesce_flags=()):
+        # Entries are one item lists so a coalesced push can replace the item in place
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.coalesce_flags = set(coalesce_flags)
+        self.dropped = 0
+
         self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.async_waiters = []
 
-    def push(self, item):
+    def push(self, item, timeout=None):
         with self.lock:
-            self.queue.append(item)
+            if _get_flag(item) in self.coalesce_flags:
+                if self.queue and _get_flag(self.queue[-1][0]) == _get_flag(item):
+                    self.queue[-1][0] = item
+                    return True
+                if self.maxsize is not None and len(self.queue) >= self.maxsize:
+                    self.dropped += 1
+                    return False
+            elif self.maxsize is not None:
+                if not self.not_full.wait_for(lambda: len(self.queue) < self.maxsize, timeout=timeout):
+                    raise TimeoutError(f"Queue is full ({self.maxsize} items)")
+
+            self.queue.append([item])
+            self.not_empty.notify()
+            self._wake_async_waiters()
+            return True
+
+    def _wake_async_waiters(self):
+        for loop, future in self.async_waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+        self.async_waiters.clear()
+
+    def _pop_locked(self):
+        item = self.queue.popleft()[0]
+        self.not_full.notify()
+        return item
 
     def pop(self):
         with self.lock:
             if self.queue:
-                return self.queue.pop(0)
+                return self._pop_locked()
             return None
 
     def top(self):
         with self.lock:
             if self.queue:
-                return self.queue[0]
+                return self.queue[0][0]
             return None
 
-    def next(self):
+    def next(self, timeout=None):
+        """Blocks until an item is available. Raises IndexError if `timeout` expires first."""
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: self.queue, timeout=timeout):
+                raise IndexError("No item available")
+            return self._pop_locked()
+
+    async def async_next(self, timeout=None):
+        """asyncio version of `next`, waits without blocking the event loop or an executor thread."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
         while True:
             with self.lock:
                 if self.queue:
-                    return self.queue.pop(0)
+                    return self._pop_locked()
+                future = loop.create_future()
+                self.async_waiters.append((loop, future))
 
-            time.sleep(0.001)
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise IndexError("No item available")
+            try:
+                await asyncio.wait_for(future, timeout=remaining)
+            except asyncio.TimeoutError:
+                with self.lock:
+                    if (loop, future) in self.async_waiters:
+                        self.async_waiters.remove((loop, future))
+                raise IndexError("No item available")
 
 
 class AsyncStream:
-    def __init__(self):
+    def __init__(self, maxsize=256):
         self.input_queue = FIFOQueue()
-        self.output_queue = FIFOQueue()
+        # Progress previews are coalesced, file/end/error events are never dropped
+        self.output_queue = FIFOQueue(maxsize=maxsize, coalesce_flags=('progress',))
+        # Mirror of the processed output events for observers such as the serverless handler.
+        # Unbounded so an absent observer never blocks the job queue, only file/end events accumulate.
+        self.event_queue = FIFOQueue(coalesce_flags=('progress',))
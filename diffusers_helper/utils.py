@@ -280,6 +280,22 @@ def save_bcthw_as_mp4(x, output_filename, fps=10, crf=0):
     return x
 
 
+def save_bthwc_uint8_as_mp4(x, output_filename, fps=10, crf=0):
+    b, t, h, w, c = x.shape
+
+    per_row = b
+    for p in [6, 5, 4, 3, 2]:
+        if b % p == 0:
+            per_row = p
+            break
+
+    os.makedirs(os.path.dirname(os.path.abspath(os.path.realpath(output_filename))), exist_ok=True)
+    # A single video is written straight from the given view without copying
+    x = x[0] if b == 1 else einops.rearrange(x, '(m n) t h w c -> t (m h) (n w) c', n=per_row)
+    torchvision.io.write_video(output_filename, x, fps=fps, video_codec='libx264', options={'crf': str(int(crf))})
+    return x
+
+
 def save_bcthw_as_png(x, output_filename):
     os.makedirs(os.path.dirname(os.path.abspath(os.path.realpath(output_filename))), exist_ok=True)
     x = torch.clamp(x.float(), -1., 1.) * 127.5 + 127.5
@@ -0,0 +1,320 @@
+"""
+The generation engine: models, job queue and worker wiring, without the Gradio UI.
+
+studio.py builds the UI on top of this module, serverless.py imports it directly so a serverless
+worker does not pay for importing Gradio, the interface, the toolbox and the XY plot.
+"""
+from diffusers_helper.hf_login import login
+
+import os
+import sys
+import shutil
+from pathlib import PurePath
+import numpy as np
+import torch
+
+os.environ['TOKENIZERS_PARALLELISM'] = 'false'  # Prevent tokenizers parallelism warning
+
+from transformers import LlamaTokenizerFast, CLIPTokenizer
+from transformers import SiglipImageProcessor
+from diffusers_helper.utils import generate_timestamp
+from diffusers_helper.memory import gpu, get_worker_devices, get_cuda_free_memory_gb, DynamicSwapInstaller
+from diffusers_helper.thread_utils import AsyncStream
+
+from modules.video_queue import VideoJobQueue, JobStatus
+from modules.device_pool import DeviceContext, DevicePool
+from modules.model_loader import ModelLoader
+from modules.weight_snapshot import load_component
+from modules.worker_process import get_worker_mode, is_worker_process, ProcessWorkerSupervisor, run_in_worker_process
+from modules.settings import Settings
+from modules import DUMMY_LORA_NAME # Import the constant
+from modules.pipelines.worker import worker
+
+# Global cache for prompt embeddings
+prompt_embedding_cache = {}
+
+# Initialize settings
+settings = Settings()
+
+
+def load_device_models(device):
+    """
+    Starts loading the text encoders, VAE and image encoder for a worker device, configured for its free memory.
+
+    The components load concurrently in the background. The returned DeviceContext holds LazyModel
+    handles, each one waits for its component when it is first read, so a job can start encoding its
+    prompts while the VAE and image encoder are still loading.
+    """
+    free_mem_gb = get_cuda_free_memory_gb(device)
+    high_vram = free_mem_gb > 60
+
+    print(f'Free VRAM on {device}: {free_mem_gb} GB')
+    print(f'High-VRAM Mode on {device}: {high_vram}')
+
+    def configure(model, resident=True):
+        model.eval()
+        model.requires_grad_(False)
+        if high_vram and resident:
+            model.to(device)
+        return model
+
+    # Components baked with `python -m modules.weight_snapshot bake` are memory mapped from their snapshot,
+    # the others load with from_pretrained in their runtime dtype (half precision, as stored) and low_cpu_mem_usage
+    def load_text_encoder():
+        text_encoder = configure(load_component("text_encoder"))
+        if not high_vram:
+            # DynamicSwapInstaller is same as huggingface's enable_sequential_offload but 3x faster
+            DynamicSwapInstaller.install_model(text_encoder, device=device)
+        return text_encoder
+
+    def load_vae():
+        vae = configure(load_component("vae"))
+        if not high_vram:
+            vae.enable_slicing()
+            vae.enable_tiling()
+        return vae
+
+    loader = ModelLoader(label=f"{device} models")
+    text_encoder = loader.submit("text_encoder", load_text_encoder)
+    text_encoder_2 = loader.submit("text_encoder_2", lambda: configure(load_component("text_encoder_2")))
+    tokenizer = loader.submit("tokenizer", lambda: LlamaTokenizerFast.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='tokenizer'))
+    tokenizer_2 = loader.submit("tokenizer_2", lambda: CLIPTokenizer.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='tokenizer_2'))
+    vae = loader.submit("vae", load_vae)
+    feature_extractor = loader.submit("feature_extractor", lambda: SiglipImageProcessor.from_pretrained("lllyasviel/flux_redux_bfl", subfolder='feature_extractor'))
+    image_encoder = loader.submit("image_encoder", lambda: configure(load_component("image_encoder")))
+    loader.close()
+
+    return DeviceContext(
+        device, text_encoder, text_encoder_2, tokenizer, tokenizer_2, vae, image_encoder, feature_extractor,
+        high_vram=high_vram, prompt_embedding_cache=prompt_embedding_cache
+    )
+
+
+# In process mode the models only live in the worker processes
+load_models_in_process = get_worker_mode() != "process" or is_worker_process()
+
+if load_models_in_process:
+    # The primary device keeps its models in primary_device_context, used by the UI and LoRA loading.
+    # They load in the background, reading one of them waits for it.
+    primary_device_context = load_device_models(gpu)
+    primary_device_context.generator_owner = sys.modules[__name__]
+    high_vram = primary_device_context.high_vram
+else:
+    primary_device_context = None
+    high_vram = False
+
+# Initialize model generator placeholder
+current_generator = None # Will hold the currently active model generator
+
+
+def create_device_context(device):
+    if device == gpu:
+        return primary_device_context
+    return load_device_models(device)
+
+
+# One job worker per device (FRAMEPACK_DEVICES), additional devices load their models on their first job.
+# In process mode each device gets a supervised worker process instead, started right away.
+if load_models_in_process:
+    device_pool = DevicePool(get_worker_devices(), create_device_context)
+else:
+    device_pool = DevicePool(get_worker_devices(), ProcessWorkerSupervisor)
+    for worker_device in device_pool.devices:
+        device_pool.get(worker_device)
+
+# Initialize LoRA support
+lora_names = []
+lora_values = [] # This seems unused for population, might be related to weights later
+
+# Nothing consumes this stream in serverless mode, unbounded so the worker's pushes never block on it
+stream = AsyncStream(maxsize=None)
+
+# --- Populate LoRA names AFTER settings are loaded ---
+lora_folder_from_settings: str = settings.get("lora_dir") # Use setting, fallback to default
+lora_dir = lora_folder_from_settings
+print(f"Scanning for LoRAs in: {lora_folder_from_settings}")
+if os.path.isdir(lora_folder_from_settings):
+    try:
+        for root, _, files in os.walk(lora_folder_from_settings):
+            for file in files:
+                if file.endswith('.safetensors') or file.endswith('.pt'):
+                    lora_relative_path = os.path.relpath(os.path.join(root, file), lora_folder_from_settings)
+                    lora_name = str(PurePath(lora_relative_path).with_suffix(''))
+                    lora_names.append(lora_name)
+        print(f"Found LoRAs: {lora_names}")
+        # Temp solution for only 1 lora
+        if len(lora_names) == 1:
+            lora_names.append(DUMMY_LORA_NAME)
+    except Exception as e:
+        print(f"Error scanning LoRA directory '{lora_folder_from_settings}': {e}")
+else:
+    print(f"LoRA directory not found: {lora_folder_from_settings}")
+# --- End LoRA population ---
+
+# Create job queue
+job_queue = VideoJobQueue()
+
+# Set the worker function for the job queue - using the imported worker from modules/pipelines/worker.py
+# Worker processes receive their jobs from the supervisor in the main process
+if not is_worker_process():
+    job_queue.set_worker_function(worker if load_models_in_process else run_in_worker_process, device_pool=device_pool)
+
+
+def process(
+        model_type,
+        input_image,
+        end_frame_image,     # NEW
+        end_frame_strength,  # NEW        
+        prompt_text,
+        n_prompt,
+        seed, 
+        total_second_length, 
+        latent_window_size, 
+        steps, 
+        cfg, 
+        gs, 
+        rs, 
+        use_teacache, 
+        teacache_num_steps, 
+        teacache_rel_l1_thresh,
+        use_magcache,
+        magcache_threshold,
+        magcache_max_consecutive_skips,
+        magcache_retention_ratio,
+        blend_sections, 
+        latent_type,
+        clean_up_videos,
+        selected_loras,
+        resolutionW,
+        resolutionH,
+        input_image_path,
+        combine_with_source,
+        num_cleaned_frames,
+        *lora_args,
+        save_metadata_checked=True,  # NEW: Parameter to control metadata saving
+    ):
+    """Adds a generation job to the queue and returns its id"""
+       
+    # Create a blank black image if no 
+    # Create a default image based on the selected latent_type
+    has_input_image = True
+    if input_image is None:
+        has_input_image = False
+        default_height, default_width = resolutionH, resolutionW
+        if latent_type == "White":
+            # Create a white image
+            input_image = np.ones((default_height, default_width, 3), dtype=np.uint8) * 255
+            print("No input image provided. Using a blank white image.")
+
+        elif latent_type == "Noise":
+            # Create a noise image
+            input_image = np.random.randint(0, 256, (default_height, default_width, 3), dtype=np.uint8)
+            print("No input image provided. Using a random noise image.")
+
+        elif latent_type == "Green Screen":
+            # Create a green screen image with standard chroma key green (0, 177, 64)
+            input_image = np.zeros((default_height, default_width, 3), dtype=np.uint8)
+            input_image[:, :, 1] = 177  # Green channel
+            input_image[:, :, 2] = 64   # Blue channel
+            # Red channel remains 0
+            print("No input image provided. Using a standard chroma key green screen.")
+
+        else:  # Default to "Black" or any other value
+            # Create a black image
+            input_image = np.zeros((default_height, default_width, 3), dtype=np.uint8)
+            print(f"No input image provided. Using a blank black image (latent_type: {latent_type}).")
+
+    
+    # Handle input files - copy to input_files_dir to prevent them from being deleted by temp cleanup
+    input_files_dir = settings.get("input_files_dir")
+    os.makedirs(input_files_dir, exist_ok=True)
+    
+    # Process input image (if it's a file path)
+    input_image_path = None
+    if isinstance(input_image, str) and os.path.exists(input_image):
+        # It's a file path, copy it to input_files_dir
+        filename = os.path.basename(input_image)
+        input_image_path = os.path.join(input_files_dir, f"{generate_timestamp()}_{filename}")
+        try:
+            shutil.copy2(input_image, input_image_path)
+            print(f"Copied input image to {input_image_path}")
+            # For Video model, we'll use the path
+            if model_type == "Video":
+                input_image = input_image_path
+        except Exception as e:
+            print(f"Error copying input image: {e}")
+    
+    # Process end frame image (if it's a file path)
+    end_frame_image_path = None
+    if isinstance(end_frame_image, str) and os.path.exists(end_frame_image):
+        # It's a file path, copy it to input_files_dir
+        filename = os.path.basename(end_frame_image)
+        end_frame_image_path = os.path.join(input_files_dir, f"{generate_timestamp()}_{filename}")
+        try:
+            shutil.copy2(end_frame_image, end_frame_image_path)
+            print(f"Copied end frame image to {end_frame_image_path}")
+        except Exception as e:
+            print(f"Error copying end frame image: {e}")
+    
+    # Extract lora_loaded_names from lora_args
+    lora_loaded_names = lora_args[0] if lora_args and len(lora_args) > 0 else []
+    lora_values = lora_args[1:] if lora_args and len(lora_args) > 1 else []
+    
+    # Create job parameters
+    job_params = {
+        'model_type': model_type,
+        'input_image': input_image.copy() if hasattr(input_image, 'copy') else input_image,  # Handle both image arrays and video paths
+        'end_frame_image': end_frame_image.copy() if end_frame_image is not None else None,
+        'end_frame_strength': end_frame_strength,        
+        'prompt_text': prompt_text,
+        'n_prompt': n_prompt,
+        'seed': seed,
+        'total_second_length': total_second_length,
+        'latent_window_size': latent_window_size,
+        'latent_type': latent_type,
+        'steps': steps,
+        'cfg': cfg,
+        'gs': gs,
+        'rs': rs,
+        'blend_sections': blend_sections,
+        'use_teacache': use_teacache,
+        'teacache_num_steps': teacache_num_steps,
+        'teacache_rel_l1_thresh': teacache_rel_l1_thresh,
+        'use_magcache': use_magcache,
+        'magcache_threshold': magcache_threshold,
+        'magcache_max_consecutive_skips': magcache_max_consecutive_skips,
+        'magcache_retention_ratio': magcache_retention_ratio,
+        'selected_loras': selected_loras,
+        'has_input_image': has_input_image,
+        'output_dir': settings.get("output_dir"),
+        'metadata_dir': settings.get("metadata_dir"),
+        'input_files_dir': input_files_dir,  # Add input_files_dir to job parameters
+        'input_image_path': input_image_path,  # Add the path to the copied input image
+        'end_frame_image_path': end_frame_image_path,  # Add the path to the copied end frame image
+        'resolutionW': resolutionW, # Add resolution parameter
+        'resolutionH': resolutionH,
+        'lora_loaded_names': lora_loaded_names,
+        'combine_with_source': combine_with_source,  # Add combine_with_source parameter
+        'num_cleaned_frames': num_cleaned_frames,
+        'save_metadata_checked': save_metadata_checked,  # NEW: Add save_metadata_checked parameter
+    }
+    
+    # Print teacache parameters for debugging
+    print(f"Teacache parameters: use_teacache={use_teacache}, teacache_num_steps={teacache_num_steps}, teacache_rel_l1_thresh={teacache_rel_l1_thresh}")
+    
+    # Add LoRA values if provided - extract them from the tuple
+    if lora_values:
+        # Convert tuple to list
+        lora_values_list = list(lora_values)
+        job_params['lora_values'] = lora_values_list
+    
+    # Add job to queue
+    job_id = job_queue.add_job(job_params)
+    
+    # Set the generation_type attribute on the job object directly
+    job = job_queue.get_job(job_id)
+    if job:
+        job.generation_type = model_type  # Set generation_type to model_type for display in queue
+    print(f"Added job {job_id} to queue")
+    
+    return job_id
@@ -35,6 +35,8 @@ class JobInputModel(BaseModel):
     name: str
     source: str
     weight: Optional[float] = 1.0
+    # Expected sha256 of the file, verified after download when given
+    sha256: Optional[str] = None
     
 class JobInput(BaseModel):
     image_url: str
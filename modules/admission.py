@@ -0,0 +1,281 @@
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+from diffusers_helper.bucket_tools import find_nearest_bucket
+
+
+GB = 1024 ** 3
+
+# Size of the weights in half precision
+MODULE_SIZES_GB = {
+    "transformer": 25.6,
+    "text_encoder": 15.0,
+    "text_encoder_2": 0.25,
+    "image_encoder": 0.8,
+    "vae": 0.5,
+}
+LORA_SIZE_GB = 0.35
+
+# Transformer geometry, see HunyuanVideoTransformer3DModelPacked
+INNER_DIM = 3072
+MLP_DIM = 4 * INNER_DIM
+ELEMENT_SIZE = 2
+TEXT_TOKENS = 512  # Prompts are cropped or padded to 512 tokens
+
+# Per token bytes of the widest MLP activation (proj_mlp output, GELU and the concat into proj_out),
+# and of what stays alive across a block (residual stream, attention q/k/v and output, modulation)
+MLP_BYTES_PER_TOKEN = (2 * MLP_DIM + INNER_DIM + MLP_DIM) * ELEMENT_SIZE
+BLOCK_BYTES_PER_TOKEN = 8 * INNER_DIM * ELEMENT_SIZE
+
+# The HunyuanVideo VAE decoder peaks on its 128 channel full resolution layers, with a few live copies
+VAE_DECODE_BYTES_PER_PIXEL = 128 * ELEMENT_SIZE * 4
+# Tiled decode (enabled in low VRAM mode) works on 256x256 pixel, 64 frame tiles
+VAE_TILE_PIXELS = 256 * 256 * 64
+
+# Kept free for the CUDA context, the allocator and the DynamicSwap working set
+DEVICE_OVERHEAD_GB = 1.5
+HOST_OVERHEAD_GB = 4.0
+# Fractions of the device / host memory a job may plan to use
+DEVICE_HEADROOM = 0.95
+HOST_HEADROOM = 0.9
+
+# Fraction of the preserved memory given to MLP chunks, same as get_chunk_size_for_memory_budget
+CHUNK_BUDGET_FRACTION = 0.25
+
+
+class JobRejectedError(ValueError):
+    """Raised when a job cannot run on its device whatever the memory configuration"""
+
+
+@dataclass
+class MemoryEstimate:
+    device_gb: float
+    host_gb: float
+    breakdown: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class AdmissionDecision:
+    action: str  # "accept", "adjust" or "reject"
+    plan: Dict[str, Any]
+    estimate: MemoryEstimate
+    reason: str = ""
+    warning: str = ""
+
+
+def get_admission_mode():
+    """"adjust" picks a safe configuration when needed, "strict" rejects instead, "off" admits every job"""
+    return os.environ.get("FRAMEPACK_ADMISSION", "adjust").lower()
+
+
+def get_job_bucket(params):
+    """(height, width) the job will be generated at, same rounding as the pipelines"""
+    resolution_w = int(params.get('resolutionW', 640) or 640)
+    resolution_h = int(params.get('resolutionH', 640) or 640)
+    input_image = params.get('input_image')
+    shape = getattr(input_image, 'shape', None)
+    if shape is not None and len(shape) >= 2:
+        return find_nearest_bucket(shape[0], shape[1], resolution=resolution_w)
+    return find_nearest_bucket(resolution_h, resolution_w, (resolution_w + resolution_h) / 2)
+
+
+def get_activation_key(height, width, latent_window_size, chunked=False):
+    """Key of the activation peaks recorded by the worker, see diffusers_helper.memory.record_activation_peak"""
+    return f"{width}x{height}@{latent_window_size}" + ("/chunked" if chunked else "")
+
+
+def count_sampling_tokens(height, width, latent_window_size):
+    """Transformer sequence length of one section: the window, the 1x clean latents and the packed 2x / 4x history"""
+    tokens_per_frame = (height // 16) * (width // 16)
+    full_frames = latent_window_size + 1 + 2
+    # 2 latent frames packed 2x in time and space, 16 frames packed 4x
+    packed_frames = 2 / 8 + 16 / 64
+    return int(tokens_per_frame * (full_frames + packed_frames)) + TEXT_TOKENS
+
+
+def get_chunk_tokens(preserved_memory_gb, multiple=256):
+    chunk = int(preserved_memory_gb * CHUNK_BUDGET_FRACTION * GB // MLP_BYTES_PER_TOKEN) // multiple * multiple
+    return max(multiple, chunk)
+
+
+def estimate_activation_gb(tokens, chunked=False, preserved_memory_gb=6.0, cache_mode="none"):
+    mlp_tokens = min(tokens, get_chunk_tokens(preserved_memory_gb)) if chunked else tokens
+    activation = tokens * BLOCK_BYTES_PER_TOKEN + mlp_tokens * MLP_BYTES_PER_TOKEN
+    if cache_mode != "none":
+        # TeaCache / MagCache keep the residual of the previous step
+        activation += 2 * tokens * INNER_DIM * ELEMENT_SIZE
+    return activation / GB
+
+
+def estimate_decode_gb(latent_frames, height, width, tiled=False):
+    pixel_frames = max(latent_frames * 4 - 3, 1)
+    pixels = pixel_frames * height * width
+    if tiled:
+        pixels = min(pixels, VAE_TILE_PIXELS)
+    return pixels * VAE_DECODE_BYTES_PER_PIXEL / GB
+
+
+def estimate_job_memory(params, plan, high_vram, device_memory_gb, preserved_memory_gb=6.0,
+                        lora_sizes_gb=None, observed_activation_gb=None, mapped_modules=()):
+    """
+    Estimates the peak device and host memory of a job.
+
+    Args:
+        params: The job parameters
+        plan: Memory configuration, see default_memory_plan
+        high_vram: Whether the worker keeps every model on the device
+        device_memory_gb: Total memory of the device
+        preserved_memory_gb: Memory kept free when the transformer is swapped in
+        lora_sizes_gb: Sizes of the selected LoRAs, LORA_SIZE_GB each when unknown
+        observed_activation_gb: Dict of activation key -> peak recorded for earlier jobs, see get_activation_key
+        mapped_modules: Names of the MODULE_SIZES_GB modules memory mapped from a weight snapshot
+
+    Returns:
+        MemoryEstimate with the peak and the per phase breakdown
+    """
+    height, width = get_job_bucket(params)
+    latent_window_size = int(params.get('latent_window_size', 9) or 9)
+    total_second_length = float(params.get('total_second_length', 6) or 6)
+
+    selected_loras = params.get('selected_loras') or []
+    if not isinstance(selected_loras, (list, tuple)):
+        selected_loras = [selected_loras]
+    lora_gb = sum(lora_sizes_gb) if lora_sizes_gb is not None else LORA_SIZE_GB * len([lora for lora in selected_loras if str(lora).strip()])
+
+    if params.get('use_magcache'):
+        cache_mode = "magcache"
+    elif params.get('use_teacache'):
+        cache_mode = "teacache"
+    else:
+        cache_mode = "none"
+
+    tokens = count_sampling_tokens(height, width, latent_window_size)
+    chunked = bool(plan.get('chunked_execution'))
+    activation_gb = estimate_activation_gb(tokens, chunked, preserved_memory_gb, cache_mode)
+    observed = (observed_activation_gb or {}).get(get_activation_key(height, width, latent_window_size, chunked))
+    if observed:
+        # A measured peak replaces the analytic one, with a margin for allocator fragmentation
+        activation_gb = observed * 1.1
+
+    sizes = MODULE_SIZES_GB
+    if high_vram:
+        resident_gb = sum(sizes.values()) + lora_gb
+    else:
+        # The transformer is swapped in until only the preserved memory is left
+        transformer_gb = min(sizes["transformer"], max(device_memory_gb - preserved_memory_gb, 0.0))
+        resident_gb = transformer_gb + lora_gb
+    sampling_gb = resident_gb + activation_gb + DEVICE_OVERHEAD_GB
+
+    # Sections are decoded with window * 2 + 1 latent frames, the final video in chunks
+    tiled = not high_vram
+    section_decode_gb = 0.0
+    if not plan.get('deferred_decode'):
+        section_decode_gb = estimate_decode_gb(latent_window_size * 2 + 1, height, width, tiled)
+    final_decode_gb = estimate_decode_gb(plan.get('decode_chunk_latent_frames') or latent_window_size * 2, height, width, tiled)
+    decode_resident_gb = (sum(sizes.values()) + lora_gb) if high_vram else sizes["vae"]
+    decode_gb = decode_resident_gb + max(section_decode_gb, final_decode_gb) + DEVICE_OVERHEAD_GB
+
+    # In high VRAM mode the models only pass through host memory while loading. Offloaded models stay in host
+    # memory, except those mapped from a snapshot: their pages are clean page cache the kernel can reclaim.
+    if high_vram:
+        host_models_gb = 0.0
+    else:
+        host_models_gb = sum(size for name, size in sizes.items() if name not in mapped_modules) + lora_gb
+
+    # The uint8 history, and the float window of the final decode before it is quantized into it
+    total_frames = int(total_second_length * 30) + 4 * latent_window_size
+    history_gb = total_frames * height * width * 3 / GB
+    final_window_frames = max((plan.get('decode_chunk_latent_frames') or latent_window_size * 2) * 4 - 3, 1)
+    final_buffer_gb = final_window_frames * height * width * 3 * 4 / GB
+    host_gb = host_models_gb + history_gb + final_buffer_gb + HOST_OVERHEAD_GB
+
+    return MemoryEstimate(
+        device_gb=max(sampling_gb, decode_gb),
+        host_gb=host_gb,
+        breakdown={
+            "activation": activation_gb,
+            "sampling": sampling_gb,
+            "decode": decode_gb,
+            "host_models": host_models_gb,
+            "host_history": history_gb + final_buffer_gb,
+        },
+    )
+
+
+def default_memory_plan(settings, latent_window_size=9):
+    """The memory configuration a job runs with when admission does not change anything"""
+    return {
+        "chunked_execution": bool(settings.get("chunked_execution", False)),
+        "chunked_attention": bool(settings.get("chunked_attention", False)),
+        "deferred_decode": bool(settings.get("deferred_decode", False)),
+        "decode_chunk_latent_frames": latent_window_size * 2,
+    }
+
+
+def _candidate_plans(plan):
+    """Progressively safer configurations, each one keeps the previous changes"""
+    plan = dict(plan)
+    if not plan["chunked_execution"]:
+        plan.update(chunked_execution=True, chunked_attention=True)
+        yield dict(plan)
+    if not plan["deferred_decode"]:
+        plan.update(deferred_decode=True)
+        yield dict(plan)
+    chunk = plan["decode_chunk_latent_frames"]
+    while chunk > 2:
+        chunk = max(chunk // 2, 2)
+        plan.update(decode_chunk_latent_frames=chunk)
+        yield dict(plan)
+
+
+def admit_job(params, plan, high_vram, device_memory_gb, host_memory_gb, preserved_memory_gb=6.0,
+              lora_sizes_gb=None, observed_activation_gb=None, mode="adjust", device_name="device",
+              mapped_modules=()):
+    """
+    Decides whether a job fits on a device before it starts.
+
+    The job is accepted with the requested plan when it fits. Otherwise, in "adjust" mode, chunked
+    execution, deferred decoding and smaller final decode chunks are enabled one after the other until it
+    fits. Jobs that do not fit in any configuration are rejected.
+
+    The host estimate is rougher (swap, page cache, other processes), a job over it only gets a warning
+    unless the mode is "strict".
+
+    Returns:
+        AdmissionDecision
+    """
+    def estimate(candidate):
+        return estimate_job_memory(params, candidate, high_vram, device_memory_gb, preserved_memory_gb,
+                                   lora_sizes_gb, observed_activation_gb, mapped_modules)
+
+    def fits(result):
+        return result.device_gb <= device_memory_gb * DEVICE_HEADROOM
+
+    requested = estimate(plan)
+    if mode == "off":
+        return AdmissionDecision("accept", plan, requested)
+
+    warning = ""
+    if requested.host_gb > host_memory_gb * HOST_HEADROOM:
+        message = f"Job needs about {requested.host_gb:.1f} GB of host memory, {host_memory_gb:.1f} GB available"
+        if mode == "strict":
+            return AdmissionDecision("reject", plan, requested, f"{message}. Reduce the video length or the resolution.")
+        warning = f"{message}, it may swap or run out of memory."
+
+    if fits(requested):
+        return AdmissionDecision("accept", plan, requested, warning=warning)
+
+    if mode == "adjust":
+        for candidate in _candidate_plans(plan):
+            result = estimate(candidate)
+            if fits(result):
+                changes = ", ".join(f"{key}={value}" for key, value in candidate.items() if plan.get(key) != value)
+                return AdmissionDecision("adjust", candidate, result, f"Adjusted memory configuration to fit {device_name}: {changes}", warning)
+
+    height, width = get_job_bucket(params)
+    return AdmissionDecision("reject", plan, requested, (
+        f"Job needs about {requested.device_gb:.1f} GB on {device_name}, {device_memory_gb:.1f} GB available "
+        f"({width}x{height}, window {params.get('latent_window_size', 9)}, "
+        f"activations {requested.breakdown['activation']:.1f} GB). Reduce the resolution or the latent window size."
+    ))
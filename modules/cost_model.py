@@ -0,0 +1,269 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from utils.paths import get_local_dir
+
+
+# Stages whose duration grows with the number of sections, the others are a per job overhead
+PER_SECTION_STAGES = {"sampling", "decode", "save"}
+
+# Samples per (signature, stage) used to fit the predictor
+MAX_SAMPLES = 50
+
+
+def get_default_cost_model_path():
+    """FRAMEPACK_COST_MODEL_PATH, on the node's local disk by default since WAL does not work on network filesystems"""
+    return os.environ.get("FRAMEPACK_COST_MODEL_PATH", os.path.join(get_local_dir(), "cost_model.db"))
+
+
+def get_total_latent_sections(params):
+    """Same section count as the worker"""
+    total_second_length = float(params.get('total_second_length', 6) or 6)
+    latent_window_size = int(params.get('latent_window_size', 9) or 9)
+    return int(max(round((total_second_length * 30) / (latent_window_size * 4)), 1))
+
+
+def get_job_signature(params):
+    """
+    The job properties that determine its cost, apart from its length.
+
+    Returns:
+        dict with model type, resolution bucket, steps, window size, cache mode and LoRA count
+    """
+    if params.get('use_magcache'):
+        cache_mode = "magcache"
+    elif params.get('use_teacache'):
+        cache_mode = "teacache"
+    else:
+        cache_mode = "none"
+
+    selected_loras = params.get('selected_loras') or []
+    if not isinstance(selected_loras, (list, tuple)):
+        selected_loras = [selected_loras]
+    from modules import DUMMY_LORA_NAME
+    lora_count = len([lora for lora in selected_loras if lora != DUMMY_LORA_NAME])
+
+    # The size the job is generated at, which also depends on the aspect ratio of the input image
+    from modules.admission import get_job_bucket
+    height, width = get_job_bucket(params)
+
+    return {
+        "model_type": params.get('model_type', 'Original') or 'Original',
+        "bucket": f"{width}x{height}",
+        "steps": int(params.get('steps', 25) or 25),
+        "latent_window_size": int(params.get('latent_window_size', 9) or 9),
+        "cache_mode": cache_mode,
+        "lora_count": lora_count,
+    }
+
+
+def signature_key(signature):
+    return json.dumps(signature, sort_keys=True)
+
+
+class StageTimer:
+    """Accumulates wall time per named stage, `start` ends the stage that was running"""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.current = None
+        self.started_at = None
+
+    def start(self, stage):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.durations[self.current] += now - self.started_at
+        self.current = stage
+        self.started_at = now
+
+    def stop(self):
+        self.start(None)
+        self.current = None
+        return dict(self.durations)
+
+
+def _fit_line(samples):
+    """Least squares fit of seconds = a + b * sections. Returns (a, b) or None when x does not vary."""
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x == 0:
+        return None
+    b = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+    a = mean_y - b * mean_x
+    if a < 0 or b < 0:
+        return None
+    return a, b
+
+
+class CostModel:
+    """
+    Predicts job runtimes from the stage timings of past jobs.
+
+    Every finished job records how long each stage took (model load, preprocessing, encoding, sampling,
+    decoding, saving and, on serverless, uploading) together with its signature, see get_job_signature.
+    A stage is predicted as `a + b * sections`, fitted on the recent samples of the same signature. When
+    a signature has no history yet, samples of the same model type and bucket are used, with sampling
+    scaled by the step count, and then samples of any job.
+
+    Timings are stored in SQLite next to the job store, so predictions improve across restarts. Only the
+    last MAX_SAMPLES timings per signature and stage are kept.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_default_cost_model_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stage_timings (
+                signature TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                sections INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS stage_timings_signature ON stage_timings (signature, stage)")
+        # Only the most recent samples are used, databases written before the trim on insert are trimmed once here
+        self.conn.execute(
+            """
+            DELETE FROM stage_timings WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (PARTITION BY signature, stage ORDER BY recorded_at DESC) AS n
+                    FROM stage_timings
+                ) WHERE n > ?
+            )
+            """,
+            (MAX_SAMPLES,),
+        )
+        self.conn.commit()
+
+        # signature key -> stage -> [(sections, seconds)], most recent last
+        self.samples = defaultdict(lambda: defaultdict(list))
+        rows = self.conn.execute("SELECT signature, stage, sections, seconds FROM stage_timings ORDER BY recorded_at").fetchall()
+        for key, stage, sections, seconds in rows:
+            self._add_sample(key, stage, sections, seconds)
+        self.predictions = {}
+        self.listeners = []  # Called without arguments after new timings are recorded
+
+    def _add_sample(self, key, stage, sections, seconds):
+        samples = self.samples[key][stage]
+        samples.append((sections, seconds))
+        if len(samples) > MAX_SAMPLES:
+            del samples[0]
+
+    def record(self, params, stage_durations):
+        """
+        Records the stage timings of a finished job.
+
+        Args:
+            params: The job parameters
+            stage_durations: Dict of stage name -> seconds
+        """
+        key = signature_key(get_job_signature(params))
+        sections = get_total_latent_sections(params)
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO stage_timings (signature, stage, sections, seconds, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, stage, sections, seconds, now) for stage, seconds in stage_durations.items()],
+            )
+            # Keep MAX_SAMPLES rows per (signature, stage) like the samples in memory
+            self.conn.executemany(
+                """
+                DELETE FROM stage_timings WHERE signature = ? AND stage = ? AND rowid NOT IN (
+                    SELECT rowid FROM stage_timings WHERE signature = ? AND stage = ? ORDER BY recorded_at DESC LIMIT ?
+                )
+                """,
+                [(key, stage, key, stage, MAX_SAMPLES) for stage in stage_durations],
+            )
+            self.conn.commit()
+            for stage, seconds in stage_durations.items():
+                self._add_sample(key, stage, sections, seconds)
+            self.predictions.clear()
+            listeners = list(self.listeners)
+        print(f"Recorded stage timings for {key}: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stage_durations.items()))
+
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error refreshing predictions after recording timings: {e}")
+
+    def add_listener(self, listener):
+        """Calls `listener()` after each record, e.g. to refresh the predicted costs of queued jobs"""
+        with self.lock:
+            self.listeners.append(listener)
+
+    def _predict_stage(self, samples, stage, sections):
+        fit = _fit_line(samples)
+        if fit is not None:
+            a, b = fit
+            return a + b * sections
+        if stage in PER_SECTION_STAGES:
+            return sum(seconds / max(x, 1) for x, seconds in samples) / len(samples) * sections
+        return sum(seconds for _, seconds in samples) / len(samples)
+
+    def _fallback_samples(self, signature, stage):
+        """Samples of similar jobs when the signature has none, sampling times scaled to the step count"""
+        similar, others = [], []
+        for key, stages in self.samples.items():
+            other = json.loads(key)
+            scale = signature["steps"] / max(other["steps"], 1) if stage == "sampling" else 1.0
+            scaled = [(x, seconds * scale) for x, seconds in stages.get(stage, [])]
+            if other["model_type"] == signature["model_type"] and other["bucket"] == signature["bucket"]:
+                similar.extend(scaled)
+            else:
+                others.extend(scaled)
+        return similar or others
+
+    def predict_stages(self, params):
+        """Predicted seconds per stage, empty when nothing has been recorded yet"""
+        signature = get_job_signature(params)
+        key = signature_key(signature)
+        sections = get_total_latent_sections(params)
+
+        with self.lock:
+            if (key, sections) in self.predictions:
+                return self.predictions[(key, sections)]
+
+            stages = set(self.samples.get(key, {}).keys())
+            for other in self.samples.values():
+                stages.update(other.keys())
+
+            prediction = {}
+            for stage in stages:
+                samples = self.samples.get(key, {}).get(stage) or self._fallback_samples(signature, stage)
+                if samples:
+                    prediction[stage] = self._predict_stage(samples, stage, sections)
+            self.predictions[(key, sections)] = prediction
+            return prediction
+
+    def predict_runtime(self, params):
+        """Predicted total seconds for a job, or None when nothing has been recorded yet"""
+        prediction = self.predict_stages(params)
+        if not prediction:
+            return None
+        return sum(prediction.values())
+
+
+_cost_model = None
+_cost_model_lock = threading.Lock()
+
+
+def get_cost_model():
+    global _cost_model
+    with _cost_model_lock:
+        if _cost_model is None:
+            _cost_model = CostModel()
+        return _cost_model
@@ -0,0 +1,114 @@
+import threading
+
+import torch
+
+from modules.model_loader import LazyModel, resolve_model
+
+
+def _model_property(name):
+    """Attribute holding a model or a LazyModel, reading it waits for the model to be loaded"""
+    def getter(self):
+        return resolve_model(self._models[name])
+    return property(getter)
+
+
+class DeviceContext:
+    """
+    Models and state owned by the job worker of one device.
+
+    Each worker gets its own text encoders, VAE, image encoder and model generator, so workers on
+    different devices never move each other's models. The memory ledger of `load_model_as_complete`
+    is kept per device as well. The prompt embedding cache only holds CPU tensors and is shared.
+
+    The models may be LazyModel handles still loading in the background, they are waited for when
+    they are first read.
+    """
+
+    MODEL_NAMES = ("text_encoder", "text_encoder_2", "tokenizer", "tokenizer_2", "vae", "image_encoder", "feature_extractor")
+
+    text_encoder = _model_property("text_encoder")
+    text_encoder_2 = _model_property("text_encoder_2")
+    tokenizer = _model_property("tokenizer")
+    tokenizer_2 = _model_property("tokenizer_2")
+    vae = _model_property("vae")
+    image_encoder = _model_property("image_encoder")
+    feature_extractor = _model_property("feature_extractor")
+
+    def __init__(self, device, text_encoder, text_encoder_2, tokenizer, tokenizer_2, vae, image_encoder,
+                 feature_extractor, high_vram=False, prompt_embedding_cache=None, generator_owner=None):
+        """
+        Args:
+            device: The torch device the worker runs on
+            generator_owner: Optional object whose `current_generator` attribute holds the generator,
+                used for the primary device so code reading `engine.current_generator` keeps working
+        """
+        self.device = torch.device(device)
+        self._models = {
+            "text_encoder": text_encoder,
+            "text_encoder_2": text_encoder_2,
+            "tokenizer": tokenizer,
+            "tokenizer_2": tokenizer_2,
+            "vae": vae,
+            "image_encoder": image_encoder,
+            "feature_extractor": feature_extractor,
+        }
+        self.high_vram = high_vram
+        self.prompt_embedding_cache = prompt_embedding_cache if prompt_embedding_cache is not None else {}
+        # Held while the text encoders or the image encoder run and the prompt embedding cache is written,
+        # the job prefetcher encodes the next job with the same modules while this one runs
+        self.encoder_lock = threading.RLock()
+        self.generator_owner = generator_owner
+        self._current_generator = None
+
+    @property
+    def name(self):
+        return str(self.device)
+
+    def loaded_models(self):
+        """The torch modules already loaded, without waiting for the others"""
+        models = []
+        for name in ("text_encoder", "text_encoder_2", "image_encoder", "vae"):
+            value = self._models[name]
+            if isinstance(value, LazyModel):
+                if not value.is_loaded():
+                    continue
+                value = value.get()
+            if value is not None:
+                models.append(value)
+        return models
+
+    @property
+    def current_generator(self):
+        if self.generator_owner is not None:
+            return getattr(self.generator_owner, 'current_generator', None)
+        return self._current_generator
+
+    @current_generator.setter
+    def current_generator(self, generator):
+        if self.generator_owner is not None:
+            setattr(self.generator_owner, 'current_generator', generator)
+        else:
+            self._current_generator = generator
+
+
+class DevicePool:
+    """
+    The devices the job queue runs workers on, and their DeviceContext.
+
+    Contexts are created on first use by `context_factory(device)`, from the worker thread of that
+    device, so additional devices only load their models once they receive a job.
+    """
+
+    def __init__(self, devices, context_factory):
+        self.devices = [torch.device(device) for device in devices]
+        self.context_factory = context_factory
+        self.contexts = {}
+        self.locks = {device: threading.Lock() for device in self.devices}
+
+    def get(self, device):
+        device = torch.device(device)
+        with self.locks[device]:
+            if device not in self.contexts:
+                print(f"Creating worker context for {device}")
+                self.contexts[device] = self.context_factory(device)
+            return self.contexts[device]
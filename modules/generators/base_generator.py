@@ -1,8 +1,8 @@
 import torch
 import os # required for os.path
 from abc import ABC, abstractmethod
-from diffusers_helper import lora_utils
-from typing import List, Optional
+from diffusers_helper import lora_utils, lora_fusion
+from typing import Any, Dict, List, Optional
 from pathlib import Path
 
 class BaseModelGenerator(ABC):
@@ -22,7 +22,8 @@ class BaseModelGenerator(ABC):
                  high_vram=False,
                  prompt_embedding_cache=None,
                  settings=None,
-                 offline=False): # NEW: offline flag
+                 offline=False, # NEW: offline flag
+                 device=None):
         """
         Initialize the base model generator.
         
@@ -38,6 +39,7 @@ class BaseModelGenerator(ABC):
             prompt_embedding_cache: Cache for prompt embeddings
             settings: Application settings
             offline: Whether to run in offline mode for model loading
+            device: Device the transformer runs on, defaults to the current CUDA device (or the CPU)
         """
         self.text_encoder = text_encoder
         self.text_encoder_2 = text_encoder_2
@@ -51,7 +53,10 @@ class BaseModelGenerator(ABC):
         self.settings = settings
         self.offline = offline 
         self.transformer = None
-        self.gpu = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if device is not None:
+            self.gpu = torch.device(device)
+        else:
+            self.gpu = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.cpu = torch.device("cpu")
 
             
@@ -63,6 +68,24 @@ class BaseModelGenerator(ABC):
         """
         pass
     
+    def adopt_transformer(self, previous_generator):
+        """
+        Reuse the transformer of the generator of the previous job when it is the same model.
+        Its LoRA adapters are kept too, load_loras only applies what changed.
+
+        Returns:
+            True if the transformer was adopted, False if load_model must be called.
+        """
+        if previous_generator is None or previous_generator.transformer is None:
+            return False
+        if getattr(previous_generator, 'model_path', None) != getattr(self, 'model_path', None) or previous_generator.offline != self.offline:
+            return False
+        if previous_generator.high_vram != self.high_vram or previous_generator.gpu != self.gpu:
+            return False
+        self.transformer = previous_generator.transformer
+        print(f"Reusing the {self.get_model_name()} transformer of the previous job")
+        return True
+
     @abstractmethod
     def get_model_name(self):
         """
@@ -134,7 +157,10 @@ class BaseModelGenerator(ABC):
         """
         if self.transformer is not None:
             print(f"Unloading all LoRAs from {self.get_model_name()} model")
+            lora_fusion.unfuse_loras(self.transformer)
             self.transformer = lora_utils.unload_all_loras(self.transformer)
+            self.transformer.lora_digests = {}
+            self.transformer.lora_weights = None
             self.verify_lora_state("After unloading LoRAs")
             import gc
             gc.collect()
@@ -179,6 +205,8 @@ class BaseModelGenerator(ABC):
         """
         if self.transformer is None:
             return
+        if lora_fusion.get_fused_key(self.transformer) is not None:
+            return  # The adapters are merged into the weights and not used
             
         print(f"Moving all LoRA adapters to {target_device}")
         
@@ -222,33 +250,40 @@ class BaseModelGenerator(ABC):
         
         print(f"Moved all LoRA adapters to {target_device}")
     
-    def load_loras(self, selected_loras: List[str], lora_folder: str, lora_loaded_names: List[str], lora_values: Optional[List[float]] = None):
+    def load_loras(self, selected_loras: List[str], lora_folder: str, lora_loaded_names: List[str], lora_values: Optional[List[float]] = None, lora_state_dicts: Optional[Dict[str, Any]] = None):
         """
         Load LoRAs into the transformer model and applies their weights.
+
+        Only the difference with the adapters already loaded is applied: adapters that are no longer
+        selected (or whose file changed) are deleted, missing ones are loaded from the LoRA cache, and
+        the weights are only set again when they differ. The transformer keeps its adapters between jobs.
+
+        With the fuse_loras setting, the weighted adapters are then merged into the base weights, so the
+        sampling steps cost the same as without LoRAs. The original weights are restored before the
+        adapters change again.
         
         Args:
             selected_loras: List of LoRA base names to load (e.g., ["lora_A", "lora_B"]).
             lora_folder: Path to the folder containing the LoRA files.
             lora_loaded_names: The master list of ALL available LoRA names, used for correct weight indexing.
             lora_values: A list of strength values corresponding to lora_loaded_names.
+            lora_state_dicts: State dicts already read by the job prefetcher, keyed by LoRA file name.
         """
-        self.unload_loras()
+        from modules.lora_cache import get_lora_cache
 
-        if not selected_loras:
-            print("No LoRAs selected, skipping loading.")
+        if self.transformer is None:
             return
 
-        lora_dir = Path(lora_folder)
+        lora_cache = get_lora_cache()
+        lora_dir = Path(lora_folder) if lora_folder else None
 
-        adapter_names = []
-        strengths = []
-
-        for idx, lora_base_name in enumerate(selected_loras):
+        # adapter name -> (file name, file digest, weight)
+        requested = {}
+        for lora_base_name in (selected_loras or []):
             lora_file = None
             for ext in (".safetensors", ".pt"):
                 candidate_path_relative = f"{lora_base_name}{ext}"
-                candidate_path_full = lora_dir / candidate_path_relative
-                if candidate_path_full.is_file():
+                if lora_dir is not None and (lora_dir / candidate_path_relative).is_file():
                     lora_file = candidate_path_relative
                     break
             
@@ -256,11 +291,6 @@ class BaseModelGenerator(ABC):
                 print(f"Warning: LoRA file for base name '{lora_base_name}' not found; skipping.")
                 continue
 
-            print(f"Loading LoRA from '{lora_file}'...")
-            
-            self.transformer, adapter_name = lora_utils.load_lora(self.transformer, lora_dir, lora_file)
-            adapter_names.append(adapter_name)
-
             weight = 1.0
             if lora_values:
                 try:
@@ -271,11 +301,55 @@ class BaseModelGenerator(ABC):
                         print(f"Warning: Index mismatch for '{lora_base_name}'. Defaulting to 1.0.")
                 except ValueError:
                     print(f"Warning: LoRA '{lora_base_name}' not found in master list. Defaulting to 1.0.")
-            
-            strengths.append(weight)
-        
-        if adapter_names:
+
+            digest = lora_cache.file_digest(lora_dir / lora_file)
+            requested[lora_utils.get_adapter_name(lora_file)] = (lora_file, digest, weight)
+
+        fuse = bool(self.settings.get("fuse_loras", False)) if self.settings is not None else False
+        fusion_key = tuple((digest, weight) for _, digest, weight in requested.values())
+        if lora_fusion.get_fused_key(self.transformer) not in (None, fusion_key if fuse else None):
+            # PEFT cannot change merged adapters, put the original weights back first
+            lora_fusion.unfuse_loras(self.transformer)
+
+        # Adapters loaded by an earlier call, adapters loaded any other way are treated as stale
+        loaded_digests = getattr(self.transformer, 'lora_digests', {})
+        existing = list(self.transformer.peft_config.keys()) if getattr(self.transformer, 'peft_config', None) else []
+        stale = [name for name in existing if name not in requested or loaded_digests.get(name) != requested[name][1]]
+        if stale:
+            print(f"Deleting LoRA adapters no longer selected: {stale}")
+            self.transformer.delete_adapters(stale)
+            import gc
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        loaded_digests = {name: digest for name, digest in loaded_digests.items() if name in existing and name not in stale}
+
+        for adapter_name, (lora_file, digest, weight) in requested.items():
+            if adapter_name in loaded_digests:
+                continue
+            print(f"Loading LoRA from '{lora_file}'...")
+            _, state_dict = lora_cache.load(lora_dir, lora_file, state_dict=(lora_state_dicts or {}).get(lora_file))
+            # load_lora_adapter consumes the dict it is given, keep the cached one intact
+            self.transformer, _ = lora_utils.load_lora(self.transformer, lora_dir, lora_file, state_dict=dict(state_dict))
+            loaded_digests[adapter_name] = digest
+        self.transformer.lora_digests = loaded_digests
+
+        adapter_names = list(requested.keys())
+        strengths = [weight for _, _, weight in requested.values()]
+        active = dict(zip(adapter_names, strengths))
+        if not adapter_names:
+            print("No LoRAs selected, skipping loading.")
+        elif active == getattr(self.transformer, 'lora_weights', None) and not stale:
+            print(f"Adapters {adapter_names} already active with strengths {strengths}")
+        else:
             print(f"Activating adapters: {adapter_names} with strengths: {strengths}")
             lora_utils.set_adapters(self.transformer, adapter_names, strengths)
+        self.transformer.lora_weights = active
+
+        if fuse and adapter_names:
+            try:
+                lora_fusion.fuse_loras(self.transformer, adapter_names, fusion_key, self.gpu, lora_fusion.get_delta_cache())
+            except Exception as e:
+                print(f"Warning: could not fuse LoRAs, running them as adapters: {e}")
 
-        self.verify_lora_state("After completing load_loras")
\ No newline at end of file
+        self.verify_lora_state("After completing load_loras")
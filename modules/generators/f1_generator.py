@@ -2,6 +2,7 @@ import torch
 import os # for offline loading path
 from diffusers_helper.models.hunyuan_video_packed import HunyuanVideoTransformer3DModelPacked
 from diffusers_helper.memory import DynamicSwapInstaller
+from modules.weight_snapshot import load_snapshot, transformer_component
 from .base_generator import BaseModelGenerator
 
 class F1ModelGenerator(BaseModelGenerator):
@@ -36,11 +37,13 @@ class F1ModelGenerator(BaseModelGenerator):
         if self.offline:
             path_to_load = self._get_offline_load_path() # Calls the method in BaseModelGenerator
 
-        # Create the transformer model
-        self.transformer = HunyuanVideoTransformer3DModelPacked.from_pretrained(
-            path_to_load, 
-            torch_dtype=torch.bfloat16
-        ).cpu()
+        # Create the transformer model, memory mapped from its baked snapshot if there is one
+        self.transformer = load_snapshot(transformer_component(self.model_path))
+        if self.transformer is None:
+            self.transformer = HunyuanVideoTransformer3DModelPacked.from_pretrained(
+                path_to_load, 
+                torch_dtype=torch.bfloat16
+            ).cpu()
         
         # Configure the model
         self.transformer.eval()
@@ -171,21 +174,29 @@ class F1ModelGenerator(BaseModelGenerator):
         # For F1, we take frames from the end
         return history_latents[:, :, -total_generated_latent_frames:, :, :]
     
+    def appends_sections(self):
+        """
+        Whether new sections are added at the end of the history rather than at the start.
+        
+        Returns:
+            True for the F1 model
+        """
+        return True
+    
     def update_history_pixels(self, history_pixels, current_pixels, overlapped_frames):
         """
         Update the history pixels with the current pixels for the F1 model.
         
         Args:
-            history_pixels: The history pixels
+            history_pixels: The HistoryPixelStore holding the history pixels
             current_pixels: The current pixels
             overlapped_frames: The number of overlapped frames
             
         Returns:
             The updated history pixels
         """
-        from diffusers_helper.utils import soft_append_bcthw
         # For F1 model, history_pixels is first, current_pixels is second
-        return soft_append_bcthw(history_pixels, current_pixels, overlapped_frames)
+        return history_pixels.append(current_pixels, overlapped_frames)
     
     def get_section_latent_frames(self, latent_window_size, is_last_section):
         """
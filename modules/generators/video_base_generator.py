@@ -9,6 +9,7 @@ from PIL import Image
 
 from diffusers_helper.models.hunyuan_video_packed import HunyuanVideoTransformer3DModelPacked
 from diffusers_helper.memory import DynamicSwapInstaller
+from modules.weight_snapshot import load_snapshot, transformer_component
 from diffusers_helper.utils import resize_and_center_crop
 from diffusers_helper.bucket_tools import find_nearest_bucket
 from diffusers_helper.hunyuan import vae_encode, vae_decode
@@ -62,11 +63,13 @@ class VideoBaseModelGenerator(BaseModelGenerator):
         if self.offline:
             path_to_load = self._get_offline_load_path() # Calls the method in BaseModelGenerator
         
-        # Create the transformer model
-        self.transformer = HunyuanVideoTransformer3DModelPacked.from_pretrained(
-            path_to_load, 
-            torch_dtype=torch.bfloat16
-        ).cpu()
+        # Create the transformer model, memory mapped from its baked snapshot if there is one
+        self.transformer = load_snapshot(transformer_component(self.model_path))
+        if self.transformer is None:
+            self.transformer = HunyuanVideoTransformer3DModelPacked.from_pretrained(
+                path_to_load, 
+                torch_dtype=torch.bfloat16
+            ).cpu()
         
         # Configure the model
         self.transformer.eval()
@@ -302,11 +305,12 @@ class VideoBaseModelGenerator(BaseModelGenerator):
         try:
             if device is None:
                 device = self.gpu
+            device = torch.device(device)
                 
             # Check CUDA availability and fallback to CPU if needed
-            if device == "cuda" and not torch.cuda.is_available():
+            if device.type == "cuda" and not torch.cuda.is_available():
                 print("CUDA is not available, falling back to CPU")
-                device = "cpu"
+                device = self.cpu
 
             # Save first frame for CLIP vision encoding
             input_image_np = input_frames_resized_np[0]
@@ -344,16 +348,16 @@ class VideoBaseModelGenerator(BaseModelGenerator):
                     batch = frames_pt[:, :, i:i + vae_batch_size]  # Shape: (1, channels, batch_size, height, width)
                     try:
                         # Log GPU memory before encoding
-                        if device == "cuda":
-                            free_mem = torch.cuda.memory_allocated() / 1024**3
+                        if device.type == "cuda":
+                            free_mem = torch.cuda.memory_allocated(device) / 1024**3
                         batch_latent = vae_encode(batch, self.vae)
                         # Synchronize CUDA to catch issues
-                        if device == "cuda":
-                            torch.cuda.synchronize()
+                        if device.type == "cuda":
+                            torch.cuda.synchronize(device)
                         latents.append(batch_latent)
                     except RuntimeError as e:
                         print(f"Error during VAE encoding: {str(e)}")
-                        if device == "cuda" and "out of memory" in str(e).lower():
+                        if device.type == "cuda" and "out of memory" in str(e).lower():
                             print("CUDA out of memory, try reducing vae_batch_size or using CPU")
                         raise
             
@@ -376,7 +380,7 @@ class VideoBaseModelGenerator(BaseModelGenerator):
                 print("======================================================")
 
             # Move VAE back to CPU to free GPU memory
-            if device == "cuda":
+            if device.type == "cuda":
                 self.vae.to(self.cpu)
                 torch.cuda.empty_cache()
                 print("VAE moved back to CPU, CUDA cache cleared")
@@ -488,7 +492,7 @@ class VideoBaseModelGenerator(BaseModelGenerator):
             
             # Import settings from main module
             try:
-                from studio import settings
+                from engine import settings
                 video_processor = VideoProcessor(message_manager, settings.settings)
             except ImportError:
                 # Fallback to creating a new settings object
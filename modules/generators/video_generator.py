@@ -186,22 +186,30 @@ class VideoModelGenerator(VideoBaseModelGenerator):
         # Generated frames at the front.
         return history_latents[:, :, :total_generated_latent_frames, :, :]
     
+    def appends_sections(self):
+        """
+        Whether new sections are added at the end of the history rather than at the start.
+        
+        Returns:
+            False for the Video model
+        """
+        return False
+    
     def update_history_pixels(self, history_pixels, current_pixels, overlapped_frames):
         """
         Update the history pixels with the current pixels for the Video model.
         
         Args:
-            history_pixels: The history pixels
+            history_pixels: The HistoryPixelStore holding the history pixels
             current_pixels: The current pixels
             overlapped_frames: The number of overlapped frames
             
         Returns:
             The updated history pixels
         """
-        from diffusers_helper.utils import soft_append_bcthw
         # For Video model, we prepend the current pixels to the history pixels
         # This matches the original implementation in video-example.py
-        return soft_append_bcthw(current_pixels, history_pixels, overlapped_frames)
+        return history_pixels.prepend(current_pixels, overlapped_frames)
     
     def get_current_pixels(self, real_history_latents, section_latent_frames, vae):
         """
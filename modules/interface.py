@@ -25,8 +25,6 @@ from diffusers_helper.utils import generate_timestamp
 
 from modules.video_queue import JobStatus, Job, JobType
 from modules.prompt_handler import get_section_boundaries, get_quick_prompts, parse_timestamped_prompt
-from modules.llm_enhancer import enhance_prompt
-from modules.llm_captioner import caption_image
 from diffusers_helper.gradio.progress_bar import make_progress_bar_css, make_progress_bar_html
 from diffusers_helper.bucket_tools import find_nearest_bucket
 from modules.pipelines.metadata_utils import create_metadata
@@ -727,7 +725,7 @@ def create_interface(
                             - **Refresh Queue**: Update the job list.
                             - **Cancel Queue**: Stop all pending jobs.
                             - **Clear Complete**: Remove finished, failed, or cancelled jobs from the list.
-                            - **Load Queue**: Load jobs from the default `queue.json`.
+                            - **Load Queue**: Restore the pending jobs saved in the job store.
                             - **Export Queue**: Save the current job list and its images to a zip file.
                             - **Import Queue**: Load a queue from a `.json` or `.zip` file.
                             """)
@@ -758,11 +756,11 @@ def create_interface(
                                 traceback.print_exc()
                                 return [], ""
 
-                        # Function to load queue from queue.json
+                        # Function to restore the pending jobs from the job store
                         def load_queue_from_json():
                             try:
                                 loaded_count = job_queue.load_queue_from_json()
-                                print(f"Loaded {loaded_count} jobs from queue.json")
+                                print(f"Restored {loaded_count} jobs from the job store")
                                 return update_stats()
                             except Exception as e:
                                 import traceback
@@ -2371,6 +2369,7 @@ def create_interface(
             if not current_prompt_text:
                 return ""
             print("UI: Enhance button clicked. Sending prompt to enhancer.")
+            from modules.llm_enhancer import enhance_prompt  # Imported on first use, it is only needed here
             enhanced_text = enhance_prompt(current_prompt_text)
             print(f"UI: Received enhanced prompt: {enhanced_text}")
             return gr.update(value=enhanced_text)
@@ -2386,6 +2385,7 @@ def create_interface(
             """Calls the LLM enhancer and returns the updated text."""
             if input_image is None:
                 return prompt  # Return current prompt if no image is provided
+            from modules.llm_captioner import caption_image  # Imported on first use, it is only needed here
             caption_text = caption_image(input_image)
             print(f"UI: Received caption: {caption_text}")
             return gr.update(value=caption_text)
@@ -2450,15 +2450,16 @@ def update_queue_status_with_thumbnails(): # Function name is now slightly misle
     # For now, let's assume it's globally accessible as defined in studio.py
     # If not, this needs adjustment based on how job_queue is managed.
     try:
-        # Need access to the global job_queue instance from studio.py
+        # Need access to the global job_queue instance from the engine
         # This might require restructuring or passing job_queue differently.
         # For now, assuming it's accessible (this might fail if run standalone)
-        from studio import job_queue # Attempt to import from main script scope
+        from engine import job_queue
 
         jobs = job_queue.get_all_jobs()
+        positions = job_queue.get_queue_positions()
         for job in jobs:
             if job.status == JobStatus.PENDING:
-                job.queue_position = job_queue.get_queue_position(job.id)
+                job.queue_position = job_queue.get_queue_position(job.id, positions)
 
         if job_queue.current_job:
             job_queue.current_job.status = JobStatus.RUNNING
@@ -0,0 +1,225 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from modules import DUMMY_LORA_NAME
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def find_lora_file(lora_dir, lora_base_name):
+    """File name of a LoRA in lora_dir, same lookup as BaseModelGenerator.load_loras"""
+    for ext in (".safetensors", ".pt"):
+        if (Path(lora_dir) / f"{lora_base_name}{ext}").is_file():
+            return f"{lora_base_name}{ext}"
+    return None
+
+
+class JobPrefetcher:
+    """
+    Prepares the inputs of the next job while the current one is sampling.
+
+    The CPU bound preparation runs on a background thread: input image resize and crop, and reading and
+    converting the LoRA files. When the device keeps its encoders resident (high VRAM mode), the prompts
+    are encoded into the shared prompt embedding cache and the input image is encoded with SigLIP too.
+    These encodings hold the encoder lock of the device, which the worker also takes around its own
+    encoder use, so the shared modules and cache are never used by both at once. Models that would have
+    to be swapped in are left alone, so the running job keeps the device memory.
+
+    The prepared state is kept on the CPU, its total size is capped by max_bytes. Whatever does not fit is
+    left to the worker, which prepares it as usual.
+    """
+
+    def __init__(self, max_bytes, settings=None, wait_timeout=None):
+        """
+        Args:
+            max_bytes: Memory cap of the prepared state
+            settings: Used for the LoRA folder
+            wait_timeout: Seconds take() waits for a preparation still running, FRAMEPACK_PREFETCH_WAIT_SECONDS
+        """
+        self.max_bytes = max_bytes
+        self.settings = settings
+        self.wait_timeout = get_prefetch_wait_timeout() if wait_timeout is None else wait_timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-prefetch")
+        self.futures = {}
+        self.cancelled = {}  # job_id -> Event set once the preparation is no longer wanted
+        self.prepared = {}
+        self.lock = threading.Lock()
+
+    def used_bytes(self):
+        with self.lock:
+            return sum(_nbytes(prepared) for prepared in self.prepared.values())
+
+    def prefetch(self, job_id, params, device_context=None):
+        """Schedules the preparation of a job, does nothing if it is already prepared or being prepared"""
+        with self.lock:
+            if job_id in self.futures or job_id in self.prepared:
+                return
+            self.cancelled[job_id] = threading.Event()
+            self.futures[job_id] = self.executor.submit(self._prepare, job_id, dict(params), device_context, self.cancelled[job_id])
+
+    def take(self, job_id):
+        """
+        Returns the prepared inputs of a job and forgets them.
+
+        A preparation still running is waited for at most wait_timeout seconds. After that the worker gets
+        what is prepared so far and computes the rest inline, the preparation stops at its next stage.
+
+        Returns:
+            dict with any of `processed_inputs`, `lora_state_dicts` and `image_encoder_last_hidden_state`, or None
+        """
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout=self.wait_timeout)
+            except FutureTimeoutError:
+                print(f"Prefetch for job {job_id} is not finished, preparing the rest inline")
+            except Exception:
+                pass
+        with self.lock:
+            self._cancel_locked(job_id)
+            return self.prepared.pop(job_id, None)
+
+    def discard(self, job_id):
+        """Drops the prepared inputs of a job that will not run"""
+        with self.lock:
+            self._cancel_locked(job_id)
+            self.prepared.pop(job_id, None)
+
+    def _cancel_locked(self, job_id):
+        """Stops the preparation of a job: not started yet it never runs, running it stops at its next stage"""
+        future = self.futures.pop(job_id, None)
+        if future is not None:
+            future.cancel()
+        cancelled = self.cancelled.pop(job_id, None)
+        if cancelled is not None:
+            cancelled.set()
+
+    def _budget(self):
+        return self.max_bytes - self.used_bytes()
+
+    def _store(self, job_id, key, value):
+        """Keeps a prepared value if it fits in the memory cap"""
+        size = _nbytes(value)
+        if size > self._budget():
+            print(f"Prefetch for job {job_id}: skipping {key} ({size / (1024 ** 2):.0f} MB), over the memory cap")
+            return False
+        with self.lock:
+            if job_id not in self.futures:
+                return False  # Discarded in the meantime
+            self.prepared.setdefault(job_id, {})[key] = value
+        return True
+
+    def _prepare(self, job_id, params, device_context, cancelled):
+        stages = [lambda: self._prepare_inputs(job_id, params), lambda: self._prepare_loras(job_id, params, cancelled)]
+        if device_context is not None and getattr(device_context, 'high_vram', False):
+            stages.append(lambda: self._prepare_encodings(job_id, params, device_context, cancelled))
+        try:
+            for stage in stages:
+                if cancelled.is_set():
+                    print(f"Prefetch for job {job_id} stopped, the job was taken or discarded")
+                    return
+                stage()
+            print(f"Prefetched inputs for job {job_id}: {', '.join(self.prepared.get(job_id, {}).keys()) or 'nothing'}")
+        except Exception as e:
+            print(f"Error prefetching job {job_id}: {e}")
+            traceback.print_exc()
+
+    def _prepare_inputs(self, job_id, params):
+        from modules.pipelines import create_pipeline
+
+        pipeline = create_pipeline(params.get('model_type', 'Original'), {})
+        job_params = pipeline.prepare_parameters(params)
+        self._store(job_id, 'processed_inputs', pipeline.preprocess_inputs(job_params))
+
+    def _prepare_loras(self, job_id, params, cancelled):
+        from modules.lora_cache import get_lora_cache
+
+        selected_loras = params.get('selected_loras') or []
+        if not isinstance(selected_loras, (list, tuple)):
+            selected_loras = [selected_loras]
+        lora_dir = self.settings.get("lora_dir") if self.settings is not None else None
+        if not lora_dir:
+            return
+
+        state_dicts = {}
+        for lora_base_name in selected_loras:
+            if cancelled.is_set():
+                return
+            if lora_base_name == DUMMY_LORA_NAME:
+                continue
+            lora_file = find_lora_file(lora_dir, lora_base_name)
+            if lora_file is None:
+                continue
+            # Check the file size first, so files over the cap are not read at all
+            if os.path.getsize(Path(lora_dir) / lora_file) > self._budget() - _nbytes(state_dicts):
+                print(f"Prefetch for job {job_id}: skipping LoRA {lora_file}, over the memory cap")
+                continue
+            # Also warms the LoRA cache, the worker finds the converted state dict there
+            _, state_dicts[lora_file] = get_lora_cache().load(Path(lora_dir), lora_file)
+
+        if state_dicts:
+            self._store(job_id, 'lora_state_dicts', state_dicts)
+
+    @torch.no_grad()
+    def _prepare_encodings(self, job_id, params, device_context, cancelled):
+        from modules.prompt_handler import parse_timestamped_prompt
+        from modules.pipelines.worker import get_cached_or_encode_prompt
+
+        model_type = params.get('model_type', 'Original')
+        prompt_sections = parse_timestamped_prompt(
+            params.get('prompt_text', ''), params.get('total_second_length', 6), params.get('latent_window_size', 9), model_type
+        )
+        prompts = list(dict.fromkeys(section.prompt for section in prompt_sections))
+        if params.get('cfg', 1) != 1:
+            prompts.append(str(params.get('n_prompt') or ""))
+
+        # The embeddings land in the prompt embedding cache, where the worker finds them
+        for prompt in prompts:
+            with device_context.encoder_lock:
+                if cancelled.is_set():
+                    return  # Taken or discarded in the meantime
+                if prompt not in device_context.prompt_embedding_cache:
+                    get_cached_or_encode_prompt(
+                        prompt, device_context.text_encoder, device_context.text_encoder_2, device_context.tokenizer,
+                        device_context.tokenizer_2, device_context.device, device_context.prompt_embedding_cache
+                    )
+
+        input_image = self.prepared.get(job_id, {}).get('processed_inputs', {}).get('input_image')
+        if model_type in ("Video", "Video F1") or not isinstance(input_image, np.ndarray):
+            return
+        if not params.get('has_input_image', True) and params.get('latent_type') == 'Noise':
+            return  # The worker encodes a black image instead
+
+        from diffusers_helper.clip_vision import hf_clip_vision_encode
+        with device_context.encoder_lock:
+            if cancelled.is_set():
+                return
+            image_encoder_output = hf_clip_vision_encode(input_image, device_context.feature_extractor, device_context.image_encoder)
+        self._store(job_id, 'image_encoder_last_hidden_state', image_encoder_output.last_hidden_state.cpu())
+
+
+def get_prefetch_max_bytes():
+    """Memory cap of the prefetched state, FRAMEPACK_PREFETCH_MAX_MB (0 disables prefetching)"""
+    return int(float(os.environ.get("FRAMEPACK_PREFETCH_MAX_MB", "4096")) * 1024 * 1024)
+
+
+def get_prefetch_wait_timeout():
+    """Seconds a job waits for its unfinished prefetch before preparing inline, FRAMEPACK_PREFETCH_WAIT_SECONDS"""
+    return float(os.environ.get("FRAMEPACK_PREFETCH_WAIT_SECONDS", "1"))
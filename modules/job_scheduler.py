@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import threading
+import queue as queue_module
+
+
+def get_job_affinity_key(params):
+    """
+    Jobs with the same key can run back to back without swapping the transformer or reloading LoRAs.
+
+    Args:
+        params: The job parameters
+
+    Returns:
+        A hashable (model family, LoRA set, resolution bucket) tuple
+    """
+    model_type = params.get('model_type', 'Original') or 'Original'
+    # "Original with Endframe" and "Video" run on the Original transformer, "Video F1" and "F1 with Endframe" on F1
+    model_family = "F1" if "F1" in model_type else "Original"
+
+    selected_loras = params.get('selected_loras') or []
+    if not isinstance(selected_loras, (list, tuple)):
+        selected_loras = [selected_loras]
+    lora_values = params.get('lora_values') or []
+    lora_set = tuple(sorted(
+        (str(name), str(lora_values[i]) if i < len(lora_values) else "1.0")
+        for i, name in enumerate(selected_loras)
+    ))
+
+    resolution_bucket = (params.get('resolutionW'), params.get('resolutionH'))
+    return (model_family, lora_set, resolution_bucket)
+
+
+class JobScheduler:
+    """
+    Priority queue of job ids with affinity-aware ordering, used by VideoJobQueue in place of queue.Queue.
+
+    Higher priority always runs first. Within the same priority jobs run in arrival order, except that a
+    pending job with the same affinity key as the job that just ran may overtake the head of the queue,
+    which avoids model swaps and LoRA reloads. The head can be overtaken at most `fairness_window` times
+    before it is forced to run.
+
+    Insert and cancel are O(log n) / O(1), peeking the head is O(1) amortized. Cancelled entries stay in the
+    heaps until popped, the heaps are rebuilt once most of their entries are cancelled. The replayed order
+    and the positions used for queue positions and wait estimates are cached until the next put, remove or get.
+
+    Entries can carry a predicted cost in seconds, used by estimate_wait_times.
+    """
+
+    def __init__(self, fairness_window=4):
+        self.fairness_window = fairness_window
+
+        self._heap = []
+        self._affinity_heaps = {}
+        self._affinity_counts = {}  # affinity key -> valid entries in its heap
+        self._order = None  # Cached _replay result, [(job_id, cost)]
+        self._positions = None  # Cached scheduled_positions result
+        self._entries = {}
+        self._counter = itertools.count()
+        self._front_counter = itertools.count(-1, -1)
+
+        self._last_affinity_key = None
+        self._head_skips = {}
+
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+
+    # Entries are lists so they can be invalidated in place: [-priority, seq, job_id, affinity_key, cost, valid]
+
+    def put(self, job_id, priority=0, affinity_key=None, front=False, cost=None):
+        """
+        Schedules a job. Re-putting a scheduled job replaces its entry.
+
+        Args:
+            job_id: The job id
+            priority: Higher runs first
+            affinity_key: Jobs sharing a key are grouped together, see get_job_affinity_key
+            front: Run before every other job of the same priority (used for grid children)
+            cost: Predicted runtime in seconds, None when unknown
+        """
+        with self._mutex:
+            self._invalidate(job_id)
+            seq = next(self._front_counter) if front else next(self._counter)
+            entry = [-priority, seq, job_id, affinity_key, cost, True]
+            self._entries[job_id] = entry
+            heapq.heappush(self._heap, entry)
+            if affinity_key is not None:
+                heapq.heappush(self._affinity_heaps.setdefault(affinity_key, []), entry)
+                self._affinity_counts[affinity_key] = self._affinity_counts.get(affinity_key, 0) + 1
+            self._order = self._positions = None
+            self._not_empty.notify()
+
+    def update_costs(self, costs):
+        """Replaces the predicted cost of scheduled jobs, `costs` maps job id -> seconds or None"""
+        with self._mutex:
+            for job_id, cost in costs.items():
+                entry = self._entries.get(job_id)
+                if entry is not None:
+                    entry[4] = cost
+            self._order = self._positions = None
+
+    def remove(self, job_id):
+        """Removes a scheduled job, returns True if it was scheduled."""
+        with self._mutex:
+            return self._invalidate(job_id)
+
+    def _invalidate(self, job_id):
+        entry = self._entries.pop(job_id, None)
+        if entry is None:
+            return False
+        entry[-1] = False
+        self._head_skips.pop(job_id, None)
+        self._order = self._positions = None
+        self._prune_affinity_heap(entry[3])
+        if len(self._heap) > 2 * len(self._entries):
+            self._heap[:] = [entry for entry in self._heap if entry[-1]]
+            heapq.heapify(self._heap)
+        return True
+
+    def _prune_affinity_heap(self, affinity_key):
+        """
+        Accounts for an invalidated entry of an affinity heap. Affinity heaps are only cleaned when consulted,
+        so the heap is dropped once it has no valid entry and rebuilt once most of its entries are invalid.
+        """
+        if affinity_key is None or affinity_key not in self._affinity_counts:
+            return
+        count = self._affinity_counts[affinity_key] - 1
+        if count <= 0:
+            del self._affinity_counts[affinity_key]
+            self._affinity_heaps.pop(affinity_key, None)
+            return
+        self._affinity_counts[affinity_key] = count
+        heap = self._affinity_heaps[affinity_key]
+        if len(heap) > 2 * count:
+            heap[:] = [entry for entry in heap if entry[-1]]
+            heapq.heapify(heap)
+
+    @staticmethod
+    def _clean_top(heap):
+        while heap and not heap[0][-1]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _select(self, heap, affinity_heaps, head_skips, last_affinity_key):
+        """Returns the entry that should run next according to priority, affinity and fairness."""
+        head = self._clean_top(heap)
+        if head is None:
+            return None
+
+        if last_affinity_key is None or head[3] == last_affinity_key:
+            return head
+        if head_skips.get(head[2], 0) >= self.fairness_window:
+            return head
+
+        affinity_heap = affinity_heaps.get(last_affinity_key)
+        candidate = self._clean_top(affinity_heap) if affinity_heap is not None else None
+        if candidate is not None and candidate[0] == head[0]:
+            return candidate
+        return head
+
+    def _pop_locked(self):
+        entry = self._select(self._heap, self._affinity_heaps, self._head_skips, self._last_affinity_key)
+        head = self._heap[0]
+        if entry is not head:
+            self._head_skips[head[2]] = self._head_skips.get(head[2], 0) + 1
+
+        self._invalidate(entry[2])
+        self._last_affinity_key = entry[3]
+        return entry[2]
+
+    def get(self, block=True, timeout=None):
+        """Same contract as queue.Queue.get: raises queue.Empty on timeout or when not blocking."""
+        with self._not_empty:
+            if not block:
+                if self._clean_top(self._heap) is None:
+                    raise queue_module.Empty
+            elif not self._not_empty.wait_for(lambda: self._clean_top(self._heap) is not None, timeout=timeout):
+                raise queue_module.Empty
+            return self._pop_locked()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        pass  # For compatibility with queue.Queue
+
+    def peek(self):
+        """The job id that the next get() would return, without removing it."""
+        with self._mutex:
+            entry = self._select(self._heap, self._affinity_heaps, self._head_skips, self._last_affinity_key)
+            return entry[2] if entry is not None else None
+
+    def qsize(self):
+        with self._mutex:
+            return len(self._entries)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def clear(self):
+        with self._mutex:
+            count = len(self._entries)
+            for job_id in list(self._entries):
+                self._invalidate(job_id)
+            self._heap.clear()
+            self._affinity_heaps.clear()
+            self._affinity_counts.clear()
+            return count
+
+    def scheduled_order(self):
+        """
+        The order in which the currently scheduled jobs will run if nothing else is added,
+        obtained by replaying the selection policy on a copy of the state.
+        """
+        return [job_id for job_id, _ in self._replay()]
+
+    def scheduled_positions(self):
+        """
+        {job_id: 1-based position} in the scheduled order, cached like the order itself.
+        The dict is shared until the scheduled jobs change, callers must not modify it.
+        """
+        with self._mutex:
+            if self._positions is None:
+                self._positions = {job_id: position for position, (job_id, _) in enumerate(self._replay_locked(), start=1)}
+            return self._positions
+
+    def _replay(self):
+        """[(job_id, cost)] in the scheduled order, cached until the scheduled jobs change"""
+        with self._mutex:
+            return self._replay_locked()
+
+    def _replay_locked(self):
+        if self._order is not None:
+            return self._order
+        heap = [entry[:] for entry in self._heap if entry[-1]]
+        heapq.heapify(heap)
+        affinity_heaps = {}
+        for entry in heap:
+            if entry[3] is not None:
+                affinity_heaps.setdefault(entry[3], []).append(entry)
+        for affinity_heap in affinity_heaps.values():
+            heapq.heapify(affinity_heap)
+
+        head_skips = dict(self._head_skips)
+        last_affinity_key = self._last_affinity_key
+        order = []
+        while True:
+            entry = self._select(heap, affinity_heaps, head_skips, last_affinity_key)
+            if entry is None:
+                break
+            if entry is not heap[0]:
+                head_skips[heap[0][2]] = head_skips.get(heap[0][2], 0) + 1
+            entry[-1] = False
+            last_affinity_key = entry[3]
+            order.append((entry[2], entry[4]))
+        self._order = order
+        return order
+
+    def estimate_wait_times(self, busy_until=(0.0,)):
+        """
+        Predicted seconds until each scheduled job starts, the scheduled order being dispatched to the
+        first free worker.
+
+        Args:
+            busy_until: Seconds until each worker is free, one value per worker
+
+        Returns:
+            dict of job id -> seconds, None for the jobs queued behind a job of unknown cost
+        """
+        workers = sorted(busy_until) or [0.0]
+        waits = {}
+        unknown = False
+        for job_id, cost in self._replay():
+            start = heapq.heappop(workers)
+            waits[job_id] = None if unknown else start
+            if cost is None:
+                unknown = True
+                cost = 0.0
+            heapq.heappush(workers, start + cost)
+        return waits
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.paths import get_local_dir
+
+
+def get_default_store_path():
+    """FRAMEPACK_JOB_STORE_PATH, on the node's local disk by default since WAL does not work on network filesystems"""
+    return os.environ.get("FRAMEPACK_JOB_STORE_PATH", os.path.join(get_local_dir(), "queue.db"))
+
+
+class SQLiteJobStore:
+    """
+    Crash-safe job persistence for VideoJobQueue.
+
+    Every job is one row, so a status or progress transition only writes the job that changed.
+    The database runs in WAL mode: writes are atomic, a crash never leaves a half written queue, and
+    other processes on the node can read the queue state while the worker keeps writing.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_default_store_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                updated_at REAL,
+                progress TEXT,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self.conn.commit()
+
+    def upsert(self, job_id, status, data, priority=0, created_at=None):
+        """Insert or replace a job with its serialized data (the same dict queue.json stores per job)"""
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO jobs (id, status, priority, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    status = excluded.status, priority = excluded.priority, created_at = excluded.created_at,
+                    updated_at = excluded.updated_at, data = excluded.data
+                """,
+                (job_id, status, priority, created_at, time.time(), json.dumps(data)),
+            )
+            self.conn.commit()
+
+    def update_progress(self, job_id, progress):
+        """Only touch the progress column, without rewriting the job data"""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (progress, time.time(), job_id),
+            )
+            self.conn.commit()
+
+    def delete(self, job_ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+            self.conn.commit()
+
+    def load(self, statuses=None):
+        """
+        Returns {job_id: data} in creation order.
+
+        Args:
+            statuses: Optional list of status values to filter on
+        """
+        query = "SELECT id, status, data FROM jobs"
+        args = ()
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+            args = tuple(statuses)
+        query += " ORDER BY created_at"
+
+        with self.lock:
+            rows = self.conn.execute(query, args).fetchall()
+
+        jobs = {}
+        for job_id, status, data in rows:
+            try:
+                job_data = json.loads(data)
+            except Exception as e:
+                print(f"Error decoding stored job {job_id}: {e}")
+                continue
+            # The status column is authoritative, the data may predate the last transition
+            job_data["status"] = status
+            jobs[job_id] = job_data
+        return jobs
+
+    def prune(self, statuses, max_age_seconds):
+        """Deletes the jobs in one of `statuses` not updated for `max_age_seconds`, returns how many were deleted"""
+        if not statuses:
+            return 0
+        with self.lock:
+            cursor = self.conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(statuses))}) AND COALESCE(updated_at, created_at, 0) < ?",
+                (*statuses, time.time() - max_age_seconds),
+            )
+            self.conn.commit()
+            return cursor.rowcount
+
+    def summary(self):
+        """Lightweight view of the queue for other processes: [(id, status, priority, progress)]"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, status, priority, progress FROM jobs ORDER BY created_at"
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def _nbytes(state_dict):
+    return sum(t.numel() * t.element_size() for t in state_dict.values() if isinstance(t, torch.Tensor))
+
+
+class LoraStateDictCache:
+    """
+    Keeps converted LoRA state dicts in host memory, so jobs using the same LoRAs skip reading and converting the files.
+
+    Entries are keyed by the sha256 of the file, so a LoRA renamed or stored under several names is cached once
+    and a file replaced under the same name is read again. The hash of a file is computed once per size and
+    modification time. Tensors are pinned when CUDA is available, which makes their copies to the device faster.
+    The least recently used entries are dropped to stay under max_bytes.
+    """
+
+    def __init__(self, max_bytes, pin_memory=None):
+        self.max_bytes = max_bytes
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.entries = OrderedDict()  # digest -> state dict
+        self.sizes = {}
+        self.file_digests = {}  # (path, size, mtime_ns) -> digest
+        self.lock = threading.Lock()
+
+    def used_bytes(self):
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def file_digest(self, path):
+        """sha256 of a LoRA file, only hashed again when the file changes"""
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            digest = self.file_digests.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self.lock:
+                self.file_digests[key] = digest
+        return digest
+
+    def get(self, digest):
+        with self.lock:
+            state_dict = self.entries.get(digest)
+            if state_dict is not None:
+                self.entries.move_to_end(digest)
+            return state_dict
+
+    def put(self, digest, state_dict):
+        """Caches a converted state dict, returns the (pinned) state dict to use"""
+        size = _nbytes(state_dict)
+        if size > self.max_bytes:
+            return state_dict
+        if self.pin_memory:
+            state_dict = {k: (v.pin_memory() if isinstance(v, torch.Tensor) and v.device.type == "cpu" else v)
+                          for k, v in state_dict.items()}
+        with self.lock:
+            self.entries[digest] = state_dict
+            self.entries.move_to_end(digest)
+            self.sizes[digest] = size
+            while sum(self.sizes.values()) > self.max_bytes and len(self.entries) > 1:
+                evicted, _ = self.entries.popitem(last=False)
+                del self.sizes[evicted]
+                print(f"LoRA cache: evicted {evicted[:12]}")
+        return state_dict
+
+    def load(self, lora_path, weight_name, state_dict=None):
+        """
+        Returns the converted state dict of a LoRA file, from the cache or read from the file.
+
+        Args:
+            lora_path: Folder containing the LoRA file
+            weight_name: File name of the LoRA
+            state_dict: Already converted state dict (e.g. read by the job prefetcher), cached instead of reading the file
+
+        Returns:
+            Tuple of (file digest, state dict)
+        """
+        from diffusers_helper import lora_utils
+
+        digest = self.file_digest(Path(lora_path) / weight_name)
+        cached = self.get(digest)
+        if cached is not None:
+            print(f"LoRA cache: using cached state dict for '{weight_name}' ({digest[:12]})")
+            return digest, cached
+        if state_dict is None:
+            state_dict = lora_utils.load_lora_state_dict(Path(lora_path), weight_name)
+        return digest, self.put(digest, state_dict)
+
+
+def get_lora_cache_max_bytes():
+    """Host memory for converted LoRAs, FRAMEPACK_LORA_MEMORY_CACHE_MB (0 disables the cache)"""
+    return int(float(os.environ.get("FRAMEPACK_LORA_MEMORY_CACHE_MB", "2048")) * 1024 * 1024)
+
+
+_lora_cache = None
+_lora_cache_lock = threading.Lock()
+
+
+def get_lora_cache():
+    global _lora_cache
+    with _lora_cache_lock:
+        if _lora_cache is None:
+            _lora_cache = LoraStateDictCache(get_lora_cache_max_bytes())
+        return _lora_cache
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+import httpx
+
+from utils.logging import logger
+
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _link_or_copy(source, target):
+    """Points target at source with a hard link, falling back to a copy, replacing target atomically"""
+    tmp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(source, tmp_target)
+    except OSError:
+        shutil.copyfile(source, tmp_target)
+    os.replace(tmp_target, target)
+
+
+class LoraFetcher:
+    """
+    Downloads LoRA files into a content-addressed store.
+
+    Files are stored once under `<lora_dir>/.store/objects/<sha256>` and exposed under their names in
+    lora_dir through hard links, so the same file requested under several names or URLs is downloaded and
+    stored once. Downloads go to part files that are resumed after an interruption. Large files are fetched
+    as several HTTP range requests in parallel. The assembled file is only moved into the store once its
+    checksum matches, so a name in lora_dir always points to a complete file.
+
+    The store is kept under `max_bytes` by evicting the least recently used files, together with their names.
+    """
+
+    def __init__(self, lora_dir, max_bytes=0, client_factory: Optional[Callable[[str], httpx.Client]] = None,
+                 chunk_size=64 * 1024 * 1024, connections=4, max_parallel_files=4, timeout=60.0):
+        """
+        Args:
+            lora_dir: The LoRA folder the workers load from
+            max_bytes: Size budget of the store, 0 for no limit
+            client_factory: Returns the httpx client for a URL (for authentication headers)
+            chunk_size: Size of the range requests, files up to this size use a single request
+            connections: Range requests in flight per file
+            max_parallel_files: Files downloaded at the same time by fetch_all
+        """
+        self.lora_dir = lora_dir
+        self.store_dir = os.path.join(lora_dir, ".store")
+        self.objects_dir = os.path.join(self.store_dir, "objects")
+        self.partial_dir = os.path.join(self.store_dir, "partial")
+        self.index_path = os.path.join(self.store_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.client_factory = client_factory or (lambda url: httpx.Client())
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.max_parallel_files = max_parallel_files
+        self.timeout = timeout
+        self.logger = logger.getChild("lora_fetcher")
+
+        self.lock = threading.Lock()
+        self.url_locks = {}
+        self.index = self._load_index()
+
+    # --- Index ---
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                return {"objects": index.get("objects", {}), "names": index.get("names", {}), "urls": index.get("urls", {})}
+            except Exception as e:
+                self.logger.warning(f"Could not read the LoRA store index, starting empty: {e}")
+        return {"objects": {}, "names": {}, "urls": {}}
+
+    def _save_index(self):
+        """Called with self.lock held"""
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest)
+
+    def _lookup(self, name, url, sha256):
+        """The digest of an already stored file for this request, or None"""
+        with self.lock:
+            candidates = [sha256, self.index["urls"].get(url), self.index["names"].get(name)]
+        for digest in candidates:
+            if digest and os.path.isfile(self._object_path(digest)):
+                if sha256 and digest != sha256:
+                    continue
+                return digest
+        return None
+
+    def _expose(self, name, url, digest):
+        """Links the stored file under its name in lora_dir and records it"""
+        target = os.path.join(self.lora_dir, name)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        if not (os.path.isfile(target) and os.path.samefile(target, self._object_path(digest))):
+            _link_or_copy(self._object_path(digest), target)
+        with self.lock:
+            self.index["names"][name] = digest
+            self.index["urls"][url] = digest
+            entry = self.index["objects"].setdefault(digest, {"size": os.path.getsize(self._object_path(digest))})
+            entry["last_used"] = time.time()
+            self._save_index()
+        return target
+
+    # --- Download ---
+
+    def _url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    def _probe(self, client, url):
+        """
+        Final URL, size, range support, checksum and validator (for If-Range) advertised by the server.
+
+        Servers that refuse HEAD get size 0 and no range support, so the file is fetched with a single GET.
+        """
+        try:
+            response = client.head(url, follow_redirects=True, timeout=self.timeout)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.logger.warning(f"HEAD request for {url} failed, downloading it with a single request: {e}")
+            return url, 0, False, None, None
+        size = int(response.headers.get("Content-Length", 0) or 0)
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        # If-Range needs a strong ETag, Last-Modified otherwise
+        etag = response.headers.get("ETag")
+        validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+        # Hugging Face LFS files advertise their sha256 as the (linked) ETag, on the response before the CDN redirect
+        advertised = None
+        for r in [*response.history, response]:
+            etag = (r.headers.get("X-Linked-Etag") or r.headers.get("ETag") or "").strip('W/"').lower()
+            if SHA256_RE.match(etag):
+                advertised = etag
+        return str(response.url), size, accepts_ranges, advertised, validator
+
+    def _download_range(self, client, url, part_path, start, end, validator=None):
+        """
+        Downloads bytes [start, end] into part_path, resuming from what the part file already holds.
+
+        Range requests carry the validator as If-Range, so a file that changed on the server is sent whole
+        instead of being spliced onto stale bytes. The size of an open ended range comes from the response.
+        """
+        expected = end - start + 1 if end is not None else None
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected is not None and have >= expected:
+            return
+
+        headers = {}
+        if have or start or end is not None:
+            headers["Range"] = f"bytes={start + have}-" + (str(end) if end is not None else "")
+            if validator:
+                headers["If-Range"] = validator
+
+        with client.stream("GET", url, headers=headers, follow_redirects=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if headers and response.status_code != 206:
+                # The server ignored the range or the file changed, start this part over
+                have = 0
+                if start or end is not None:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise IOError(f"Server answered {response.status_code} to the range request for {url}, the part was discarded")
+            content_length = response.headers.get("Content-Length")
+            # Content-Length is the encoded size when the body is compressed
+            if expected is None and content_length is not None and not response.headers.get("Content-Encoding"):
+                expected = have + int(content_length)
+            with open(part_path, "ab" if have else "wb") as f:
+                for chunk in response.iter_bytes(COPY_BUFFER_SIZE):
+                    f.write(chunk)
+
+        if expected is not None and os.path.getsize(part_path) != expected:
+            raise IOError(f"Incomplete range {start}-{end} of {url}: {os.path.getsize(part_path)} of {expected} bytes")
+
+    def _download(self, source_url, sha256=None):
+        """Downloads a file into the store and returns its digest"""
+        client = self.client_factory(source_url)
+        try:
+            url, size, accepts_ranges, advertised, validator = self._probe(client, source_url)
+            sha256 = sha256 or advertised
+
+            # Part files are keyed by source URL, size and validator, so an interrupted download resumes on the
+            # next request and a file that changed on the server starts over
+            work_dir = os.path.join(self.partial_dir, hashlib.sha1(f"{source_url}:{size}:{validator}".encode()).hexdigest())
+            os.makedirs(work_dir, exist_ok=True)
+
+            if size and accepts_ranges and size > self.chunk_size:
+                ranges = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+            elif size and accepts_ranges:
+                ranges = [(0, size - 1)]
+            else:
+                ranges = [(0, None)]
+
+            parts = [os.path.join(work_dir, f"part-{i:05d}") for i in range(len(ranges))]
+            size_text = f"{size / (1024 ** 2):.1f} MB" if size else "unknown size"
+            self.logger.info(f"Downloading {source_url} ({size_text}, {len(ranges)} part(s))")
+            with ThreadPoolExecutor(max_workers=min(self.connections, len(ranges))) as executor:
+                futures = [executor.submit(self._download_range, client, url, part, start, end, validator)
+                           for part, (start, end) in zip(parts, ranges)]
+                for future in futures:
+                    future.result()
+
+            # Assemble and hash in one pass, the file only enters the store once the checksum passes
+            tmp_path = os.path.join(self.objects_dir, f"{uuid.uuid4().hex}.tmp")
+            h = hashlib.sha256()
+            with open(tmp_path, "wb") as out:
+                for part in parts:
+                    with open(part, "rb") as f:
+                        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                            h.update(chunk)
+                            out.write(chunk)
+            digest = h.hexdigest()
+
+            if (size and os.path.getsize(tmp_path) != size) or (sha256 and digest != sha256):
+                os.remove(tmp_path)
+                shutil.rmtree(work_dir, ignore_errors=True)
+                raise IOError(f"Checksum mismatch for {source_url}: expected {sha256 or size}, got {digest}")
+
+            if os.path.exists(self._object_path(digest)):
+                os.remove(tmp_path)  # Same content already stored under another name or URL
+            else:
+                os.replace(tmp_path, self._object_path(digest))
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return digest
+        finally:
+            client.close()
+
+    # --- Public API ---
+
+    def fetch(self, name, source_url, sha256=None):
+        """
+        Makes `<lora_dir>/<name>` available, downloading it if needed.
+
+        Args:
+            name: File name in lora_dir
+            source_url: Where to download it from
+            sha256: Expected checksum, verified when given (or when the server advertises one)
+
+        Returns:
+            The path of the file in lora_dir
+        """
+        sha256 = sha256.lower() if sha256 else None
+        with self._url_lock(source_url):
+            digest = self._lookup(name, source_url, sha256)
+            if digest is None:
+                target = os.path.join(self.lora_dir, name)
+                with self.lock:
+                    indexed = name in self.index["names"]
+                if os.path.isfile(target) and not indexed and (sha256 is None or _hash_file(target) == sha256):
+                    # Placed in lora_dir by hand, not managed by the store
+                    self.logger.debug(f"Model already exists: {target}")
+                    return target
+                digest = self._download(source_url, sha256)
+            else:
+                self.logger.debug(f"Model {name} found in the store ({digest[:12]})")
+            return self._expose(name, source_url, digest)
+
+    def fetch_all(self, requests: Iterable[Dict[str, Optional[str]]]):
+        """
+        Fetches several files concurrently, then evicts old files over the size budget.
+
+        Args:
+            requests: Dicts with `name`, `source` and optionally `sha256`
+
+        Returns:
+            List of paths in the order of the requests
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_files, len(requests))) as executor:
+            futures = [executor.submit(self.fetch, r["name"], r["source"], r.get("sha256")) for r in requests]
+            paths = [future.result() for future in futures]
+
+        with self.lock:
+            keep = {self.index["names"].get(r["name"]) for r in requests}
+        self.evict(keep=keep)
+        return paths
+
+    def evict(self, keep=()):
+        """Removes the least recently used files until the store fits in max_bytes"""
+        if not self.max_bytes:
+            return []
+        with self.lock:
+            objects = self.index["objects"]
+            total = sum(entry.get("size", 0) for entry in objects.values())
+            evicted = []
+            for digest, entry in sorted(objects.items(), key=lambda item: item[1].get("last_used", 0)):
+                if total <= self.max_bytes:
+                    break
+                if digest in keep:
+                    continue
+                for name, name_digest in list(self.index["names"].items()):
+                    if name_digest == digest:
+                        path = os.path.join(self.lora_dir, name)
+                        if os.path.isfile(path):
+                            os.remove(path)
+                        del self.index["names"][name]
+                for url, url_digest in list(self.index["urls"].items()):
+                    if url_digest == digest:
+                        del self.index["urls"][url]
+                if os.path.isfile(self._object_path(digest)):
+                    os.remove(self._object_path(digest))
+                total -= entry.get("size", 0)
+                evicted.append(digest)
+            for digest in evicted:
+                del objects[digest]
+            if evicted:
+                self._save_index()
+        if evicted:
+            self.logger.info(f"Evicted {len(evicted)} LoRA file(s) from the store")
+        return evicted
@@ -1,9 +1,11 @@
 import os
 import httpx
 import re
-from studio import settings
+from engine import settings
 from utils.logging import logger
 from local_types.runpod_job import JobInputModel
+from modules.lora_fetcher import LoraFetcher
+from typing import List, Optional
 
 class LoraManager():
     logger = logger.getChild("lora_manager")
@@ -19,6 +21,7 @@ class LoraManager():
                 "token": os.environ.get("CIVITAI_API_TOKEN", ""),
             }
         ]
+        self.fetcher = None
   
     def get_http_client(self, url: str):
         headers = {}
@@ -56,27 +59,33 @@ class LoraManager():
         
     #     raise Exception("Could not determine the filename from the URL.")
     
-    def install_model(self, source_url: str, file_path: str):
-        client = self.get_http_client(source_url)
+    def get_fetcher(self) -> LoraFetcher:
+        lora_dir = settings.get("lora_dir")
+        
+        if self.fetcher is None or self.fetcher.lora_dir != lora_dir:
+            self.fetcher = LoraFetcher(
+                lora_dir,
+                max_bytes=int(float(os.environ.get("FRAMEPACK_LORA_CACHE_GB", "0")) * 1024 ** 3),
+                client_factory=self.get_http_client,
+                connections=int(os.environ.get("FRAMEPACK_LORA_DOWNLOAD_CONNECTIONS", "4")),
+            )
         
+        return self.fetcher
+    
+    def install_model(self, source_url: str, file_path: str, sha256: Optional[str] = None):
         self.logger.info(f"Installing model from: {source_url}")
-        with client.stream("GET", source_url, follow_redirects=True) as response:
-            response.raise_for_status()
-            
-            with open(file_path, "wb") as file:
-                for chunk in response.iter_bytes():
-                    file.write(chunk)
-                    
-            self.logger.info(f"Model installed: {file_path}")
+        file_path = self.get_fetcher().fetch(os.path.basename(file_path), source_url, sha256)
+        self.logger.info(f"Model installed: {file_path}")
   
     def install_model_if_needed(self, model: JobInputModel):
-        lora_dir = settings.get("lora_dir")
-        file_path = os.path.join(lora_dir, model.name)
-        
-        if os.path.exists(file_path):
-            self.logger.debug(f"Model already exists: {file_path}")
-            return
-        
-        self.install_model(model.source, file_path)
+        self.install_models_if_needed([model])
+    
+    def install_models_if_needed(self, models: List[JobInputModel]):
+        """Installs the LoRAs of a job concurrently, files already in the store are only linked"""
+        paths = self.get_fetcher().fetch_all(
+            {"name": model.name, "source": model.source, "sha256": model.sha256} for model in models
+        )
+        for path in paths:
+            self.logger.debug(f"Model ready: {path}")
         
 lora_manager = LoraManager()
\ No newline at end of file
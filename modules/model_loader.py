@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LazyModel:
+    """
+    Handle of a model being loaded in the background.
+
+    `get()` returns the model, waiting for its load to finish on first use. Errors raised by the
+    load are raised again by `get()`.
+    """
+
+    def __init__(self, name, future):
+        self.name = name
+        self.future = future
+        self.load_seconds = None
+
+    def is_loaded(self):
+        return self.future.done() and self.future.exception() is None
+
+    def get(self):
+        if not self.future.done():
+            start_time = time.perf_counter()
+            print(f"Waiting for {self.name} to finish loading...")
+            result = self.future.result()
+            print(f"{self.name} ready after waiting {time.perf_counter() - start_time:.2f}s")
+            return result
+        return self.future.result()
+
+
+def resolve_model(value):
+    """The model behind a LazyModel handle, other values are returned as is"""
+    return value.get() if isinstance(value, LazyModel) else value
+
+
+class ModelLoader:
+    """
+    Loads model components concurrently on a thread pool.
+
+    Loading is mostly reading safetensors files and building modules, both of which release the GIL,
+    so the text encoders, VAE and image encoder load in about the time of the largest one. Each
+    component is returned as a LazyModel right away and its load time is logged once it is done.
+    """
+
+    def __init__(self, max_workers=None, label="models"):
+        self.max_workers = max_workers or get_model_loader_workers()
+        self.label = label
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model-loader")
+        self.handles = {}
+        self.started_at = time.perf_counter()
+        self.submitted_all = False
+        self.reported = False
+        self.lock = threading.Lock()
+
+    def _load(self, handle, load_fn):
+        start_time = time.perf_counter()
+        try:
+            return load_fn()
+        finally:
+            handle.load_seconds = time.perf_counter() - start_time
+            print(f"Loaded {handle.name} in {handle.load_seconds:.2f}s")
+            self._report_if_done()
+
+    def submit(self, name, load_fn):
+        """Starts loading a component, returns its LazyModel"""
+        handle = LazyModel(name, None)
+        with self.lock:
+            self.handles[name] = handle
+            handle.future = self.executor.submit(self._load, handle, load_fn)
+        return handle
+
+    def _report_if_done(self):
+        with self.lock:
+            if not self.submitted_all or self.reported or any(handle.load_seconds is None for handle in self.handles.values()):
+                return
+            self.reported = True
+        self.report()
+
+    def close(self):
+        """Marks the end of the submissions, the load times are reported once they are all loaded"""
+        with self.lock:
+            self.submitted_all = True
+        self.executor.shutdown(wait=False)
+        self._report_if_done()
+
+    def report(self):
+        """Logs the load time of every component and the wall time of the whole load"""
+        with self.lock:
+            handles = list(self.handles.values())
+        times = ", ".join(
+            f"{handle.name} {handle.load_seconds:.2f}s" if handle.load_seconds is not None else f"{handle.name} loading"
+            for handle in handles
+        )
+        print(f"Load times for {self.label} (wall {time.perf_counter() - self.started_at:.2f}s): {times}")
+
+    def wait(self):
+        """Waits for every component, raising the first load error"""
+        for handle in list(self.handles.values()):
+            handle.get()
+
+
+def get_model_loader_workers():
+    """Components loaded at the same time, FRAMEPACK_MODEL_LOAD_WORKERS"""
+    return int(os.environ.get("FRAMEPACK_MODEL_LOAD_WORKERS", "4"))
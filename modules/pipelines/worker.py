@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import time
 import traceback
@@ -10,20 +11,31 @@ from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from diffusers_helper.models.mag_cache import MagCache
 from diffusers_helper.utils import save_bcthw_as_mp4, generate_timestamp, resize_and_center_crop
-from diffusers_helper.memory import cpu, gpu, move_model_to_device_with_memory_preservation, offload_model_from_device_for_memory_preservation, fake_diffusers_current_device, unload_complete_models, load_model_as_complete
+from diffusers_helper.memory import cpu, gpu, move_model_to_device_with_memory_preservation, offload_model_from_device_for_memory_preservation, fake_diffusers_current_device, unload_complete_models, load_model_as_complete, start_activation_peak_tracking, record_activation_peak, activation_peaks_gb, get_device_total_memory_gb, swap_bandwidth_report
 from diffusers_helper.thread_utils import AsyncStream
 from diffusers_helper.gradio.progress_bar import make_progress_bar_html
-from diffusers_helper.hunyuan import vae_decode
+from diffusers_helper.hunyuan import vae_decode, vae_decode_chunked
+from diffusers_helper.pixel_history import HistoryPixelStore
 from modules.video_queue import JobStatus
 from modules.prompt_handler import parse_timestamped_prompt
 from modules.generators import create_model_generator
 from modules.pipelines.video_tools import combine_videos_sequentially_from_tensors
 from modules import DUMMY_LORA_NAME # Import the constant
-from modules.llm_captioner import unload_captioning_model
-from modules.llm_enhancer import unload_enhancing_model
+from modules.cost_model import StageTimer, get_cost_model
+from modules.admission import JobRejectedError, admit_job, default_memory_plan, get_activation_key, get_admission_mode
+from modules.weight_snapshot import TRANSFORMER_REPOS, has_snapshot, transformer_component
 from . import create_pipeline
 
-import studio as studio_module # Get a reference to the __main__ module object
+import engine as engine_module # The module holding the models, settings and job queue
+
+
+def get_default_device_context():
+    """The engine's primary DeviceContext, used when the worker is called without a device pool"""
+    device_context = getattr(engine_module, 'primary_device_context', None)
+    if device_context is None:
+        # In process mode the models only live in the worker processes, each job has to go through the device pool
+        raise RuntimeError("No models are loaded in this process, pass the device_context of a device pool worker")
+    return device_context
 
 @torch.no_grad()
 def get_cached_or_encode_prompt(prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2, target_device, prompt_embedding_cache):
@@ -58,6 +70,50 @@ def get_cached_or_encode_prompt(prompt, text_encoder, text_encoder_2, tokenizer,
         # Return embeddings already on the target device (as encode_prompt_conds uses the model's device)
         return llama_vec, llama_attention_mask, clip_l_pooler
 
+
+def get_mapped_modules(model_type):
+    """Admission module names of the job that are memory mapped from a weight snapshot"""
+    # The F1 generators load the F1 transformer, the others the original one
+    model_path = TRANSFORMER_REPOS[1] if "F1" in model_type else TRANSFORMER_REPOS[0]
+    components = {name: name for name in ("text_encoder", "text_encoder_2", "image_encoder", "vae")}
+    components["transformer"] = transformer_component(model_path)
+    return {module for module, component in components.items() if has_snapshot(component)}
+
+
+def plan_job_memory(job_params, device_context, settings):
+    """
+    Checks that a job fits in the memory of the worker's device before anything is loaded.
+
+    Returns:
+        The memory plan to run the job with, see modules.admission.default_memory_plan
+
+    Raises:
+        JobRejectedError: When the job cannot run on this device
+    """
+    import psutil
+
+    latent_window_size = int(job_params.get('latent_window_size', 9) or 9)
+    decision = admit_job(
+        job_params,
+        default_memory_plan(settings, latent_window_size),
+        high_vram=device_context.high_vram,
+        device_memory_gb=get_device_total_memory_gb(device_context.device),
+        host_memory_gb=psutil.virtual_memory().total / (1024 ** 3),
+        preserved_memory_gb=settings.get("gpu_memory_preservation", 6),
+        observed_activation_gb=activation_peaks_gb,
+        mode=get_admission_mode(),
+        device_name=device_context.name,
+        mapped_modules=get_mapped_modules(job_params.get('model_type', "Original")),
+    )
+    print(f"Admission: {decision.action}, estimated peak {decision.estimate.device_gb:.1f} GB on {device_context.name}, {decision.estimate.host_gb:.1f} GB host")
+    if decision.warning:
+        print(f"Admission warning: {decision.warning}")
+    if decision.action == "reject":
+        raise JobRejectedError(decision.reason)
+    if decision.action == "adjust":
+        print(decision.reason)
+    return decision.plan
+
 @torch.no_grad()
 def worker(
     model_type,
@@ -97,16 +153,29 @@ def worker(
     input_video=None,     # Add input_video parameter with default value of None
     combine_with_source=None,  # Add combine_with_source parameter
     num_cleaned_frames=5,  # Add num_cleaned_frames parameter with default value
-    save_metadata_checked=True  # Add save_metadata_checked parameter
+    save_metadata_checked=True,  # Add save_metadata_checked parameter
+    device_context=None,  # DeviceContext of the worker running this job, see modules.device_pool
+    prepared_inputs=None  # Inputs prepared while the previous job was running, see modules.job_prefetch
 ):
     """
     Worker function for video generation.
     """
+    if device_context is None:
+        device_context = get_default_device_context()
+    prepared_inputs = prepared_inputs or {}
+    # Every model move below targets the device of this worker
+    gpu = device_context.device
+    if gpu.type == 'cuda':
+        # Jobs may run on a fresh thread (worker processes), whose current device is cuda:0
+        torch.cuda.set_device(gpu)
 
     random_generator = torch.Generator("cpu").manual_seed(seed)
 
-    unload_enhancing_model()
-    unload_captioning_model()
+    # The prompt enhancer and captioner are only imported by the UI, unload them if they were used
+    if 'modules.llm_enhancer' in sys.modules:
+        sys.modules['modules.llm_enhancer'].unload_enhancing_model()
+    if 'modules.llm_captioner' in sys.modules:
+        sys.modules['modules.llm_captioner'].unload_captioning_model()
 
     # Filter out the dummy LoRA from selected_loras at the very beginning of the worker
     actual_selected_loras_for_worker = []
@@ -122,17 +191,13 @@ def worker(
     selected_loras = actual_selected_loras_for_worker
     print(f"Worker: Selected LoRAs for this worker: {selected_loras}")
     
-    # Import globals from the main module
-    from studio import high_vram, text_encoder, text_encoder_2, tokenizer, tokenizer_2, vae, image_encoder, feature_extractor, prompt_embedding_cache, settings, stream
-    
-    # Ensure any existing LoRAs are unloaded from the current generator
-    if studio_module.current_generator is not None:
-        print("Worker: Unloading LoRAs from studio_module.current_generator")
-        studio_module.current_generator.unload_loras()
-        import gc
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+    # Models are owned by the device context, settings and the UI stream are global
+    from engine import settings, stream
+    high_vram = device_context.high_vram
+    # Reading a model waits for it when it is still loading, the VAE and image encoder are read once needed
+    text_encoder, text_encoder_2 = device_context.text_encoder, device_context.text_encoder_2
+    tokenizer, tokenizer_2 = device_context.tokenizer, device_context.tokenizer_2
+    prompt_embedding_cache = device_context.prompt_embedding_cache
     
     stream_to_use = job_stream if job_stream is not None else stream
 
@@ -160,7 +225,7 @@ def worker(
     # Store initial progress data in the job object if using a job stream
     if job_stream is not None:
         try:
-            from studio import job_queue
+            from engine import job_queue
             job = job_queue.get_job(job_id)
             if job:
                 job.progress_data = initial_progress_data
@@ -175,7 +240,7 @@ def worker(
     stream_to_use.output_queue.push(('monitor_job', job_id))
     
     # Always push to the main stream to ensure the UI is updated
-    from studio import stream as main_stream
+    from engine import stream as main_stream
     if main_stream:  # Always push to main stream regardless of whether it's the same as stream_to_use
         print(f"Pushing initial progress update to main stream for job {job_id}")
         main_stream.output_queue.push(('progress', (dummy_preview, 'Starting job...', make_progress_bar_html(0, 'Starting job...'))))
@@ -184,6 +249,18 @@ def worker(
         main_stream.output_queue.push(('job_id', job_id))
         main_stream.output_queue.push(('monitor_job', job_id))
 
+    # Read by the cleanup in the finally block, also when the job fails before sampling
+    history_pixels = None
+
+    # Stage timings of this job, recorded once it completes to predict the runtime of later jobs
+    stage_timer = StageTimer()
+    cost_params = {
+        'model_type': model_type, 'resolutionW': resolutionW, 'resolutionH': resolutionH, 'steps': steps,
+        'latent_window_size': latent_window_size, 'total_second_length': total_second_length,
+        'use_teacache': use_teacache, 'use_magcache': use_magcache, 'selected_loras': selected_loras,
+        'input_image': input_image,  # Only its shape is used, for the bucket
+    }
+
     try:
         # Create a settings dictionary for the pipeline
         pipeline_settings = {
@@ -246,18 +323,23 @@ def worker(
         # Prepare parameters
         job_params = pipeline.prepare_parameters(job_params)
         
+        # Reject or reconfigure jobs that would run out of memory halfway through
+        memory_plan = plan_job_memory(job_params, device_context, settings)
+        
+        stage_timer.start("load")
         if not high_vram:
             # Unload everything *except* the potentially active transformer
-            unload_complete_models(text_encoder, text_encoder_2, image_encoder, vae)
-            if studio_module.current_generator is not None and studio_module.current_generator.transformer is not None:
-                offload_model_from_device_for_memory_preservation(studio_module.current_generator.transformer, target_device=gpu, preserved_memory_gb=8)
+            unload_complete_models(*device_context.loaded_models(), device=gpu)
+            if device_context.current_generator is not None and device_context.current_generator.transformer is not None:
+                offload_model_from_device_for_memory_preservation(device_context.current_generator.transformer, target_device=gpu, preserved_memory_gb=8)
 
 
         # --- Model Loading / Switching ---
         print(f"Worker starting for model type: {model_type}")
-        print(f"Worker: Before model assignment, studio_module.current_generator is {type(studio_module.current_generator)}, id: {id(studio_module.current_generator)}")
+        print(f"Worker: Before model assignment, device_context.current_generator is {type(device_context.current_generator)}, id: {id(device_context.current_generator)}")
         
         # Create the appropriate model generator
+        vae, image_encoder, feature_extractor = device_context.vae, device_context.image_encoder, device_context.feature_extractor
         new_generator = create_model_generator(
             model_type,
             text_encoder=text_encoder,
@@ -270,26 +352,30 @@ def worker(
             high_vram=high_vram,
             prompt_embedding_cache=prompt_embedding_cache,
             offline=False,#args.offline,
-            settings=settings
+            settings=settings,
+            device=gpu
         )
         
-        # Update the global generator
-        # This modifies the 'current_generator' attribute OF THE '__main__' MODULE OBJECT
-        studio_module.current_generator = new_generator
-        print(f"Worker: AFTER model assignment, studio_module.current_generator is {type(studio_module.current_generator)}, id: {id(studio_module.current_generator)}")
-        if studio_module.current_generator:
-             print(f"Worker: studio_module.current_generator.transformer is {type(studio_module.current_generator.transformer)}")        
+        # The transformer (and its LoRA adapters) of the previous job is kept when the model is the same
+        previous_generator = device_context.current_generator
+
+        # Update the generator of this device
+        # For the primary device this also updates the 'current_generator' attribute of the studio module
+        device_context.current_generator = new_generator
+        print(f"Worker: AFTER model assignment, device_context.current_generator is {type(device_context.current_generator)}, id: {id(device_context.current_generator)}")
+        if device_context.current_generator:
+             print(f"Worker: device_context.current_generator.transformer is {type(device_context.current_generator.transformer)}")        
              
         # Load the transformer model
-        studio_module.current_generator.load_model()
-        
-        # Ensure the model has no LoRAs loaded
-        print(f"Ensuring {model_type} model has no LoRAs loaded")
-        studio_module.current_generator.unload_loras()
+        adopted = device_context.current_generator.adopt_transformer(previous_generator)
+        previous_generator = None  # Release the previous transformer before loading another one
+        if not adopted:
+            device_context.current_generator.load_model()
 
         # Preprocess inputs
+        stage_timer.start("preprocess")
         stream_to_use.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Preprocessing inputs...'))))
-        processed_inputs = pipeline.preprocess_inputs(job_params)
+        processed_inputs = prepared_inputs.get('processed_inputs') or pipeline.preprocess_inputs(job_params)
         
         # Update job_params with processed inputs
         job_params.update(processed_inputs)
@@ -313,6 +399,7 @@ def worker(
                 traceback.print_exc()
                 
         # Pre-encode all prompts
+        stage_timer.start("encode")
         stream_to_use.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Text encoding all prompts...'))))
         
         # THE FOLLOWING CODE SHOULD BE INSIDE THE TRY BLOCK
@@ -329,9 +416,10 @@ def worker(
         encoded_prompts = {}
         for prompt in unique_prompts:
             # Use the helper function for caching and encoding
-            llama_vec, llama_attention_mask, clip_l_pooler = get_cached_or_encode_prompt(
-                prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2, gpu, prompt_embedding_cache
-            )
+            with device_context.encoder_lock:
+                llama_vec, llama_attention_mask, clip_l_pooler = get_cached_or_encode_prompt(
+                    prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2, gpu, prompt_embedding_cache
+                )
             encoded_prompts[prompt] = (llama_vec, llama_attention_mask, clip_l_pooler)
 
         # PROMPT BLENDING: Build a list of (start_section_idx, prompt) for each prompt
@@ -353,9 +441,10 @@ def worker(
              # Use the helper function for caching and encoding negative prompt
             # Ensure n_prompt is a string
             n_prompt_str = str(n_prompt) if n_prompt is not None else ""
-            llama_vec_n, llama_attention_mask_n, clip_l_pooler_n = get_cached_or_encode_prompt(
-                n_prompt_str, text_encoder, text_encoder_2, tokenizer, tokenizer_2, gpu, prompt_embedding_cache
-            )
+            with device_context.encoder_lock:
+                llama_vec_n, llama_attention_mask_n, clip_l_pooler_n = get_cached_or_encode_prompt(
+                    n_prompt_str, text_encoder, text_encoder_2, tokenizer, tokenizer_2, gpu, prompt_embedding_cache
+                )
 
         end_of_input_video_embedding = None # Video model end frame CLIP Vision embedding
         # Process input image or video based on model type
@@ -363,7 +452,7 @@ def worker(
             stream_to_use.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Video processing ...'))))
             
             # Encode the video using the VideoModelGenerator
-            start_latent, input_image_np, video_latents, fps, height, width, input_video_pixels, end_of_input_video_image_np, input_frames_resized_np = studio_module.current_generator.video_encode(
+            start_latent, input_image_np, video_latents, fps, height, width, input_video_pixels, end_of_input_video_image_np, input_frames_resized_np = device_context.current_generator.video_encode(
                 video_path=job_params['input_image'],  # For Video model, input_image contains the video path
                 resolution=job_params['resolutionW'],
                 no_resize=False,
@@ -393,18 +482,19 @@ def worker(
                 load_model_as_complete(image_encoder, target_device=gpu)
                 
             from diffusers_helper.clip_vision import hf_clip_vision_encode
-            image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
-            image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
+            with device_context.encoder_lock:
+                image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
+                image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
 
-            end_of_input_video_embedding = hf_clip_vision_encode(end_of_input_video_image_np, feature_extractor, image_encoder).last_hidden_state
+                end_of_input_video_embedding = hf_clip_vision_encode(end_of_input_video_image_np, feature_extractor, image_encoder).last_hidden_state
             
             # Store the input video pixels and latents for later use
             input_video_pixels = input_video_pixels.cpu()
             video_latents = video_latents.cpu()
             
             # Store the full video latents in the generator instance for preparing clean latents
-            if hasattr(studio_module.current_generator, 'set_full_video_latents'):
-                studio_module.current_generator.set_full_video_latents(video_latents.clone())
+            if hasattr(device_context.current_generator, 'set_full_video_latents'):
+                device_context.current_generator.set_full_video_latents(video_latents.clone())
                 print(f"Stored full input video latents in VideoModelGenerator. Shape: {video_latents.shape}")
             
             # For Video model, history_latents is initialized with the video_latents
@@ -439,7 +529,7 @@ def worker(
                 # Create a neutral black image to generate a valid "null" CLIP Vision embedding.
                 # This provides the model with a valid, in-distribution unconditional image prompt.
                 # RT_BORG: Clip doesn't understand noise at all. I also tried using
-                #   image_encoder_last_hidden_state = torch.zeros((1, 257, 1152), device=gpu, dtype=studio_module.current_generator.transformer.dtype)
+                #   image_encoder_last_hidden_state = torch.zeros((1, 257, 1152), device=gpu, dtype=device_context.current_generator.transformer.dtype)
                 # to represent a "null" CLIP Vision embedding in the shape for the CLIP encoder,
                 # but the Video model wasn't trained to handle zeros, so using a neutral black image for CLIP.
 
@@ -449,7 +539,8 @@ def worker(
                     load_model_as_complete(image_encoder, target_device=gpu)
 
                 from diffusers_helper.clip_vision import hf_clip_vision_encode
-                image_encoder_output = hf_clip_vision_encode(black_image_np, feature_extractor, image_encoder)
+                with device_context.encoder_lock:
+                    image_encoder_output = hf_clip_vision_encode(black_image_np, feature_extractor, image_encoder)
                 image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
 
             else:
@@ -470,12 +561,17 @@ def worker(
                 # CLIP Vision
                 stream_to_use.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'CLIP Vision encoding ...'))))
 
-                if not high_vram:
-                    load_model_as_complete(image_encoder, target_device=gpu)
+                if prepared_inputs.get('image_encoder_last_hidden_state') is not None:
+                    # Encoded by the prefetcher, the image encoder is not needed
+                    image_encoder_last_hidden_state = prepared_inputs['image_encoder_last_hidden_state'].to(gpu)
+                else:
+                    if not high_vram:
+                        load_model_as_complete(image_encoder, target_device=gpu)
 
-                from diffusers_helper.clip_vision import hf_clip_vision_encode
-                image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
-                image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
+                    from diffusers_helper.clip_vision import hf_clip_vision_encode
+                    with device_context.encoder_lock:
+                        image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
+                    image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
 
         # VAE encode end_frame_image if provided
         end_frame_latent = None
@@ -523,8 +619,9 @@ def worker(
                     if not high_vram: # Ensure image_encoder is on GPU for this operation
                         load_model_as_complete(image_encoder, target_device=gpu)
                     from diffusers_helper.clip_vision import hf_clip_vision_encode
-                    end_clip_embedding = hf_clip_vision_encode(end_frame_np, feature_extractor, image_encoder).last_hidden_state
-                    end_clip_embedding = end_clip_embedding.to(studio_module.current_generator.transformer.dtype)
+                    with device_context.encoder_lock:
+                        end_clip_embedding = hf_clip_vision_encode(end_frame_np, feature_extractor, image_encoder).last_hidden_state
+                    end_clip_embedding = end_clip_embedding.to(device_context.current_generator.transformer.dtype)
                     # Need that dtype conversion for end_clip_embedding? I don't think so, but it was in the original PR.
         
         if not high_vram: # Offload VAE and image_encoder if they were loaded
@@ -534,13 +631,13 @@ def worker(
         # Dtype
         for prompt_key in encoded_prompts:
             llama_vec, llama_attention_mask, clip_l_pooler = encoded_prompts[prompt_key]
-            llama_vec = llama_vec.to(studio_module.current_generator.transformer.dtype)
-            clip_l_pooler = clip_l_pooler.to(studio_module.current_generator.transformer.dtype)
+            llama_vec = llama_vec.to(device_context.current_generator.transformer.dtype)
+            clip_l_pooler = clip_l_pooler.to(device_context.current_generator.transformer.dtype)
             encoded_prompts[prompt_key] = (llama_vec, llama_attention_mask, clip_l_pooler)
 
-        llama_vec_n = llama_vec_n.to(studio_module.current_generator.transformer.dtype)
-        clip_l_pooler_n = clip_l_pooler_n.to(studio_module.current_generator.transformer.dtype)
-        image_encoder_last_hidden_state = image_encoder_last_hidden_state.to(studio_module.current_generator.transformer.dtype)
+        llama_vec_n = llama_vec_n.to(device_context.current_generator.transformer.dtype)
+        clip_l_pooler_n = clip_l_pooler_n.to(device_context.current_generator.transformer.dtype)
+        image_encoder_last_hidden_state = image_encoder_last_hidden_state.to(device_context.current_generator.transformer.dtype)
 
         # Sampling
         stream_to_use.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Start sampling ...'))))
@@ -552,28 +649,42 @@ def worker(
 
         # Initialize history latents based on model type
         if model_type != "Video" and model_type != "Video F1":  # Skip for Video models as we already initialized it
-            history_latents = studio_module.current_generator.prepare_history_latents(height, width)
+            history_latents = device_context.current_generator.prepare_history_latents(height, width)
             
             # For F1 model, initialize with start latent
             if model_type == "F1":
-                history_latents = studio_module.current_generator.initialize_with_start_latent(history_latents, start_latent, has_input_image)
+                history_latents = device_context.current_generator.initialize_with_start_latent(history_latents, start_latent, has_input_image)
                 # If we had a real start image, it was just added to the history_latents
                 total_generated_latent_frames = 1 if has_input_image else 0
             elif model_type == "Original" or model_type == "Original with Endframe":
                 total_generated_latent_frames = 0
 
         history_pixels = None
+
+        # Decoder used for section outputs and previews; the full VAE can be swapped for a lighter one
+        from diffusers_helper.models.latent_decoders import get_latent_decoder
+        section_decoder = get_latent_decoder(settings.get("intermediate_decoder", "vae"), vae=vae, tiny_decoder_path=settings.get("tiny_decoder_path"), device=gpu)
+        if section_decoder.name != "vae":
+            print(f"Using the {section_decoder.name} decoder for section outputs and previews")
+
+        # Latents only until the end: no per-section decodes, VAE swaps or intermediate MP4s
+        deferred_decode = memory_plan["deferred_decode"]
+        if deferred_decode:
+            print("Deferred decode enabled: the video will be decoded once after all sections are sampled")
+        cancelled = False
+
+        # Latent ranges decoded for each section, counted from the side of the history that does not grow
+        section_windows = []
         
         # Get latent paddings from the generator
-        latent_paddings = studio_module.current_generator.get_latent_paddings(total_latent_sections)
+        latent_paddings = device_context.current_generator.get_latent_paddings(total_latent_sections)
 
         # PROMPT BLENDING: Track section index
         section_idx = 0
 
-        # Load LoRAs if selected
-        if selected_loras:
-            lora_folder_from_settings = settings.get("lora_dir")
-            studio_module.current_generator.load_loras(selected_loras, lora_folder_from_settings, lora_loaded_names, lora_values)
+        # Apply the selected LoRAs, only the adapters that changed since the previous job are loaded or deleted
+        lora_folder_from_settings = settings.get("lora_dir")
+        device_context.current_generator.load_loras(selected_loras, lora_folder_from_settings, lora_loaded_names, lora_values, lora_state_dicts=prepared_inputs.get('lora_state_dicts'))
 
             # --- Callback for progress ---
         def callback(d):
@@ -596,8 +707,11 @@ def worker(
             avg_step = sum(step_durations) / len(step_durations) if step_durations else 0.0
 
             preview = d['denoised']
-            from diffusers_helper.hunyuan import vae_decode_fake
-            preview = vae_decode_fake(preview)
+            if section_decoder.name == "tiny":
+                preview = (section_decoder.decode(preview).float() + 1.0) / 2.0
+            else:
+                from diffusers_helper.hunyuan import vae_decode_fake
+                preview = vae_decode_fake(preview)
             preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
             preview = einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
 
@@ -640,7 +754,7 @@ def worker(
             if original_pos < 0: original_pos = 0
 
             hint = segment_hint  # deprecated variable kept to minimise other code changes
-            desc = studio_module.current_generator.format_position_description(
+            desc = device_context.current_generator.format_position_description(
                 total_generated_latent_frames, 
                 current_pos, 
                 original_pos, 
@@ -657,7 +771,7 @@ def worker(
             # Store progress data in the job object if using a job stream
             if job_stream is not None:
                 try:
-                    from studio import job_queue
+                    from engine import job_queue
                     job = job_queue.get_job(job_id)
                     if job:
                         job.progress_data = progress_data
@@ -669,14 +783,9 @@ def worker(
             
             # Always push to the main stream to ensure the UI is updated
             # This is especially important for resumed jobs
-            from studio import stream as main_stream
+            from engine import stream as main_stream
             if main_stream:  # Always push to main stream regardless of whether it's the same as stream_to_use
                 main_stream.output_queue.push(('progress', (preview, desc, make_progress_bar_html(percentage, segment_hint) + make_progress_bar_html(total_percentage, total_hint))))
-                
-            # Also push job ID to main stream to ensure monitoring connection
-            if main_stream:
-                main_stream.output_queue.push(('job_id', job_id))
-                main_stream.output_queue.push(('monitor_job', job_id))
 
         # MagCache / TeaCache Initialization Logic
         magcache = None
@@ -686,22 +795,33 @@ def worker(
         if settings.get("calibrate_magcache"): # Calibration mode (forces MagCache on)
             print("Setting Up MagCache for Calibration")
             is_calibrating = settings.get("calibrate_magcache")
-            studio_module.current_generator.transformer.initialize_teacache(enable_teacache=False) # Ensure TeaCache is off
+            device_context.current_generator.transformer.initialize_teacache(enable_teacache=False) # Ensure TeaCache is off
             magcache = MagCache(model_family=model_family, height=height, width=width, num_steps=steps, is_calibrating=is_calibrating, threshold=magcache_threshold, max_consectutive_skips=magcache_max_consecutive_skips, retention_ratio=magcache_retention_ratio)
-            studio_module.current_generator.transformer.install_magcache(magcache)
+            device_context.current_generator.transformer.install_magcache(magcache)
         elif use_magcache: # User selected MagCache
             print("Setting Up MagCache")
             magcache = MagCache(model_family=model_family, height=height, width=width, num_steps=steps, is_calibrating=False, threshold=magcache_threshold, max_consectutive_skips=magcache_max_consecutive_skips, retention_ratio=magcache_retention_ratio)
-            studio_module.current_generator.transformer.initialize_teacache(enable_teacache=False) # Ensure TeaCache is off
-            studio_module.current_generator.transformer.install_magcache(magcache)
+            device_context.current_generator.transformer.initialize_teacache(enable_teacache=False) # Ensure TeaCache is off
+            device_context.current_generator.transformer.install_magcache(magcache)
         elif use_teacache:
             print("Setting Up TeaCache")
-            studio_module.current_generator.transformer.initialize_teacache(enable_teacache=True, num_steps=teacache_num_steps, rel_l1_thresh=teacache_rel_l1_thresh)
-            studio_module.current_generator.transformer.uninstall_magcache()
+            device_context.current_generator.transformer.initialize_teacache(enable_teacache=True, num_steps=teacache_num_steps, rel_l1_thresh=teacache_rel_l1_thresh)
+            device_context.current_generator.transformer.uninstall_magcache()
         else:
             print("No Transformer Cache in use")
-            studio_module.current_generator.transformer.initialize_teacache(enable_teacache=False)
-            studio_module.current_generator.transformer.uninstall_magcache()
+            device_context.current_generator.transformer.initialize_teacache(enable_teacache=False)
+            device_context.current_generator.transformer.uninstall_magcache()
+
+        # Chunked execution: cap the MLP/attention activation peak using the preserved memory budget
+        if memory_plan["chunked_execution"]:
+            ff_chunk_size = device_context.current_generator.transformer.get_chunk_size_for_memory_budget(settings.get("gpu_memory_preservation", 6))
+            attn_chunk_size = ff_chunk_size if memory_plan["chunked_attention"] else None
+            device_context.current_generator.transformer.enable_chunked_execution(ff_chunk_size, attn_chunk_size)
+        else:
+            device_context.current_generator.transformer.disable_chunked_execution()
+        activation_bucket = get_activation_key(height, width, latent_window_size, memory_plan["chunked_execution"])
+        # Measuring the peak syncs the device, admission only needs it once per activation bucket
+        track_activation_peak = get_admission_mode() != "off" and activation_bucket not in activation_peaks_gb
 
         # --- Main generation loop ---
         # `i_section_loop` will be our loop counter for applying end_frame_latent
@@ -713,6 +833,8 @@ def worker(
                 stream_to_use.output_queue.push(('end', None))
                 return
 
+            stage_timer.start("sampling")
+
             # Calculate the current time position
             if model_type == "Video":
                 # For Video model, add the input video time to the current position
@@ -800,7 +922,7 @@ def worker(
                 
                 # Ensure history_latents is on the correct device (usually CPU for this kind of modification if it's init'd there)
                 # and that the assigned tensor matches its dtype.
-                # The `studio_module.current_generator.prepare_history_latents` initializes it on CPU with float32.
+                # The `device_context.current_generator.prepare_history_latents` initializes it on CPU with float32.
                 if history_latents.shape[2] >= 1: # Check if the 'Depth_slots' dimension is sufficient
                     if model_type == "Original with Endframe":
                         # For Original model, apply to the beginning (position 0)
@@ -824,33 +946,34 @@ def worker(
                 # Get num_cleaned_frames from job_params if available, otherwise use default value of 5
                 num_cleaned_frames = job_params.get('num_cleaned_frames', 5)
                 clean_latent_indices, latent_indices, clean_latent_2x_indices, clean_latent_4x_indices, clean_latents, clean_latents_2x, clean_latents_4x = \
-                studio_module.current_generator.video_prepare_clean_latents_and_indices(end_frame_output_dimensions_latent, end_frame_strength, end_clip_embedding, end_of_input_video_embedding, latent_paddings, latent_padding, latent_padding_size, latent_window_size, video_latents, history_latents, num_cleaned_frames)
+                device_context.current_generator.video_prepare_clean_latents_and_indices(end_frame_output_dimensions_latent, end_frame_strength, end_clip_embedding, end_of_input_video_embedding, latent_paddings, latent_padding, latent_padding_size, latent_window_size, video_latents, history_latents, num_cleaned_frames)
             elif model_type == "Video F1":
                 # Get num_cleaned_frames from job_params if available, otherwise use default value of 5
                 num_cleaned_frames = job_params.get('num_cleaned_frames', 5)
                 clean_latent_indices, latent_indices, clean_latent_2x_indices, clean_latent_4x_indices, clean_latents, clean_latents_2x, clean_latents_4x = \
-                studio_module.current_generator.video_f1_prepare_clean_latents_and_indices(latent_window_size, video_latents, history_latents, num_cleaned_frames)
+                device_context.current_generator.video_f1_prepare_clean_latents_and_indices(latent_window_size, video_latents, history_latents, num_cleaned_frames)
             else:
                 # Prepare indices using the generator
-                clean_latent_indices, latent_indices, clean_latent_2x_indices, clean_latent_4x_indices = studio_module.current_generator.prepare_indices(latent_padding_size, latent_window_size)
+                clean_latent_indices, latent_indices, clean_latent_2x_indices, clean_latent_4x_indices = device_context.current_generator.prepare_indices(latent_padding_size, latent_window_size)
 
                 # Prepare clean latents using the generator
-                clean_latents, clean_latents_2x, clean_latents_4x = studio_module.current_generator.prepare_clean_latents(start_latent, history_latents)
+                clean_latents, clean_latents_2x, clean_latents_4x = device_context.current_generator.prepare_clean_latents(start_latent, history_latents)
             
             # Print debug info
             print(f"{model_type} model section {section_idx+1}/{total_latent_sections}, latent_padding={latent_padding}")
 
             if not high_vram:
                 # Unload VAE etc. before loading transformer
-                unload_complete_models(vae, text_encoder, text_encoder_2, image_encoder)
-                move_model_to_device_with_memory_preservation(studio_module.current_generator.transformer, target_device=gpu, preserved_memory_gb=settings.get("gpu_memory_preservation"))
+                unload_complete_models(vae, text_encoder, text_encoder_2, image_encoder, device=gpu)
+                move_model_to_device_with_memory_preservation(device_context.current_generator.transformer, target_device=gpu, preserved_memory_gb=settings.get("gpu_memory_preservation"))
                 if selected_loras:
-                    studio_module.current_generator.move_lora_adapters_to_device(gpu)
+                    device_context.current_generator.move_lora_adapters_to_device(gpu)
 
 
             from diffusers_helper.pipelines.k_diffusion_hunyuan import sample_hunyuan
+            activation_baseline = start_activation_peak_tracking(gpu) if track_activation_peak else None
             generated_latents = sample_hunyuan(
-                transformer=studio_module.current_generator.transformer,
+                transformer=device_context.current_generator.transformer,
                 width=width,
                 height=height,
                 frames=num_frames,
@@ -877,6 +1000,10 @@ def worker(
                 clean_latent_4x_indices=clean_latent_4x_indices,
                 callback=callback,
             )
+            if track_activation_peak:
+                record_activation_peak(activation_bucket, activation_baseline, gpu)
+                track_activation_peak = False
+            stage_timer.start("decode")
 
             # RT_BORG: Observe the MagCache skip patterns during dev.
             # RT_BORG: We need to use a real logger soon!
@@ -888,36 +1015,53 @@ def worker(
             
             total_generated_latent_frames += int(generated_latents.shape[2])
             # Update history latents using the generator
-            history_latents = studio_module.current_generator.update_history_latents(history_latents, generated_latents)
+            history_latents = device_context.current_generator.update_history_latents(history_latents, generated_latents)
+
+            # Get real history latents using the generator
+            real_history_latents = device_context.current_generator.get_real_history_latents(history_latents, total_generated_latent_frames)
+
+            section_latent_frames = (latent_window_size * 2 + 1) if model_type in ("Original", "Original with Endframe") and has_input_image and is_last_section else device_context.current_generator.get_section_latent_frames(latent_window_size, is_last_section)
+            window_latent_frames = section_latent_frames if section_windows else total_generated_latent_frames
+            section_windows.append((total_generated_latent_frames - window_latent_frames, total_generated_latent_frames))
+
+            if deferred_decode:
+                # Keep the transformer resident and go straight to the next section
+                print(f"{model_type} model section {section_idx+1}/{total_latent_sections} sampled, latent shape {real_history_latents.shape}")
+                if is_last_section:
+                    break
+                if stream_to_use.input_queue.top() == 'end':
+                    # Decode what was sampled so far, like the per-section path writes a video for each section
+                    cancelled = True
+                    break
+                section_idx += 1
+                continue
 
             if not high_vram:
                 if selected_loras:
-                    studio_module.current_generator.move_lora_adapters_to_device(cpu)
-                offload_model_from_device_for_memory_preservation(studio_module.current_generator.transformer, target_device=gpu, preserved_memory_gb=8)
-                load_model_as_complete(vae, target_device=gpu)
-
-            # Get real history latents using the generator
-            real_history_latents = studio_module.current_generator.get_real_history_latents(history_latents, total_generated_latent_frames)
+                    device_context.current_generator.move_lora_adapters_to_device(cpu)
+                offload_model_from_device_for_memory_preservation(device_context.current_generator.transformer, target_device=gpu, preserved_memory_gb=8)
+                if section_decoder.requires_model_swap:
+                    load_model_as_complete(vae, target_device=gpu)
 
             if history_pixels is None:
-                history_pixels = vae_decode(real_history_latents, vae).cpu()
+                history_pixels = HistoryPixelStore(vae_decode(real_history_latents, section_decoder).cpu())
             else:
-                section_latent_frames = (latent_window_size * 2 + 1) if model_type in ("Original", "Original with Endframe") and has_input_image and is_last_section else studio_module.current_generator.get_section_latent_frames(latent_window_size, is_last_section)
                 overlapped_frames = latent_window_size * 4 - 3
 
                 # Get current pixels using the generator
-                current_pixels = studio_module.current_generator.get_current_pixels(real_history_latents, section_latent_frames, vae)
+                current_pixels = device_context.current_generator.get_current_pixels(real_history_latents, section_latent_frames, section_decoder)
                 
                 # Update history pixels using the generator
-                history_pixels = studio_module.current_generator.update_history_pixels(history_pixels, current_pixels, overlapped_frames)
+                history_pixels = device_context.current_generator.update_history_pixels(history_pixels, current_pixels, overlapped_frames)
                 
                 print(f"{model_type} model section {section_idx+1}/{total_latent_sections}, history_pixels shape: {history_pixels.shape}")
 
             if not high_vram:
-                unload_complete_models()
+                unload_complete_models(device=gpu)
 
+            stage_timer.start("save")
             output_filename = os.path.join(output_dir, f'{job_id}_{total_generated_latent_frames}.mp4')
-            save_bcthw_as_mp4(history_pixels, output_filename, fps=30, crf=settings.get("mp4_crf"))
+            history_pixels.save_mp4(output_filename, fps=30, crf=settings.get("mp4_crf"))
             print(f'Decoded. Current latent shape {real_history_latents.shape}; pixel shape {history_pixels.shape}')
             stream_to_use.output_queue.push(('file', output_filename))
 
@@ -930,7 +1074,42 @@ def worker(
             # This section intentionally left empty to remove the in-process combination
             # --- END Main generation loop ---
 
-        magcache = studio_module.current_generator.transformer.magcache
+        # Decode the final video once with the full VAE when sections were not decoded with it
+        if deferred_decode or (not section_decoder.requires_model_swap and settings.get("final_full_vae_decode", True)):
+            print("Decoding the final video with the full VAE")
+            stage_timer.start("decode")
+            if not high_vram:
+                if selected_loras:
+                    device_context.current_generator.move_lora_adapters_to_device(cpu)
+                offload_model_from_device_for_memory_preservation(device_context.current_generator.transformer, target_device=gpu, preserved_memory_gb=8)
+                load_model_as_complete(vae, target_device=gpu)
+
+            # Same windows as the per-section decodes unless admission picked smaller chunks
+            decode_chunk_latent_frames = memory_plan["decode_chunk_latent_frames"]
+            if decode_chunk_latent_frames >= latent_window_size * 2:
+                if device_context.current_generator.appends_sections():
+                    windows = section_windows
+                else:
+                    windows = [(total_generated_latent_frames - end, total_generated_latent_frames - start) for start, end in section_windows]
+                history_pixels = vae_decode_chunked(real_history_latents, vae, windows=windows)
+            else:
+                history_pixels = vae_decode_chunked(real_history_latents, vae, chunk_latent_frames=decode_chunk_latent_frames, overlap_latent_frames=decode_chunk_latent_frames // 2)
+            output_filename = os.path.join(output_dir, f'{job_id}_{total_generated_latent_frames}.mp4')
+
+            if not high_vram:
+                unload_complete_models(device=gpu)
+
+            stage_timer.start("save")
+            history_pixels.save_mp4(output_filename, fps=30, crf=settings.get("mp4_crf"))
+            print(f'Decoded final video with the full VAE. Pixel shape {history_pixels.shape}')
+            stream_to_use.output_queue.push(('file', output_filename))
+
+        if cancelled:
+            stream_to_use.output_queue.push(('end', None))
+            return
+
+        stage_timer.start("postprocess")
+        magcache = device_context.current_generator.transformer.magcache
         if magcache is not None:
             if magcache.is_calibrating:
                 output_file = os.path.join(settings.get("output_dir"), "magcache_configuration.txt")
@@ -938,27 +1117,27 @@ def worker(
                 magcache.append_calibration_to_file(output_file)
             elif magcache.is_enabled:
                 print(f"MagCache ({100.0 * magcache.total_cache_hits / magcache.total_cache_requests:.2f}%) skipped {magcache.total_cache_hits} of {magcache.total_cache_requests} steps.")
-            studio_module.current_generator.transformer.uninstall_magcache()
+            device_context.current_generator.transformer.uninstall_magcache()
             magcache = None
 
         # Handle the results
         result = pipeline.handle_results(job_params, output_filename)
 
-        # Unload all LoRAs after generation completed
-        if selected_loras:
-            print("Unloading all LoRAs after generation completed")
-            studio_module.current_generator.unload_loras()
-            import gc
-            gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
+        try:
+            get_cost_model().record(cost_params, stage_timer.stop())
+        except Exception as e:
+            print(f"Error recording stage timings: {e}")
 
+    except JobRejectedError as e:
+        # Nothing has been loaded or generated yet
+        print(f"Job rejected: {e}")
+        stream_to_use.output_queue.push(('error', str(e)))
     except Exception as e:
         traceback.print_exc()
         # Unload all LoRAs after error
-        if studio_module.current_generator is not None and selected_loras:
+        if device_context.current_generator is not None:
             print("Unloading all LoRAs after error")
-            studio_module.current_generator.unload_loras()
+            device_context.current_generator.unload_loras()
             import gc
             gc.collect()
             if torch.cuda.is_available():
@@ -968,11 +1147,15 @@ def worker(
         if not high_vram:
             # Ensure all models including the potentially active transformer are unloaded on error
             unload_complete_models(
-                text_encoder, text_encoder_2, image_encoder, vae, 
-                studio_module.current_generator.transformer if studio_module.current_generator else None
+                *device_context.loaded_models(),
+                *([device_context.current_generator.transformer] if device_context.current_generator else []),
+                device=gpu
             )
     finally:
         # This finally block is associated with the main try block (starts around line 154)
+        if not high_vram:
+            print(f"Model swap bandwidth: {swap_bandwidth_report()}")
+
         if settings.get("clean_up_videos"):
             try:
                 video_files = [
@@ -1030,9 +1213,9 @@ def worker(
                         combined_output_filename = os.path.join(output_dir, f'{job_id}_combined_v1.mp4')
                         combined_result = None
                         try:
-                            if hasattr(studio_module.current_generator, 'combine_videos'):
+                            if hasattr(device_context.current_generator, 'combine_videos'):
                                 print(f"Using VideoModelGenerator.combine_videos to create side-by-side comparison")
-                                combined_result = studio_module.current_generator.combine_videos(
+                                combined_result = device_context.current_generator.combine_videos(
                                     source_video_path=input_video_path,
                                     generated_video_path=final_video_path_for_combine, # Use the correct variable
                                     output_path=combined_output_filename
@@ -1100,7 +1283,7 @@ def worker(
                 # input_frames_resized_np = job_params.get('input_frames_resized_np')
 
                 # RT_BORG: I cringe calliing methods on BaseModelGenerator that only exist on VideoBaseGenerator, until we refactor
-                input_frames_resized_np, fps, target_height, target_width = studio_module.current_generator.extract_video_frames(
+                input_frames_resized_np, fps, target_height, target_width = device_context.current_generator.extract_video_frames(
                     is_for_encode=False,
                     video_path=job_params['input_image'],
                     resolution=job_params['resolutionW'],
@@ -1108,8 +1291,8 @@ def worker(
                     input_files_dir=job_params['input_files_dir']
                 )
 
-                # history_pixels is (B, C, T, H, W), float32, [-1,1], on CPU
-                if input_frames_resized_np is not None and history_pixels.numel() > 0 : # Check if history_pixels is not empty
+                # history_pixels is a HistoryPixelStore of (B, C, T, H, W) frames on CPU
+                if input_frames_resized_np is not None and history_pixels.num_frames > 0 : # Check if history_pixels is not empty
                     combined_sequential_output_filename = os.path.join(output_dir, f'{job_id}_combined.mp4')
                     
                     # fps variable should be from the video_encode call earlier.
@@ -1119,7 +1302,7 @@ def worker(
                     # Call the new function from video_tools.py
                     combined_sequential_result_path = combine_videos_sequentially_from_tensors(
                         processed_input_frames_np=input_frames_resized_np,
-                        generated_frames_pt=history_pixels,
+                        generated_frames_pt=history_pixels.to_bcthw(),
                         output_path=combined_sequential_output_filename,
                         target_fps=input_video_fps_for_combine,
                         crf_value=current_crf
@@ -1131,11 +1314,11 @@ def worker(
                 traceback.print_exc()
     
     # Final verification of LoRA state
-    if studio_module.current_generator and studio_module.current_generator.transformer:
+    if device_context.current_generator and device_context.current_generator.transformer:
         # Verify LoRA state
         has_loras = False
-        if hasattr(studio_module.current_generator.transformer, 'peft_config'):
-            adapter_names = list(studio_module.current_generator.transformer.peft_config.keys()) if studio_module.current_generator.transformer.peft_config else []
+        if hasattr(device_context.current_generator.transformer, 'peft_config'):
+            adapter_names = list(device_context.current_generator.transformer.peft_config.keys()) if device_context.current_generator.transformer.peft_config else []
             if adapter_names:
                 has_loras = True
                 print(f"Transformer has LoRAs: {', '.join(adapter_names)}")
@@ -1145,7 +1328,7 @@ def worker(
             print(f"Transformer has no peft_config attribute")
             
         # Check for any LoRA modules
-        for name, module in studio_module.current_generator.transformer.named_modules():
+        for name, module in device_context.current_generator.transformer.named_modules():
             if hasattr(module, 'lora_A') and module.lora_A:
                 has_loras = True
             if hasattr(module, 'lora_B') and module.lora_B:
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+MANIFEST_NAME = "queue_manifest.json"
+
+# Already compressed formats, deflating them again costs CPU time for no size gain
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.webp', '.gif',
+    '.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv',
+    '.zip', '.safetensors',
+}
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.gif')
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _crc32_file(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _compress_type_for(path):
+    ext = os.path.splitext(path)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def write_queue_archive(output_path, serialized_jobs, media_dirs=("queue_images", "input_files"), max_workers=None):
+    """
+    Writes the queue export zip.
+
+    Members are streamed from disk, already compressed media is stored as is and only text members are
+    deflated. Files are hashed in parallel and identical contents are written once: duplicates are listed in
+    queue_manifest.json as aliases of the first member with the same content.
+
+    Args:
+        output_path: Path of the zip file to create
+        serialized_jobs: The queue.json content
+        media_dirs: Directories whose files are exported under their directory name
+        max_workers: Number of hashing threads
+
+    Returns:
+        dict: Number of written and deduplicated members
+    """
+    files = []
+    for media_dir in media_dirs:
+        if not os.path.isdir(media_dir):
+            print(f"Warning: {media_dir} directory not found or empty")
+            os.makedirs(media_dir, exist_ok=True)
+            continue
+        for file in sorted(os.listdir(media_dir)):
+            file_path = os.path.join(media_dir, file)
+            if os.path.isfile(file_path):
+                files.append((file_path, f"{os.path.basename(media_dir)}/{file}"))
+
+    # Hashing is I/O and hashlib bound, both release the GIL
+    max_workers = max_workers or min(8, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = list(executor.map(lambda entry: _hash_file(entry[0]), files))
+
+    members_by_digest = {}
+    aliases = {}
+    tmp_path = f"{output_path}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+        zipf.writestr("queue.json", json.dumps(serialized_jobs, indent=2))
+
+        for (file_path, arcname), digest in zip(files, digests):
+            if digest in members_by_digest:
+                aliases[arcname] = members_by_digest[digest]
+                continue
+            members_by_digest[digest] = arcname
+
+            zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+            zinfo.compress_type = _compress_type_for(file_path)
+            with open(file_path, "rb") as src, zipf.open(zinfo, 'w', force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+        zipf.writestr(MANIFEST_NAME, json.dumps({
+            "version": 1,
+            "aliases": aliases,
+            "sha256": {arcname: digest for digest, arcname in members_by_digest.items()},
+        }, indent=2))
+
+    os.replace(tmp_path, output_path)
+    print(f"Exported {len(members_by_digest)} files to {output_path}, {len(aliases)} duplicates stored once")
+    return {"written": len(members_by_digest), "deduplicated": len(aliases)}
+
+
+def _referenced_members(job_id, job_data):
+    """Archive members that a job needs once imported"""
+    members = {f"queue_images/{job_id}_input.png", f"queue_images/{job_id}_end_frame.png"}
+    for key in ("saved_input_image_path", "saved_end_frame_image_path"):
+        if isinstance(job_data.get(key), str):
+            members.add(f"queue_images/{os.path.basename(job_data[key])}")
+
+    input_video = job_data.get("input_video")
+    input_image_path = job_data.get("input_image_path")
+    if isinstance(input_video, str):
+        members.add(f"input_files/{os.path.basename(input_video)}")
+    elif isinstance(input_image_path, str) and input_image_path.lower().endswith(VIDEO_EXTENSIONS):
+        members.add(f"input_files/{os.path.basename(input_image_path)}")
+    return members
+
+
+class QueueArchiveReader:
+    """
+    Reads a queue export zip without unpacking it.
+
+    queue.json is parsed first, media members are then extracted on demand straight to their target
+    directory. Aliases written by write_queue_archive are resolved, and archives from older exports
+    (without a manifest) work the same way.
+    """
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.zipf = zipfile.ZipFile(zip_path, 'r')
+        self.names = set(self.zipf.namelist())
+
+        self.aliases = {}
+        if MANIFEST_NAME in self.names:
+            try:
+                self.aliases = json.loads(self.zipf.read(MANIFEST_NAME)).get("aliases", {})
+            except Exception as e:
+                print(f"Error reading {MANIFEST_NAME} from {zip_path}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.zipf.close()
+
+    def read_queue(self):
+        if "queue.json" not in self.names:
+            return None
+        return json.loads(self.zipf.read("queue.json"))
+
+    def has_member(self, arcname):
+        return arcname in self.names or arcname in self.aliases
+
+    def extract_member(self, arcname, target_path):
+        """
+        Streams a member to target_path. An existing file with the same size and CRC is left untouched.
+
+        Returns:
+            bool: True if the member exists in the archive
+        """
+        source_name = self.aliases.get(arcname, arcname)
+        if source_name not in self.names:
+            return False
+
+        zinfo = self.zipf.getinfo(source_name)
+        if os.path.isfile(target_path) and os.path.getsize(target_path) == zinfo.file_size \
+                and _crc32_file(target_path) == zinfo.CRC:
+            return True
+
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        tmp_path = f"{target_path}.tmp"
+        with self.zipf.open(zinfo) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        os.replace(tmp_path, target_path)
+        print(f"Extracted {arcname} to {target_path}")
+        return True
+
+    def extract_for_jobs(self, serialized_jobs, skip_statuses=('completed', 'failed', 'cancelled')):
+        """Extracts only the media referenced by the jobs that will be imported"""
+        members = set()
+        for job_id, job_data in serialized_jobs.items():
+            if job_data.get('status') in skip_statuses:
+                continue
+            members |= _referenced_members(job_id, job_data)
+
+        extracted = 0
+        for arcname in sorted(members):
+            if self.has_member(arcname):
+                target_dir, file = arcname.split("/", 1)
+                if self.extract_member(arcname, os.path.join(target_dir, file)):
+                    extracted += 1
+        return extracted
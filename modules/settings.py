@@ -19,6 +19,13 @@ class Settings:
         self.default_settings = {
             "save_metadata": True,
             "gpu_memory_preservation": float(os.environ.get("FRAMEPACK_GPU_MEMORY_PRESERVED", "6.0")),
+            "chunked_execution": os.environ.get("FRAMEPACK_CHUNKED_EXECUTION", "false").lower() == "true", # Run transformer MLPs in sequence chunks to lower the activation peak
+            "chunked_attention": os.environ.get("FRAMEPACK_CHUNKED_ATTENTION", "false").lower() == "true", # Also chunk attention queries (requires chunked_execution)
+            "intermediate_decoder": os.environ.get("FRAMEPACK_INTERMEDIATE_DECODER", "vae"), # Decoder for section outputs and previews: "vae", "tiny" or "linear"
+            "tiny_decoder_path": os.environ.get("FRAMEPACK_TINY_DECODER_PATH", str(home_root / "tiny_decoder.safetensors")),
+            "deferred_decode": os.environ.get("FRAMEPACK_DEFERRED_DECODE", "false").lower() == "true", # Sample all sections first, decode and write the video once at the end
+            "final_full_vae_decode": os.environ.get("FRAMEPACK_FINAL_FULL_VAE_DECODE", "true").lower() == "true", # Re-decode the final video with the full VAE when a lighter intermediate decoder is used
+            "fuse_loras": os.environ.get("FRAMEPACK_FUSE_LORAS", "false").lower() == "true", # Merge the weighted LoRAs into the transformer weights before sampling, restored afterwards
             "output_dir": os.environ.get("FRAMEPACK_OUTPUT_DIR", str(home_root / "outputs")),
             "metadata_dir": os.environ.get("FRAMEPACK_METADATA_DIR", str(home_root / "metadata")),
             "lora_dir": os.environ.get("FRAMEPACK_LORAS_DIR", str(home_root / "loras")),
@@ -0,0 +1,261 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.paths import get_local_dir
+
+
+THUMBNAIL_SIZE = 100
+
+# Placeholder colors, kept from the synchronous implementation so failures stay visible in the queue
+NO_FRAMES_COLOR = (0, 0, 255)
+ERROR_COLOR = (0, 255, 0)
+
+
+def get_default_cache_dir():
+    """FRAMEPACK_THUMBNAIL_CACHE_DIR, by default on the local disk of the node"""
+    return os.environ.get("FRAMEPACK_THUMBNAIL_CACHE_DIR", os.path.join(get_local_dir(), "thumbnails"))
+
+
+def get_thumbnail_cache_max_bytes():
+    """Disk budget of the thumbnail cache, FRAMEPACK_THUMBNAIL_CACHE_MB, 0 for no limit"""
+    return int(float(os.environ.get("FRAMEPACK_THUMBNAIL_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def _encode_png(img):
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def _to_data_url(png_bytes):
+    return f"data:image/png;base64,{base64.b64encode(png_bytes).decode()}"
+
+
+def make_solid_thumbnail(color, size=THUMBNAIL_SIZE):
+    return _to_data_url(_encode_png(Image.new('RGB', (size, size), color)))
+
+
+def read_last_video_frame(path):
+    """Returns the last frame of a video, seeking directly when the frame count is known."""
+    import imageio
+
+    reader = imageio.get_reader(path)
+    try:
+        num_frames = None
+        try:
+            num_frames = reader.get_meta_data().get('nframes')
+            if (num_frames is None or num_frames == float('inf')) and hasattr(reader, 'count_frames'):
+                num_frames = reader.count_frames()
+        except Exception as e:
+            print(f"Error getting frame count for {path}: {e}")
+
+        if num_frames and num_frames != float('inf'):
+            try:
+                return reader.get_data(int(num_frames) - 1)
+            except Exception as e:
+                print(f"Error seeking to the last frame of {path}: {e}")
+
+        last_frame = None
+        for frame in reader:
+            last_frame = frame
+        return last_frame
+    finally:
+        reader.close()
+
+
+class ThumbnailService:
+    """
+    Builds queue thumbnails on a small background thread pool.
+
+    Thumbnails are cached on disk as PNG files keyed by (source hash, size), and in memory as data URLs,
+    so jobs that share an input image or video reuse the same thumbnail, including across restarts and
+    queue imports. Concurrent requests for the same source share a single render.
+
+    Sources are identified by the hash of the pixels for images, and by path, size and modification time
+    for videos, which avoids reading the whole video file just to look up the cache.
+
+    The files are kept under `max_bytes` by removing the least recently used ones, a cache hit refreshes
+    the modification time of its file.
+    """
+
+    def __init__(self, cache_dir=None, max_workers=2, memory_entries=512, max_bytes=0):
+        self.cache_dir = cache_dir or get_default_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.disk_bytes = sum(size for _, size, _ in self._scan())
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self.memory_entries = memory_entries
+        self.memory_cache = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def source_key(source):
+        if isinstance(source, np.ndarray):
+            h = hashlib.sha1(np.ascontiguousarray(source).data)
+            h.update(f"{source.shape}{source.dtype}".encode())
+            return "img_" + h.hexdigest()
+
+        stat = os.stat(source)
+        identity = f"{os.path.realpath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return "vid_" + hashlib.sha1(identity.encode()).hexdigest()
+
+    def _cache_path(self, key, size):
+        return os.path.join(self.cache_dir, f"{key}_{size}.png")
+
+    def _scan(self):
+        """(path, size, mtime) of the cached files"""
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".png"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # Removed by another process
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def evict(self):
+        """Removes the least recently used files until the cache fits in max_bytes"""
+        if not self.max_bytes:
+            return 0
+        with self.lock:
+            if self.disk_bytes <= self.max_bytes:
+                return 0
+            # Rescanned, other processes of the node may share the folder
+            files = sorted(self._scan(), key=lambda item: item[2])
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for path, size, _ in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self.disk_bytes = total
+        return removed
+
+    def _remember(self, cache_key, thumbnail):
+        with self.lock:
+            self.memory_cache[cache_key] = thumbnail
+            self.memory_cache.move_to_end(cache_key)
+            while len(self.memory_cache) > self.memory_entries:
+                self.memory_cache.popitem(last=False)
+
+    def _render(self, source, size):
+        if isinstance(source, np.ndarray):
+            frame = source
+        else:
+            frame = read_last_video_frame(source)
+            if frame is None:
+                print(f"No frames were read from {source}, using placeholder thumbnail")
+                return None
+
+        img = Image.fromarray(frame)
+        img.thumbnail((size, size))
+        return _encode_png(img)
+
+    def _build(self, source, size):
+        try:
+            key = self.source_key(source)
+        except Exception as e:
+            print(f"Error reading thumbnail source: {e}")
+            return make_solid_thumbnail(ERROR_COLOR, size)
+
+        cache_key = (key, size)
+        with self.lock:
+            if cache_key in self.memory_cache:
+                self.memory_cache.move_to_end(cache_key)
+                return self.memory_cache[cache_key]
+            pending = self.in_flight.get(cache_key)
+            if pending is None:
+                pending = self.in_flight[cache_key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            pending.wait()
+            with self.lock:
+                if cache_key in self.memory_cache:
+                    return self.memory_cache[cache_key]
+            return make_solid_thumbnail(ERROR_COLOR, size)
+
+        try:
+            path = self._cache_path(key, size)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    thumbnail = _to_data_url(f.read())
+                os.utime(path)
+            else:
+                png_bytes = self._render(source, size)
+                if png_bytes is None:
+                    thumbnail = make_solid_thumbnail(NO_FRAMES_COLOR, size)
+                else:
+                    # Write then rename so a concurrent reader never sees a partial file
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(png_bytes)
+                    os.replace(tmp_path, path)
+                    thumbnail = _to_data_url(png_bytes)
+                    with self.lock:
+                        self.disk_bytes += len(png_bytes)
+                    self.evict()
+            self._remember(cache_key, thumbnail)
+            return thumbnail
+        except Exception as e:
+            print(f"Error creating thumbnail: {e}")
+            return make_solid_thumbnail(ERROR_COLOR, size)
+        finally:
+            with self.lock:
+                self.in_flight.pop(cache_key, None)
+            pending.set()
+
+    def submit(self, source, callback=None, size=THUMBNAIL_SIZE):
+        """
+        Schedules a thumbnail for an image array or a video path and returns immediately.
+
+        Args:
+            source: numpy image array or path to a video file
+            callback: Called with the thumbnail data URL from a pool thread once it is ready
+            size: Maximum width and height
+
+        Returns:
+            A Future resolving to the thumbnail data URL
+        """
+        future = self.executor.submit(self._build, source, size)
+        if callback is not None:
+            future.add_done_callback(lambda f: f.exception() is None and callback(f.result()))
+        return future
+
+    def get(self, source, size=THUMBNAIL_SIZE):
+        """Blocking variant of submit"""
+        return self._build(source, size)
+
+
+_thumbnail_service = None
+_thumbnail_service_lock = threading.Lock()
+
+
+def get_thumbnail_service():
+    global _thumbnail_service
+    with _thumbnail_service_lock:
+        if _thumbnail_service is None:
+            _thumbnail_service = ThumbnailService(
+                max_workers=int(os.environ.get("FRAMEPACK_THUMBNAIL_WORKERS", "2")),
+                max_bytes=get_thumbnail_cache_max_bytes(),
+            )
+        return _thumbnail_service
@@ -20,8 +20,6 @@ from tqdm.auto import tqdm
 
 from torchvision.transforms.functional import to_tensor, to_pil_image
 
-from modules.toolbox.rife_core import RIFEHandler
-from modules.toolbox.esrgan_core import ESRGANUpscaler
 from modules.toolbox.message_manager import MessageManager
 
 device_name_str = devicetorch.get(torch)
@@ -31,9 +29,10 @@ VIDEO_QUALITY = 8 # Used by imageio.mimwrite quality/quantizer
 class VideoProcessor:
     def __init__(self, message_manager: MessageManager, settings):
         self.message_manager = message_manager
-        self.rife_handler = RIFEHandler(message_manager)
         self.device_obj = torch.device(device_name_str) # Store device_obj
-        self.esrgan_upscaler = ESRGANUpscaler(message_manager, self.device_obj)
+        # RIFE and Real-ESRGAN pull in basicsr / realesrgan, they are created on first use
+        self._rife_handler = None
+        self._esrgan_upscaler = None
         self.settings = settings
         self.project_root = Path(__file__).resolve().parents[2]
         
@@ -67,6 +66,20 @@ class VideoProcessor:
         os.makedirs(self.reassembled_video_target_path, exist_ok=True)
 
     # --- NEW BATCH PROCESSING FUNCTION ---
+
+    @property
+    def rife_handler(self):
+        if self._rife_handler is None:
+            from modules.toolbox.rife_core import RIFEHandler
+            self._rife_handler = RIFEHandler(self.message_manager)
+        return self._rife_handler
+
+    @property
+    def esrgan_upscaler(self):
+        if self._esrgan_upscaler is None:
+            from modules.toolbox.esrgan_core import ESRGANUpscaler
+            self._esrgan_upscaler = ESRGANUpscaler(self.message_manager, self.device_obj)
+        return self._esrgan_upscaler
     def tb_process_video_batch(self, video_paths: list, pipeline_config: dict, progress=gr.Progress()):
         """
         Processes a batch of videos according to a defined pipeline of operations.
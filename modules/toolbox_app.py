@@ -59,9 +59,7 @@ sys.modules.setdefault('torchvision.transforms.functional_tensor', functional_te
 
 # --- Local Application Imports ---
 from modules.settings import Settings
-from modules.toolbox.esrgan_core import ESRGANUpscaler
 from modules.toolbox.message_manager import MessageManager
-from modules.toolbox.rife_core import RIFEHandler
 from modules.toolbox.setup_ffmpeg import setup_ffmpeg
 from modules.toolbox.system_monitor import SystemMonitor
 from modules.toolbox.toolbox_processor import VideoProcessor
@@ -857,7 +855,10 @@ def tb_handle_delete_studio_transformer():
     log_messages_from_action = []
 
     studio_module_instance = None
-    if '__main__' in sys.modules and hasattr(sys.modules['__main__'], 'current_generator'):
+    if 'engine' in sys.modules and hasattr(sys.modules['engine'], 'current_generator'):
+        studio_module_instance = sys.modules['engine']
+        print("Found studio context in sys.modules['engine'].")
+    elif '__main__' in sys.modules and hasattr(sys.modules['__main__'], 'current_generator'):
         studio_module_instance = sys.modules['__main__']
         print("Found studio context in __main__.")
     elif 'studio' in sys.modules and hasattr(sys.modules['studio'], 'current_generator'):
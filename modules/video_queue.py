@@ -3,18 +3,20 @@ import time
 import uuid
 import json
 import os
-import zipfile
-import shutil
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Dict, Any, Optional, List
 import queue as queue_module  # Renamed to avoid conflicts
-import io
-import base64
 from PIL import Image
 import numpy as np
 
 from diffusers_helper.thread_utils import AsyncStream
+from modules.job_scheduler import JobScheduler, get_job_affinity_key
+from modules.cost_model import get_cost_model
+from modules.job_store import SQLiteJobStore
+from modules.job_prefetch import JobPrefetcher, get_prefetch_max_bytes
+from modules.queue_archive import QueueArchiveReader, write_queue_archive
+from modules.thumbnail_service import get_thumbnail_service, make_solid_thumbnail
 from modules.pipelines.metadata_utils import create_metadata
 from modules.settings import Settings
 from diffusers_helper.gradio.progress_bar import make_progress_bar_html
@@ -77,6 +79,7 @@ class Job:
     generation_type: Optional[str] = None # Added generation_type
     input_image_saved: bool = False  # Flag to track if input image has been saved
     end_frame_image_saved: bool = False  # Flag to track if end frame image has been saved
+    priority: int = 0  # Higher priority jobs are scheduled first
 
     def __post_init__(self):
         # Store generation type
@@ -85,189 +88,9 @@ class Job:
         # Store input image or latent type
         if 'input_image' in self.params and self.params['input_image'] is not None:
             self.input_image = self.params['input_image']
-            # Create thumbnail
-            if isinstance(self.input_image, np.ndarray):
-                # Handle numpy array (image)
-                img = Image.fromarray(self.input_image)
-                img.thumbnail((100, 100))
-                buffered = io.BytesIO()
-                img.save(buffered, format="PNG")
-                self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-            elif isinstance(self.input_image, str):
-                # Handle string (video path)
-                try:
-                    print(f"Attempting to extract thumbnail from video: {self.input_image}")
-                    # Try to extract frames from the video using imageio
-                    import imageio
-                    
-                    # Check if the file exists
-                    if not os.path.exists(self.input_image):
-                        print(f"Video file not found: {self.input_image}")
-                        raise FileNotFoundError(f"Video file not found: {self.input_image}")
-                    
-                    # Create outputs directory if it doesn't exist
-                    os.makedirs("outputs", exist_ok=True)
-                    
-                    # Try to open the video file
-                    try:
-                        reader = imageio.get_reader(self.input_image)
-                        print(f"Successfully opened video file with imageio")
-                    except Exception as e:
-                        print(f"Failed to open video with imageio: {e}")
-                        raise
-                    
-                    # Get the total number of frames
-                    num_frames = None
-                    try:
-                        # Try to get the number of frames from metadata
-                        meta_data = reader.get_meta_data()
-                        print(f"Video metadata: {meta_data}")
-                        num_frames = meta_data.get('nframes')
-                        if num_frames is None or num_frames == float('inf'):
-                            print("Number of frames not available in metadata")
-                            # If not available, try to count frames
-                            if hasattr(reader, 'count_frames'):
-                                print("Trying to count frames...")
-                                num_frames = reader.count_frames()
-                                print(f"Counted {num_frames} frames")
-                    except Exception as e:
-                        print(f"Error getting frame count: {e}")
-                        num_frames = None
-                    
-                    # If we couldn't determine the number of frames, read the last frame by iterating
-                    if num_frames is None or num_frames == float('inf'):
-                        print("Reading frames by iteration to find the last one")
-                        # Read frames until we reach the end
-                        frame_count = 0
-                        first_frame = None
-                        last_frame = None
-                        try:
-                            for frame in reader:
-                                if frame_count == 0:
-                                    first_frame = frame
-                                last_frame = frame
-                                frame_count += 1
-                                # Print progress every 100 frames
-                                if frame_count % 100 == 0:
-                                    print(f"Read {frame_count} frames...")
-                            print(f"Finished reading {frame_count} frames")
-                            
-                            # Save the first frame if available
-                            if first_frame is not None:
-                                print(f"Found first frame with shape: {first_frame.shape}")
-                                # DEBUG IMAGE SAVING REMOVED
-                        except Exception as e:
-                            print(f"Error reading frames: {e}")
-                        
-                        if last_frame is not None:
-                            print(f"Found last frame with shape: {last_frame.shape}")
-                            
-                            # DEBUG IMAGE SAVING REMOVED
-                            # Use the last frame for the thumbnail
-                            img = Image.fromarray(last_frame)
-                            img.thumbnail((100, 100))
-                            buffered = io.BytesIO()
-                            img.save(buffered, format="PNG")
-                            self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                            print("Successfully created thumbnail from last frame")
-                        else:
-                            print("No frames were read, using red thumbnail")
-                            # Fallback to red thumbnail if no frames were read - more visible for debugging
-                            img = Image.new('RGB', (100, 100), (255, 0, 0))  # Red for video
-                            buffered = io.BytesIO()
-                            img.save(buffered, format="PNG")
-                            self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                    else:
-                        # If we know the number of frames, try to get multiple frames for debugging
-                        try:
-                            # Try to get the first frame
-                            first_frame = None
-                            try:
-                                first_frame = reader.get_data(0)
-                                print(f"Got first frame with shape: {first_frame.shape}")
-                                
-                                # DEBUG IMAGE SAVING REMOVED
-                            except Exception as e:
-                                print(f"Error getting first frame: {e}")
-                            
-                            # Try to get a middle frame
-                            middle_frame = None
-                            try:
-                                middle_frame_idx = int(num_frames / 2)
-                                middle_frame = reader.get_data(middle_frame_idx)
-                                print(f"Got middle frame (frame {middle_frame_idx}) with shape: {middle_frame.shape}")
-                                
-                                # DEBUG IMAGE SAVING REMOVED
-                            except Exception as e:
-                                print(f"Error getting middle frame: {e}")
-                            
-                            # Try to get the last frame
-                            last_frame = None
-                            try:
-                                last_frame_idx = int(num_frames) - 1
-                                last_frame = reader.get_data(last_frame_idx)
-                                print(f"Got last frame (frame {last_frame_idx}) with shape: {last_frame.shape}")
-                                
-                                # DEBUG IMAGE SAVING REMOVED
-                            except Exception as e:
-                                print(f"Error getting last frame: {e}")
-                            
-                            # If we couldn't get the last frame directly, try to get it by iterating
-                            if last_frame is None:
-                                print("Trying to get last frame by iterating through all frames")
-                                try:
-                                    for frame in reader:
-                                        last_frame = frame
-                                    
-                                    if last_frame is not None:
-                                        print(f"Got last frame by iteration with shape: {last_frame.shape}")
-                                        
-                                        # DEBUG IMAGE SAVING REMOVED
-                                except Exception as e:
-                                    print(f"Error getting last frame by iteration: {e}")
-                            
-                            # Use the last frame for the thumbnail if available, otherwise use the middle or first frame
-                            frame_for_thumbnail = last_frame if last_frame is not None else (middle_frame if middle_frame is not None else first_frame)
-                            
-                            if frame_for_thumbnail is not None:
-                                # Convert to PIL Image and create a thumbnail
-                                img = Image.fromarray(frame_for_thumbnail)
-                                img.thumbnail((100, 100))
-                                buffered = io.BytesIO()
-                                img.save(buffered, format="PNG")
-                                self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                                print("Successfully created thumbnail from frame")
-                            else:
-                                print("No frames were extracted, using blue thumbnail")
-                                # Fallback to blue thumbnail if no frames were extracted
-                                img = Image.new('RGB', (100, 100), (0, 0, 255))  # Blue for video
-                                buffered = io.BytesIO()
-                                img.save(buffered, format="PNG")
-                                self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                        except Exception as e:
-                            # Fallback to blue thumbnail on error
-                            img = Image.new('RGB', (100, 100), (0, 0, 255))  # Blue for video
-                            buffered = io.BytesIO()
-                            img.save(buffered, format="PNG")
-                            self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                    
-                    # Close the reader
-                    try:
-                        reader.close()
-                        print("Successfully closed video reader")
-                    except Exception as e:
-                        print(f"Error closing reader: {e}")
-                    
-                except Exception as e:
-                    print(f"Error extracting thumbnail from video: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    # Fallback to bright green thumbnail on error to make it more visible
-                    img = Image.new('RGB', (100, 100), (0, 255, 0))  # Bright green for error
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="PNG")
-                    self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-                    print("Created bright green fallback thumbnail")
+            # The thumbnail is built in the background and filled in when ready, see ThumbnailService
+            if isinstance(self.input_image, (np.ndarray, str)):
+                get_thumbnail_service().submit(self.input_image, callback=self._set_thumbnail)
             else:
                 # Handle other types
                 self.thumbnail = None
@@ -281,26 +104,112 @@ class Job:
                 "Green Screen": (0, 177, 64)
             }
             color = color_map.get(self.latent_type, (0, 0, 0))
-            img = Image.new('RGB', (100, 100), color)
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            self.thumbnail = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+            self.thumbnail = make_solid_thumbnail(color)
+
+    def _set_thumbnail(self, thumbnail):
+        self.thumbnail = thumbnail
 
 
 class VideoJobQueue:
     def __init__(self):
-        self.queue = queue_module.Queue()  # Using standard Queue instead of LifoQueue
+        self.queue = JobScheduler(fairness_window=int(os.environ.get("FRAMEPACK_SCHEDULER_FAIRNESS_WINDOW", "4")))
         self.jobs = {}
-        self.current_job = None
+        self.running_jobs = {}  # Worker name -> job it is processing
         self.lock = threading.Lock()
-        self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
-        self.worker_thread.start()
         self.worker_function = None  # Will be set from outside
-        self.is_processing = False  # Flag to track if we're currently processing a job
+        self.device_pool = None
+        self.worker_threads = []
+        self.prefetcher = None  # Prepares the next job while the current one runs, see JobPrefetcher
+
+        # Each transition only writes the job that changed, see SQLiteJobStore
+        self.store = SQLiteJobStore()
+        # Jobs queued before the first timings of their kind get a cost once one is recorded
+        get_cost_model().add_listener(self.refresh_scheduled_costs)
+        self.progress_persisted_at = {}
+        # Finished jobs are only removed by "Clear Complete", older ones are dropped at startup
+        retention_days = float(os.environ.get("FRAMEPACK_JOB_RETENTION_DAYS", "7"))
+        pruned = self.store.prune([JobStatus.COMPLETED.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value], retention_days * 24 * 3600)
+        if pruned:
+            print(f"Removed {pruned} finished jobs older than {retention_days:g} days from {self.store.path}")
+        restore_default = "false" if os.environ.get("RUNPOD_WEBHOOK_GET_JOB") else "true"
+        if os.environ.get("FRAMEPACK_RESTORE_QUEUE", restore_default).lower() == "true":
+            self.restore_from_store()
+
+    @property
+    def current_job(self):
+        """The running job, the first one when several devices are busy"""
+        return next(iter(list(self.running_jobs.values())), None)
+
+    @property
+    def is_processing(self):
+        return bool(self.running_jobs)
+
+    def get_running_jobs(self):
+        """Dict of worker name -> running job"""
+        return dict(self.running_jobs)
     
-    def set_worker_function(self, worker_function):
-        """Set the worker function to use for processing jobs"""
+    def set_worker_function(self, worker_function, device_pool=None):
+        """Set the worker function to use for processing jobs and start the workers
+        
+        Args:
+            worker_function: Called with the job parameters, and `device_context` when a device pool is used
+            device_pool: Optional DevicePool, one worker is started per device and jobs go to the first free one
+        """
         self.worker_function = worker_function
+        if self.worker_threads:
+            return
+
+        # Workers start once the worker function is known, so jobs restored from the store can run
+        self.device_pool = device_pool
+
+        # Prepared inputs stay in this process, they cannot be handed to worker processes
+        from modules.worker_process import get_worker_mode
+        prefetch_max_bytes = get_prefetch_max_bytes()
+        if prefetch_max_bytes > 0 and get_worker_mode() != "process":
+            self.prefetcher = JobPrefetcher(prefetch_max_bytes, Settings())
+        devices = device_pool.devices if device_pool is not None else [None]
+        for device in devices:
+            worker_name = str(device) if device is not None else "default"
+            thread = threading.Thread(target=self._worker_loop, args=(device,), name=f"job-worker-{worker_name}", daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+
+    def _prefetch_next_job(self, device_context=None):
+        """Starts preparing the job that will run next, see JobPrefetcher"""
+        if self.prefetcher is None:
+            return
+        next_job_id = self.queue.peek()
+        with self.lock:
+            next_job = self.jobs.get(next_job_id) if next_job_id else None
+            if next_job is None or next_job.status != JobStatus.PENDING or next_job.job_type != JobType.SINGLE:
+                return
+            params = {k: v for k, v in next_job.params.items() if k not in ('end_frame_image_original', 'end_frame_strength_original')}
+        self.prefetcher.prefetch(next_job_id, params, device_context)
+
+    def _schedule_job(self, job, front=False):
+        """Add a job to the scheduler with its priority, affinity key and predicted runtime"""
+        self.queue.put(job.id, priority=job.priority, affinity_key=get_job_affinity_key(job.params), front=front,
+                       cost=self.predict_job_runtime(job))
+
+    def refresh_scheduled_costs(self):
+        """Predicts the runtime of the scheduled jobs again, after the cost model recorded new timings"""
+        with self.lock:
+            jobs = [self.jobs[job_id] for job_id in self.queue.scheduled_order() if job_id in self.jobs]
+        self.queue.update_costs({job.id: self.predict_job_runtime(job) for job in jobs})
+
+    def predict_job_runtime(self, job):
+        """Predicted runtime of a job in seconds from the timings of past jobs, None when unknown"""
+        if job.job_type == JobType.GRID:
+            return 0.0  # The grid itself only schedules its children
+        try:
+            return get_cost_model().predict_runtime(job.params)
+        except Exception as e:
+            print(f"Error predicting runtime for job {job.id}: {e}")
+            return None
+
+    def get_scheduled_order(self):
+        """Get the IDs of the scheduled jobs in the order they will run"""
+        return self.queue.scheduled_order()
     
     def serialize_job(self, job):
         """Serialize a job to a JSON-compatible format"""
@@ -316,6 +225,7 @@ class VideoJobQueue:
                 "result": job.result,
                 "queue_position": job.queue_position,
                 "generation_type": job.generation_type,
+                "priority": job.priority,
             }
             
             # Add simplified params (excluding complex objects)
@@ -390,6 +300,107 @@ class VideoJobQueue:
                 "error": f"Error serializing: {str(e)}"
             }
     
+    def _save_job_images(self, job, queue_images_dir="queue_images"):
+        """Save a job's input and end frame images to disk if they haven't been saved yet"""
+        os.makedirs(queue_images_dir, exist_ok=True)
+        job_id = job.id
+
+        # Save input image to disk if it exists and hasn't been saved yet
+        if 'input_image' in job.params and isinstance(job.params['input_image'], np.ndarray) and not job.input_image_saved:
+            input_image_path = os.path.join(queue_images_dir, f"{job_id}_input.png")
+            try:
+                Image.fromarray(job.params['input_image']).save(input_image_path)
+                print(f"Saved input image for job {job_id} to {input_image_path}")
+                # Mark the image as saved
+                job.input_image_saved = True
+            except Exception as e:
+                print(f"Error saving input image for job {job_id}: {e}")
+        
+        # Save end frame image to disk if it exists and hasn't been saved yet
+        if 'end_frame_image' in job.params and isinstance(job.params['end_frame_image'], np.ndarray) and not job.end_frame_image_saved:
+            end_frame_image_path = os.path.join(queue_images_dir, f"{job_id}_end_frame.png")
+            try:
+                Image.fromarray(job.params['end_frame_image']).save(end_frame_image_path)
+                print(f"Saved end frame image for job {job_id} to {end_frame_image_path}")
+                # Mark the end frame image as saved
+                job.end_frame_image_saved = True
+            except Exception as e:
+                print(f"Error saving end frame image for job {job_id}: {e}")
+
+    def _serialize_job_metadata(self, job, settings, queue_images_dir="queue_images"):
+        """Serialize a job to the dict stored per job in queue.json and in the job store"""
+        job_id = job.id
+        try:
+            # Create metadata using the central utility
+            metadata = create_metadata(job.params, job.id, settings.settings)
+            
+            # Add job status and other fields not included in metadata
+            metadata.update({
+                "id": job.id,
+                "status": job.status.value,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "completed_at": job.completed_at,
+                "error": job.error,
+                "result": job.result,
+                "queue_position": job.queue_position,
+                "priority": job.priority,
+            })
+            
+            # Add image paths to metadata if they've been saved
+            if job.input_image_saved:
+                input_image_path = os.path.join(queue_images_dir, f"{job_id}_input.png")
+                if os.path.exists(input_image_path):
+                    metadata["saved_input_image_path"] = input_image_path
+            
+            if job.end_frame_image_saved:
+                end_frame_image_path = os.path.join(queue_images_dir, f"{job_id}_end_frame.png")
+                if os.path.exists(end_frame_image_path):
+                    metadata["saved_end_frame_image_path"] = end_frame_image_path
+            
+            return metadata
+        except Exception as e:
+            print(f"Error using metadata_utils for job {job_id}: {e}")
+            # Fall back to the old serialization method
+            return self.serialize_job(job)
+
+    def persist_job(self, job, settings=None):
+        """Write a single job to the job store after a transition. Does not take self.lock."""
+        try:
+            if settings is None:
+                settings = Settings()
+            self._save_job_images(job)
+            metadata = self._serialize_job_metadata(job, settings)
+            self.store.upsert(job.id, job.status.value, metadata, priority=job.priority, created_at=job.created_at)
+        except Exception as e:
+            print(f"Error persisting job {job.id}: {e}")
+
+    def persist_job_progress(self, job, desc):
+        """Record the latest progress description, at most once every few seconds per job"""
+        now = time.time()
+        if now - self.progress_persisted_at.get(job.id, 0) < 2.0:
+            return
+        self.progress_persisted_at[job.id] = now
+        try:
+            self.store.update_progress(job.id, desc)
+        except Exception as e:
+            print(f"Error persisting progress for job {job.id}: {e}")
+
+    def restore_from_store(self):
+        """Re-queue the pending and interrupted (running) jobs from the job store after a restart"""
+        try:
+            serialized_jobs = self.store.load(statuses=[JobStatus.PENDING.value, JobStatus.RUNNING.value])
+            if not serialized_jobs:
+                return 0
+            loaded_count = self._load_serialized_jobs(serialized_jobs)
+            print(f"Restored {loaded_count} pending jobs from {self.store.path}")
+            return loaded_count
+        except Exception as e:
+            import traceback
+            print(f"Error restoring queue from job store: {e}")
+            traceback.print_exc()
+            return 0
+
     def save_queue_to_json(self):
         """Save the current queue to queue.json using the central metadata utility"""
         try:
@@ -408,66 +419,14 @@ class VideoJobQueue:
             for job_id in job_ids:
                 job = self.get_job(job_id)
                 if job:
-                    # Save input image to disk if it exists and hasn't been saved yet
-                    if 'input_image' in job.params and isinstance(job.params['input_image'], np.ndarray) and not job.input_image_saved:
-                        input_image_path = os.path.join(queue_images_dir, f"{job_id}_input.png")
-                        try:
-                            Image.fromarray(job.params['input_image']).save(input_image_path)
-                            print(f"Saved input image for job {job_id} to {input_image_path}")
-                            # Mark the image as saved
-                            job.input_image_saved = True
-                        except Exception as e:
-                            print(f"Error saving input image for job {job_id}: {e}")
-                    
-                    # Save end frame image to disk if it exists and hasn't been saved yet
-                    if 'end_frame_image' in job.params and isinstance(job.params['end_frame_image'], np.ndarray) and not job.end_frame_image_saved:
-                        end_frame_image_path = os.path.join(queue_images_dir, f"{job_id}_end_frame.png")
-                        try:
-                            Image.fromarray(job.params['end_frame_image']).save(end_frame_image_path)
-                            print(f"Saved end frame image for job {job_id} to {end_frame_image_path}")
-                            # Mark the end frame image as saved
-                            job.end_frame_image_saved = True
-                        except Exception as e:
-                            print(f"Error saving end frame image for job {job_id}: {e}")
+                    self._save_job_images(job, queue_images_dir)
             
             # Now serialize jobs with the updated image saved flags
             serialized_jobs = {}
             for job_id in job_ids:
                 job = self.get_job(job_id)
                 if job:
-                    # Try to use metadata_utils.create_metadata if possible
-                    try:
-                        # Create metadata using the central utility
-                        metadata = create_metadata(job.params, job.id, settings.settings)
-                        
-                        # Add job status and other fields not included in metadata
-                        metadata.update({
-                            "id": job.id,
-                            "status": job.status.value,
-                            "created_at": job.created_at,
-                            "started_at": job.started_at,
-                            "completed_at": job.completed_at,
-                            "error": job.error,
-                            "result": job.result,
-                            "queue_position": job.queue_position,
-                        })
-                        
-                        # Add image paths to metadata if they've been saved
-                        if job.input_image_saved:
-                            input_image_path = os.path.join(queue_images_dir, f"{job_id}_input.png")
-                            if os.path.exists(input_image_path):
-                                metadata["saved_input_image_path"] = input_image_path
-                        
-                        if job.end_frame_image_saved:
-                            end_frame_image_path = os.path.join(queue_images_dir, f"{job_id}_end_frame.png")
-                            if os.path.exists(end_frame_image_path):
-                                metadata["saved_end_frame_image_path"] = end_frame_image_path
-                        
-                        serialized_jobs[job_id] = metadata
-                    except Exception as e:
-                        print(f"Error using metadata_utils for job {job_id}: {e}")
-                        # Fall back to the old serialization method
-                        serialized_jobs[job_id] = self.serialize_job(job)
+                    serialized_jobs[job_id] = self._serialize_job_metadata(job, settings, queue_images_dir)
             
             # Save to file
             with open("queue.json", "w") as f:
@@ -478,8 +437,10 @@ class VideoJobQueue:
             self.cleanup_orphaned_videos(job_ids)
                 
             print(f"Saved {len(serialized_jobs)} jobs to queue.json")
+            return serialized_jobs
         except Exception as e:
             print(f"Error saving queue to JSON: {e}")
+            return None
     
     def cleanup_orphaned_videos(self, current_job_ids_uuids): # Renamed arg for clarity
         """
@@ -646,6 +607,7 @@ class VideoJobQueue:
             
             # Now ensure all current jobs have their images saved
             saved_count = 0
+            updated_jobs = []
             with self.lock:
                 for job_id, job in self.jobs.items():
                     # Only save images for running or completed jobs
@@ -656,6 +618,7 @@ class VideoJobQueue:
                             try:
                                 Image.fromarray(job.params['input_image']).save(input_image_path)
                                 job.input_image_saved = True
+                                updated_jobs.append(job)
                                 saved_count += 1
                                 print(f"Saved input image for job {job_id}")
                             except Exception as e:
@@ -667,13 +630,15 @@ class VideoJobQueue:
                             try:
                                 Image.fromarray(job.params['end_frame_image']).save(end_frame_image_path)
                                 job.end_frame_image_saved = True
+                                updated_jobs.append(job)
                                 saved_count += 1
                                 print(f"Saved end frame image for job {job_id}")
                             except Exception as e:
                                 print(f"Error saving end frame image for job {job_id}: {e}")
             
-            # Save the queue to ensure the image paths are properly referenced
-            self.save_queue_to_json()
+            # Persist the jobs whose image paths changed so they are properly referenced
+            for job in {job.id: job for job in updated_jobs}.values():
+                self.persist_job(job)
             
             if removed_count > 0 or saved_count > 0:
                 print(f"Queue image synchronization: removed {removed_count} images, saved {saved_count} images")
@@ -682,7 +647,7 @@ class VideoJobQueue:
             print(f"Error synchronizing queue images: {e}")
 
     
-    def add_job(self, params, job_type=JobType.SINGLE, child_job_params_list=None, parent_job_id=None):
+    def add_job(self, params, job_type=JobType.SINGLE, child_job_params_list=None, parent_job_id=None, priority=0):
         """Add a job to the queue and return its ID"""
         job_id = str(uuid.uuid4())
         
@@ -703,7 +668,8 @@ class VideoJobQueue:
                         progress_data={},
                         stream=AsyncStream(),
                         input_image_saved=False,
-                        end_frame_image_saved=False
+                        end_frame_image_saved=False,
+                        priority=priority
                     )
                     self.jobs[child_job_id] = child_job
                     print(f"  - Created child job {child_job_id} for grid job {job_id}")
@@ -719,19 +685,24 @@ class VideoJobQueue:
             progress_data={},
             stream=AsyncStream(),
             input_image_saved=False,
-            end_frame_image_saved=False
+            end_frame_image_saved=False,
+            priority=priority
         )
 
         with self.lock:
-            print(f"Adding job {job_id} (type: {job_type.value}) to queue.")
+            print(f"Adding job {job_id} (type: {job_type.value}, priority: {priority}) to queue.")
             self.jobs[job_id] = job
-            self.queue.put(job_id) # Only the parent (or single) job is added to the queue initially
+            self._schedule_job(job) # Only the parent (or single) job is added to the queue initially
         
-        # Save the queue to JSON after adding a new job (outside the lock)
-        try:
-            self.save_queue_to_json()
-        except Exception as e:
-            print(f"Error saving queue to JSON after adding job: {e}")
+        # Persist the new job and its grid children (outside the lock)
+        settings = Settings()
+        for child_job_id in child_job_ids:
+            self.persist_job(self.jobs[child_job_id], settings)
+        self.persist_job(job, settings)
+        
+        # A job added while the workers are busy is prepared right away (CPU stages only)
+        if self.is_processing:
+            self._prefetch_next_job()
         
         return job_id
     
@@ -755,6 +726,9 @@ class VideoJobQueue:
             if job.status == JobStatus.PENDING:
                 job.status = JobStatus.CANCELLED
                 job.completed_at = time.time()  # Mark completion time
+                self.queue.remove(job_id)
+                if self.prefetcher is not None:
+                    self.prefetcher.discard(job_id)
                 result = True
             elif job.status == JobStatus.RUNNING:
                 # Send cancel signal to the job's stream
@@ -772,12 +746,9 @@ class VideoJobQueue:
             else:
                 result = False
         
-        # Save the queue to JSON after cancelling a job (outside the lock)
+        # Persist the cancelled job (outside the lock)
         if result:
-            try:
-                self.save_queue_to_json()
-            except Exception as e:
-                print(f"Error saving queue to JSON after cancelling job: {e}")
+            self.persist_job(job)
         
         return result
     
@@ -800,27 +771,24 @@ class VideoJobQueue:
                             job.status = JobStatus.CANCELLED
                             job.completed_at = time.time()
                             cancelled_count += 1
+                    if self.prefetcher is not None:
+                        self.prefetcher.discard(job_id)
                 except Exception as e:
                     print(f"Error cancelling job {job_id}: {e}")
             
             # Now clear the queue
             with self.lock:
                 # Clear the queue (this doesn't affect running jobs)
-                queue_items_cleared = 0
                 try:
-                    while not self.queue.empty():
-                        try:
-                            self.queue.get_nowait()
-                            self.queue.task_done()
-                            queue_items_cleared += 1
-                        except queue_module.Empty:
-                            break
+                    self.queue.clear()
                 except Exception as e:
                     print(f"Error clearing queue: {e}")
             
-            # Save the updated queue state
+            # Persist the cancelled jobs
             try:
-                self.save_queue_to_json()
+                for job in self.get_all_jobs():
+                    if job.id in pending_job_ids:
+                        self.persist_job(job)
             except Exception as e:
                 print(f"Error saving queue state: {e}")
             
@@ -856,9 +824,12 @@ class VideoJobQueue:
                 except Exception as e:
                     print(f"Error removing job {job_id}: {e}")
             
-            # Save the updated queue state
+            # Remove the jobs from the store and clean up their files
             try:
-                self.save_queue_to_json()
+                self.store.delete(completed_job_ids)
+                with self.lock:
+                    remaining_job_ids = list(self.jobs.keys())
+                self.cleanup_orphaned_videos(remaining_job_ids)
             except Exception as e:
                 print(f"Error saving queue state: {e}")
             
@@ -874,8 +845,15 @@ class VideoJobQueue:
             traceback.print_exc()
             return 0
     
-    def get_queue_position(self, job_id):
-        """Get position in queue (0 = currently running)"""
+    def get_queue_positions(self):
+        """
+        Positions of every pending job in the scheduled order, for refreshing the whole queue at once.
+        Pass the result to get_queue_position for each job.
+        """
+        return self.queue.scheduled_positions()
+
+    def get_queue_position(self, job_id, positions=None):
+        """Get position in queue (0 = currently running), `positions` from get_queue_positions when refreshing many jobs"""
         with self.lock:
             job = self.jobs.get(job_id)
             if not job:
@@ -887,13 +865,48 @@ class VideoJobQueue:
             if job.status != JobStatus.PENDING:
                 return None
                 
-            # Count pending jobs ahead in queue
-            position = 1  # Start at 1 because 0 means running
-            for j in self.jobs.values():
-                if (j.status == JobStatus.PENDING and 
-                    j.created_at < job.created_at):
-                    position += 1
-            return position
+            # Position in the scheduled order (priority and affinity aware), starting at 1 because 0 means running.
+            # The positions of all jobs come from one replay, cached by the scheduler until the queue changes.
+            if positions is None:
+                positions = self.queue.scheduled_positions()
+            if job_id in positions:
+                return positions[job_id]
+
+            # Pending grid children are only scheduled once their parent starts
+            return len(positions) + 1
+
+    def get_job_estimate(self, job_id):
+        """
+        Predicted runtime of a job and, while it is pending, the predicted wait before it starts.
+
+        Returns:
+            dict with `predicted_runtime` and `queue_wait` in seconds (None when unknown), or None if the job does not exist
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return None
+            predicted_runtime = self.predict_job_runtime(job)
+
+            queue_wait = None
+            if job.status == JobStatus.RUNNING:
+                queue_wait = 0.0
+            elif job.status == JobStatus.PENDING:
+                now = time.time()
+                busy_until = []
+                for running_job in self.running_jobs.values():
+                    running_runtime = self.predict_job_runtime(running_job)
+                    if running_runtime is None:
+                        break
+                    busy_until.append(max(running_runtime - (now - (running_job.started_at or now)), 0.0))
+                else:
+                    busy_until += [0.0] * max(len(self.worker_threads) - len(busy_until), 0)
+                    queue_wait = self.queue.estimate_wait_times(busy_until or [0.0]).get(job_id)
+
+        return {
+            "predicted_runtime": predicted_runtime,
+            "queue_wait": queue_wait,
+        }
     
     def update_job_progress(self, job_id, progress_data):
         """Update job progress data"""
@@ -922,49 +935,12 @@ class VideoJobQueue:
                 output_path = os.path.join(output_dir, "queue_export.zip")
             
             # Make sure queue.json is up to date
-            self.save_queue_to_json()
+            serialized_jobs = self.save_queue_to_json()
+            if serialized_jobs is None:
+                serialized_jobs = {}
             
-            # Create a zip file
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Add queue.json to the zip file
-                if os.path.exists("queue.json"):
-                    zipf.write("queue.json")
-                    print(f"Added queue.json to {output_path}")
-                else:
-                    print("Warning: queue.json not found, creating an empty one")
-                    with open("queue.json", "w") as f:
-                        json.dump({}, f)
-                    zipf.write("queue.json")
-                
-                # Add queue_images directory to the zip file if it exists
-                queue_images_dir = "queue_images"
-                if os.path.exists(queue_images_dir) and os.path.isdir(queue_images_dir):
-                    for root, _, files in os.walk(queue_images_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            # Add file to zip with path relative to queue_images_dir
-                            arcname = os.path.join(os.path.basename(queue_images_dir), file)
-                            zipf.write(file_path, arcname)
-                            print(f"Added {file_path} to {output_path}")
-                else:
-                    print(f"Warning: {queue_images_dir} directory not found or empty")
-                    # Create the directory if it doesn't exist
-                    os.makedirs(queue_images_dir, exist_ok=True)
-
-                # Add input_files directory to the zip file if it exists
-                input_files_dir = "input_files"
-                if os.path.exists(input_files_dir) and os.path.isdir(input_files_dir):
-                    for root, _, files in os.walk(input_files_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            # Add file to zip with path relative to input_files_dir
-                            arcname = os.path.join(os.path.basename(input_files_dir), file)
-                            zipf.write(file_path, arcname)
-                            print(f"Added {file_path} to {output_path}")
-                else:
-                    print(f"Warning: {input_files_dir} directory not found or empty")
-                    # Create the directory if it doesn't exist
-                    os.makedirs(input_files_dir, exist_ok=True)
+            # Stream the queue and its media into the zip file
+            write_queue_archive(output_path, serialized_jobs, media_dirs=("queue_images", "input_files"))
             
             print(f"Queue exported to {output_path}")
             return output_path
@@ -979,7 +955,8 @@ class VideoJobQueue:
         """Load queue from a JSON file or zip file
         
         Args:
-            file_path: Path to the JSON or ZIP file. If None, uses 'queue.json' in the current directory.
+            file_path: Path to the JSON or ZIP file. If None, the pending jobs are restored from the job store,
+                queue.json is only written by exports and may be stale.
             
         Returns:
             int: Number of jobs loaded
@@ -990,9 +967,9 @@ class VideoJobQueue:
             import json
             from pathlib import PurePath
             
-            # Use default path if none provided
+            # The job store is the source of truth, not a queue.json left by an earlier export
             if file_path is None:
-                file_path = "queue.json"
+                return self.restore_from_store()
             
             # Check if file exists
             if not os.path.exists(file_path):
@@ -1007,195 +984,7 @@ class VideoJobQueue:
             with open(file_path, 'r') as f:
                 serialized_jobs = json.load(f)
             
-            # Count of jobs loaded
-            loaded_count = 0
-            
-            # Process each job
-            with self.lock:
-                for job_id, job_data in serialized_jobs.items():
-                    # Skip if job already exists
-                    if job_id in self.jobs:
-                        print(f"Job {job_id} already exists, skipping")
-                        continue
-                    
-                    # Skip completed, failed, or cancelled jobs
-                    status = job_data.get('status')
-                    if status in ['completed', 'failed', 'cancelled']:
-                        print(f"Skipping job {job_id} with status {status}")
-                        continue
-                    
-                    # If the job was running when saved, we'll need to set it as the current job
-                    was_running = (status == 'running')
-                    
-                    # Extract relevant fields to construct params
-                    params = {
-                        # Basic parameters
-                        'model_type': job_data.get('model_type', 'Original'),
-                        'prompt_text': job_data.get('prompt', ''),
-                        'n_prompt': job_data.get('negative_prompt', ''),
-                        'seed': job_data.get('seed', 0),
-                        'steps': job_data.get('steps', 25),
-                        'cfg': job_data.get('cfg', 1.0),
-                        'gs': job_data.get('gs', 10.0),
-                        'rs': job_data.get('rs', 0.0),
-                        'latent_type': job_data.get('latent_type', 'Black'),
-                        'total_second_length': job_data.get('total_second_length', 6),
-                        'blend_sections': job_data.get('blend_sections', 4),
-                        'latent_window_size': job_data.get('latent_window_size', 9),
-                        'resolutionW': job_data.get('resolutionW', 640),
-                        'resolutionH': job_data.get('resolutionH', 640),
-                        'use_magcache': job_data.get('use_magcache', False),
-                        'magcache_threshold': job_data.get('magcache_threshold', 0.1),
-                        'magcache_max_consecutive_skips': job_data.get('magcache_max_consecutive_skips', 2),
-                        'magcache_retention_ratio': job_data.get('magcache_retention_ratio', 0.25),
-                        
-                        # Initialize image parameters
-                        'input_image': None,
-                        'end_frame_image': None,
-                        'end_frame_strength': job_data.get('end_frame_strength', 1.0),
-                        'use_teacache': job_data.get('use_teacache', True),
-                        'teacache_num_steps': job_data.get('teacache_num_steps', 25),
-                        'teacache_rel_l1_thresh': job_data.get('teacache_rel_l1_thresh', 0.15),
-                        'has_input_image': job_data.get('has_input_image', True),
-                        'combine_with_source': job_data.get('combine_with_source', False),
-                    }
-                    
-                    # Load input image from disk if saved path exists
-                    if "saved_input_image_path" in job_data and os.path.exists(job_data["saved_input_image_path"]):
-                        try:
-                            input_image_path = job_data["saved_input_image_path"]
-                            print(f"Loading input image from {input_image_path}")
-                            input_image = np.array(Image.open(input_image_path))
-                            params['input_image'] = input_image
-                            params['input_image_path'] = input_image_path  # Store the path for reference
-                            params['has_input_image'] = True
-                        except Exception as e:
-                            print(f"Error loading input image for job {job_id}: {e}")
-                    
-                    # Load video from disk if saved path exists
-                    input_video_val = job_data.get("input_video") # Get value safely
-                    if isinstance(input_video_val, str): # Check if it's a string path
-                        if os.path.exists(input_video_val): # Now it's safe to call os.path.exists
-                            try:
-                                video_path = input_video_val # Use the validated string path
-                                print(f"Loading video from {video_path}")
-                                params['input_image'] = video_path
-                                params['input_image_path'] = video_path
-                                params['has_input_image'] = True
-                            except Exception as e:
-                                print(f"Error loading video for job {job_id}: {e}")
-                    
-                    # Load end frame image from disk if saved path exists
-                    if "saved_end_frame_image_path" in job_data and os.path.exists(job_data["saved_end_frame_image_path"]):
-                        try:
-                            end_frame_image_path = job_data["saved_end_frame_image_path"]
-                            print(f"Loading end frame image from {end_frame_image_path}")
-                            end_frame_image = np.array(Image.open(end_frame_image_path))
-                            params['end_frame_image'] = end_frame_image
-                            params['end_frame_image_path'] = end_frame_image_path  # Store the path for reference
-                            # Make sure end_frame_strength is set if this is an endframe model
-                            if params['model_type'] == "Original with Endframe" or params['model_type'] == "F1 with Endframe":
-                                if 'end_frame_strength' not in params or params['end_frame_strength'] is None:
-                                    params['end_frame_strength'] = job_data.get('end_frame_strength', 1.0)
-                                    print(f"Set end_frame_strength to {params['end_frame_strength']} for job {job_id}")
-                        except Exception as e:
-                            print(f"Error loading end frame image for job {job_id}: {e}")
-                    
-                    # Add LoRA information if present
-                    if 'loras' in job_data:
-                        lora_data = job_data.get('loras', {})
-                        selected_loras = list(lora_data.keys())
-                        lora_values = list(lora_data.values())
-                        params['selected_loras'] = selected_loras
-                        params['lora_values'] = lora_values
-                        
-                        # Ensure the selected LoRAs are also in lora_loaded_names
-                        # This is critical for metadata_utils.create_metadata to find the LoRAs
-                        from modules.settings import Settings
-                        settings = Settings()
-                        lora_dir = settings.get("lora_dir", "loras")
-                        
-                        # Get the current lora_loaded_names from the system
-                        import os
-                        from pathlib import PurePath
-                        current_lora_names = []
-                        if os.path.isdir(lora_dir):
-                            for root, _, files in os.walk(lora_dir):
-                                for file in files:
-                                    if file.endswith('.safetensors') or file.endswith('.pt'):
-                                        lora_relative_path = os.path.relpath(os.path.join(root, file), lora_dir)
-                                        lora_name = str(PurePath(lora_relative_path).with_suffix(''))
-                                        current_lora_names.append(lora_name)
-                        
-                        # Combine the selected LoRAs with the current lora_loaded_names
-                        # This ensures that all selected LoRAs are in lora_loaded_names
-                        combined_lora_names = list(set(current_lora_names + selected_loras))
-                        params['lora_loaded_names'] = combined_lora_names
-                        
-                        print(f"Loaded LoRA data for job {job_id}: {lora_data}")
-                        print(f"Combined lora_loaded_names: {combined_lora_names}")
-                    
-                    # Get settings for output_dir and metadata_dir
-                    settings = Settings()
-                    output_dir = settings.get("output_dir")
-                    metadata_dir = settings.get("metadata_dir")
-                    input_files_dir = settings.get("input_files_dir")
-                    
-                    # Add these directories to the params
-                    params['output_dir'] = output_dir
-                    params['metadata_dir'] = metadata_dir
-                    params['input_files_dir'] = input_files_dir
-                    
-                    # Create a dummy preview image for the job
-                    dummy_preview = np.zeros((64, 64, 3), dtype=np.uint8)
-                    
-                    # Create progress data with the dummy preview
-                    from diffusers_helper.gradio.progress_bar import make_progress_bar_html
-                    initial_progress_data = {
-                        'preview': dummy_preview,
-                        'desc': 'Imported job...',
-                        'html': make_progress_bar_html(0, 'Imported job...')
-                    }
-                    
-                    # Create a dummy preview image for the job
-                    dummy_preview = np.zeros((64, 64, 3), dtype=np.uint8)
-                    
-                    # Create progress data with the dummy preview
-                    from diffusers_helper.gradio.progress_bar import make_progress_bar_html
-                    initial_progress_data = {
-                        'preview': dummy_preview,
-                        'desc': 'Imported job...',
-                        'html': make_progress_bar_html(0, 'Imported job...')
-                    }
-                    
-                    # Create a new job
-                    job = Job(
-                        id=job_id,
-                        params=params,
-                        status=JobStatus(job_data.get('status', 'pending')),
-                        created_at=job_data.get('created_at', time.time()),
-                        progress_data={},
-                        stream=AsyncStream(),
-                        # Mark images as saved if their paths exist in the job data
-                        input_image_saved="saved_input_image_path" in job_data and os.path.exists(job_data["saved_input_image_path"]),
-                        end_frame_image_saved="saved_end_frame_image_path" in job_data and os.path.exists(job_data["saved_end_frame_image_path"])
-                    )
-                    
-                    # Add job to the internal jobs dictionary
-                    self.jobs[job_id] = job
-                    
-                    # If a job was marked "running" in the JSON, reset it to "pending"
-                    # and add it to the processing queue.
-                    if was_running:
-                        print(f"Job {job_id} was 'running', resetting to 'pending' and adding to queue.")
-                        job.status = JobStatus.PENDING
-                        job.started_at = None # Clear started_at for re-queued job
-                        job.progress_data = {} # Reset progress
-                    
-                    # Add all non-completed/failed/cancelled jobs (now including reset 'running' ones) to the processing queue
-                    if job.status == JobStatus.PENDING:
-                        self.queue.put(job_id)
-                        loaded_count += 1
+            loaded_count = self._load_serialized_jobs(serialized_jobs)
             
             # Synchronize queue images after loading the queue
             self.synchronize_queue_images()
@@ -1209,6 +998,215 @@ class VideoJobQueue:
             traceback.print_exc()
             return 0
     
+    def _load_serialized_jobs(self, serialized_jobs):
+        """Create and schedule jobs from their serialized form (queue.json entries or job store rows)
+
+        Args:
+            serialized_jobs: Dict of job ID -> serialized job data
+
+        Returns:
+            int: Number of jobs loaded
+        """
+        # Count of jobs loaded
+        loaded_count = 0
+        loaded_job_ids = []
+        
+        # Process each job
+        with self.lock:
+            for job_id, job_data in serialized_jobs.items():
+                # Skip if job already exists
+                if job_id in self.jobs:
+                    print(f"Job {job_id} already exists, skipping")
+                    continue
+                
+                # Skip completed, failed, or cancelled jobs
+                status = job_data.get('status')
+                if status in ['completed', 'failed', 'cancelled']:
+                    print(f"Skipping job {job_id} with status {status}")
+                    continue
+                
+                # If the job was running when saved, we'll need to set it as the current job
+                was_running = (status == 'running')
+                
+                # Extract relevant fields to construct params
+                params = {
+                    # Basic parameters
+                    'model_type': job_data.get('model_type', 'Original'),
+                    'prompt_text': job_data.get('prompt', ''),
+                    'n_prompt': job_data.get('negative_prompt', ''),
+                    'seed': job_data.get('seed', 0),
+                    'steps': job_data.get('steps', 25),
+                    'cfg': job_data.get('cfg', 1.0),
+                    'gs': job_data.get('gs', 10.0),
+                    'rs': job_data.get('rs', 0.0),
+                    'latent_type': job_data.get('latent_type', 'Black'),
+                    'total_second_length': job_data.get('total_second_length', 6),
+                    'blend_sections': job_data.get('blend_sections', 4),
+                    'latent_window_size': job_data.get('latent_window_size', 9),
+                    'resolutionW': job_data.get('resolutionW', 640),
+                    'resolutionH': job_data.get('resolutionH', 640),
+                    'use_magcache': job_data.get('use_magcache', False),
+                    'magcache_threshold': job_data.get('magcache_threshold', 0.1),
+                    'magcache_max_consecutive_skips': job_data.get('magcache_max_consecutive_skips', 2),
+                    'magcache_retention_ratio': job_data.get('magcache_retention_ratio', 0.25),
+                    
+                    # Initialize image parameters
+                    'input_image': None,
+                    'end_frame_image': None,
+                    'end_frame_strength': job_data.get('end_frame_strength', 1.0),
+                    'use_teacache': job_data.get('use_teacache', True),
+                    'teacache_num_steps': job_data.get('teacache_num_steps', 25),
+                    'teacache_rel_l1_thresh': job_data.get('teacache_rel_l1_thresh', 0.15),
+                    'has_input_image': job_data.get('has_input_image', True),
+                    'combine_with_source': job_data.get('combine_with_source', False),
+                }
+                
+                # Load input image from disk if saved path exists
+                if "saved_input_image_path" in job_data and os.path.exists(job_data["saved_input_image_path"]):
+                    try:
+                        input_image_path = job_data["saved_input_image_path"]
+                        print(f"Loading input image from {input_image_path}")
+                        input_image = np.array(Image.open(input_image_path))
+                        params['input_image'] = input_image
+                        params['input_image_path'] = input_image_path  # Store the path for reference
+                        params['has_input_image'] = True
+                    except Exception as e:
+                        print(f"Error loading input image for job {job_id}: {e}")
+                
+                # Load video from disk if saved path exists
+                input_video_val = job_data.get("input_video") # Get value safely
+                if isinstance(input_video_val, str): # Check if it's a string path
+                    if os.path.exists(input_video_val): # Now it's safe to call os.path.exists
+                        try:
+                            video_path = input_video_val # Use the validated string path
+                            print(f"Loading video from {video_path}")
+                            params['input_image'] = video_path
+                            params['input_image_path'] = video_path
+                            params['has_input_image'] = True
+                        except Exception as e:
+                            print(f"Error loading video for job {job_id}: {e}")
+                
+                # Load end frame image from disk if saved path exists
+                if "saved_end_frame_image_path" in job_data and os.path.exists(job_data["saved_end_frame_image_path"]):
+                    try:
+                        end_frame_image_path = job_data["saved_end_frame_image_path"]
+                        print(f"Loading end frame image from {end_frame_image_path}")
+                        end_frame_image = np.array(Image.open(end_frame_image_path))
+                        params['end_frame_image'] = end_frame_image
+                        params['end_frame_image_path'] = end_frame_image_path  # Store the path for reference
+                        # Make sure end_frame_strength is set if this is an endframe model
+                        if params['model_type'] == "Original with Endframe" or params['model_type'] == "F1 with Endframe":
+                            if 'end_frame_strength' not in params or params['end_frame_strength'] is None:
+                                params['end_frame_strength'] = job_data.get('end_frame_strength', 1.0)
+                                print(f"Set end_frame_strength to {params['end_frame_strength']} for job {job_id}")
+                    except Exception as e:
+                        print(f"Error loading end frame image for job {job_id}: {e}")
+                
+                # Add LoRA information if present
+                if 'loras' in job_data:
+                    lora_data = job_data.get('loras', {})
+                    selected_loras = list(lora_data.keys())
+                    lora_values = list(lora_data.values())
+                    params['selected_loras'] = selected_loras
+                    params['lora_values'] = lora_values
+                    
+                    # Ensure the selected LoRAs are also in lora_loaded_names
+                    # This is critical for metadata_utils.create_metadata to find the LoRAs
+                    from modules.settings import Settings
+                    settings = Settings()
+                    lora_dir = settings.get("lora_dir", "loras")
+                    
+                    # Get the current lora_loaded_names from the system
+                    import os
+                    from pathlib import PurePath
+                    current_lora_names = []
+                    if os.path.isdir(lora_dir):
+                        for root, _, files in os.walk(lora_dir):
+                            for file in files:
+                                if file.endswith('.safetensors') or file.endswith('.pt'):
+                                    lora_relative_path = os.path.relpath(os.path.join(root, file), lora_dir)
+                                    lora_name = str(PurePath(lora_relative_path).with_suffix(''))
+                                    current_lora_names.append(lora_name)
+                    
+                    # Combine the selected LoRAs with the current lora_loaded_names
+                    # This ensures that all selected LoRAs are in lora_loaded_names
+                    combined_lora_names = list(set(current_lora_names + selected_loras))
+                    params['lora_loaded_names'] = combined_lora_names
+                    
+                    print(f"Loaded LoRA data for job {job_id}: {lora_data}")
+                    print(f"Combined lora_loaded_names: {combined_lora_names}")
+                
+                # Get settings for output_dir and metadata_dir
+                settings = Settings()
+                output_dir = settings.get("output_dir")
+                metadata_dir = settings.get("metadata_dir")
+                input_files_dir = settings.get("input_files_dir")
+                
+                # Add these directories to the params
+                params['output_dir'] = output_dir
+                params['metadata_dir'] = metadata_dir
+                params['input_files_dir'] = input_files_dir
+                
+                # Create a dummy preview image for the job
+                dummy_preview = np.zeros((64, 64, 3), dtype=np.uint8)
+                
+                # Create progress data with the dummy preview
+                from diffusers_helper.gradio.progress_bar import make_progress_bar_html
+                initial_progress_data = {
+                    'preview': dummy_preview,
+                    'desc': 'Imported job...',
+                    'html': make_progress_bar_html(0, 'Imported job...')
+                }
+                
+                # Create a dummy preview image for the job
+                dummy_preview = np.zeros((64, 64, 3), dtype=np.uint8)
+                
+                # Create progress data with the dummy preview
+                from diffusers_helper.gradio.progress_bar import make_progress_bar_html
+                initial_progress_data = {
+                    'preview': dummy_preview,
+                    'desc': 'Imported job...',
+                    'html': make_progress_bar_html(0, 'Imported job...')
+                }
+                
+                # Create a new job
+                job = Job(
+                    id=job_id,
+                    params=params,
+                    status=JobStatus(job_data.get('status', 'pending')),
+                    created_at=job_data.get('created_at', time.time()),
+                    progress_data={},
+                    stream=AsyncStream(),
+                    priority=job_data.get('priority', 0),
+                    # Mark images as saved if their paths exist in the job data
+                    input_image_saved="saved_input_image_path" in job_data and os.path.exists(job_data["saved_input_image_path"]),
+                    end_frame_image_saved="saved_end_frame_image_path" in job_data and os.path.exists(job_data["saved_end_frame_image_path"])
+                )
+                
+                # Add job to the internal jobs dictionary
+                self.jobs[job_id] = job
+                loaded_job_ids.append(job_id)
+                
+                # If a job was marked "running" in the JSON, reset it to "pending"
+                # and add it to the processing queue.
+                if was_running:
+                    print(f"Job {job_id} was 'running', resetting to 'pending' and adding to queue.")
+                    job.status = JobStatus.PENDING
+                    job.started_at = None # Clear started_at for re-queued job
+                    job.progress_data = {} # Reset progress
+                
+                # Add all non-completed/failed/cancelled jobs (now including reset 'running' ones) to the processing queue
+                if job.status == JobStatus.PENDING:
+                    self._schedule_job(job)
+                    loaded_count += 1
+        
+        # Persist the loaded jobs, running ones were reset to pending
+        settings = Settings()
+        for job_id in loaded_job_ids:
+            self.persist_job(self.jobs[job_id], settings)
+        
+        return loaded_count
+    
     def _load_queue_from_zip(self, zip_path):
         """Load queue from a zip file
         
@@ -1219,78 +1217,34 @@ class VideoJobQueue:
             int: Number of jobs loaded
         """
         try:
-            # Create a temporary directory to extract the zip file
-            temp_dir = "temp_queue_import"
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # Extract the zip file
-            with zipfile.ZipFile(zip_path, 'r') as zipf:
-                zipf.extractall(temp_dir)
-            
-            # Check if queue.json exists in the extracted files
-            queue_json_path = os.path.join(temp_dir, "queue.json")
-            if not os.path.exists(queue_json_path):
-                print(f"queue.json not found in {zip_path}")
-                shutil.rmtree(temp_dir)
-                return 0
-            
-            # Define target_queue_images_dir and ensure it exists
-            # This needs to be defined regardless of whether queue_images exists in the zip,
-            # as it's used later for path updates.
-            target_queue_images_dir = "queue_images"
-            os.makedirs(target_queue_images_dir, exist_ok=True)
-
-            # Check if queue_images directory exists in the extracted files
-            queue_images_dir = os.path.join(temp_dir, "queue_images")
-            if os.path.exists(queue_images_dir) and os.path.isdir(queue_images_dir):
-                # Copy all files from the extracted queue_images directory to the target directory
-                for file in os.listdir(queue_images_dir):
-                    src_path = os.path.join(queue_images_dir, file)
-                    dst_path = os.path.join(target_queue_images_dir, file)
-                    if os.path.isfile(src_path):
-                        shutil.copy2(src_path, dst_path)
-                        print(f"Copied {src_path} to {dst_path}")
-            
-            # Check if input_files directory exists in the extracted files
-            input_files_dir = os.path.join(temp_dir, "input_files")
-            print(f"DEBUG: Checking for input_files directory in zip: {input_files_dir}") # DEBUG
-            if os.path.exists(input_files_dir) and os.path.isdir(input_files_dir):
-                print(f"DEBUG: Found input_files directory in zip. Contents: {os.listdir(input_files_dir)}") # DEBUG
-                # Copy the input_files directory to the current directory
-                target_input_files_dir = "input_files"
-                os.makedirs(target_input_files_dir, exist_ok=True)
+            with QueueArchiveReader(zip_path) as archive:
+                # Read queue.json first, then only pull the media the imported jobs reference
+                queue_data = archive.read_queue()
+                if queue_data is None:
+                    print(f"queue.json not found in {zip_path}")
+                    return 0
                 
-                # Copy all files from the extracted input_files directory to the target directory
-                for file in os.listdir(input_files_dir):
-                    print(f"DEBUG: Processing file from zip's input_files: {file}") # DEBUG
-                    src_path = os.path.join(input_files_dir, file)
-                    dst_path = os.path.join(target_input_files_dir, file)
-                    if os.path.isfile(src_path):
-                        print(f"DEBUG: Attempting to copy video file: {src_path} to {dst_path}") # DEBUG
-                        shutil.copy2(src_path, dst_path)
-                        print(f"Copied {src_path} to {dst_path}")
-                    else: # DEBUG
-                        print(f"DEBUG: Skipped copy, {src_path} is not a file.") # DEBUG
-            else: # DEBUG
-                print(f"DEBUG: Directory {input_files_dir} does not exist or is not a directory.") # DEBUG
+                # Define target_queue_images_dir and ensure it exists
+                # This needs to be defined regardless of whether queue_images exists in the zip,
+                # as it's used later for path updates.
+                target_queue_images_dir = "queue_images"
+                os.makedirs(target_queue_images_dir, exist_ok=True)
                 
-            # Update paths in the queue.json file to reflect the new location of the images
+                extracted_count = archive.extract_for_jobs(queue_data)
+                print(f"Extracted {extracted_count} files referenced by the queue from {zip_path}")
+            
+            # Update paths in the queue data to reflect the new location of the images
             try:
-                with open(queue_json_path, 'r') as f:
-                    queue_data = json.load(f)
-                
                 # Update paths for each job
                 for job_id, job_data in queue_data.items():
                     # Check for files with job_id in the name to identify input and end frame images
                     input_image_filename = f"{job_id}_input.png"
                     end_frame_image_filename = f"{job_id}_end_frame.png"
-                    
+                
                     # Check if these files exist in the target directory
                     input_image_path = os.path.join(target_queue_images_dir, input_image_filename)
                     end_frame_image_path = os.path.join(target_queue_images_dir, end_frame_image_filename)
-                    
+                
                     # Update paths in job_data
                     if os.path.exists(input_image_path):
                         job_data["saved_input_image_path"] = input_image_path
@@ -1299,7 +1253,7 @@ class VideoJobQueue:
                         # Fallback to updating the existing path
                         job_data["saved_input_image_path"] = os.path.join(target_queue_images_dir, os.path.basename(job_data["saved_input_image_path"]))
                         print(f"Updated existing input image path for job {job_id}")
-                    
+                
                     if os.path.exists(end_frame_image_path):
                         job_data["saved_end_frame_image_path"] = end_frame_image_path
                         print(f"Updated end frame image path for job {job_id}: {end_frame_image_path}")
@@ -1323,40 +1277,42 @@ class VideoJobQueue:
                          isinstance(current_input_image_path, str) and \
                          model_type_for_job in ("Video", "Video F1") and \
                          current_input_image_path.lower().endswith(video_extensions):
-                        
+                    
                         video_basename = os.path.basename(current_input_image_path)
                         job_data["input_video"] = os.path.join("input_files", video_basename)
                         print(f"Updated video path for job {job_id} from 'input_image_path' ('{current_input_image_path}') to '{job_data['input_video']}'")
                     elif current_input_video is None:
                         # If input_video is None and input_image_path is not a usable video path, keep input_video as None
                         print(f"Video path for job {job_id} is None and 'input_image_path' ('{current_input_image_path}') not used for 'input_video'. 'input_video' remains None.")
-                # Write the updated queue.json back to the file
-                with open(queue_json_path, 'w') as f:
-                    json.dump(queue_data, f, indent=2)
                 
                 print(f"Updated image paths in queue.json to reflect new location")
             except Exception as e:
                 print(f"Error updating paths in queue.json: {e}")
             
-            # Load the queue from the extracted queue.json
-            loaded_count = self.load_queue_from_json(queue_json_path)
+            # Load the queue from the archived queue.json
+            loaded_count = self._load_serialized_jobs(queue_data)
             
-            # Clean up the temporary directory
-            shutil.rmtree(temp_dir)
+            # Synchronize queue images after loading the queue
+            self.synchronize_queue_images()
             
+            print(f"Loaded {loaded_count} pending jobs from {zip_path}")
             return loaded_count
             
         except Exception as e:
             import traceback
             print(f"Error loading queue from zip: {e}")
             traceback.print_exc()
-            # Clean up the temporary directory if it exists
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
             return 0
     
-    def _worker_loop(self):
-        """Worker thread that processes jobs from the queue"""
+    def _worker_loop(self, device=None):
+        """Worker thread that processes jobs from the queue on one device"""
+        worker_name = str(device) if device is not None else "default"
+        from modules.worker_process import get_worker_mode
+        if device is not None and device.type == "cuda" and get_worker_mode() != "process":
+            # The current device is per thread, so kernels and allocations without an explicit device
+            # (custom kernels, torch.cuda.* calls) land on this worker's GPU instead of cuda:0
+            import torch
+            torch.cuda.set_device(device)
         while True:
             try:
                 # Get the next job ID from the queue
@@ -1382,45 +1338,31 @@ class VideoJobQueue:
                         print(f"Processing grid job {job.id}, adding {len(job.child_job_ids)} child jobs to queue.")
                         job.status = JobStatus.RUNNING # Mark the grid job as running
                         job.started_at = time.time()
+                        self.persist_job(job)
                         # Add child jobs to the front of the queue
-                        temp_queue = []
-                        while not self.queue.empty():
-                            temp_queue.append(self.queue.get())
                         for child_id in reversed(job.child_job_ids): # Add in reverse to maintain order
-                            self.queue.put(child_id)
-                        for item in temp_queue:
-                            self.queue.put(item)
+                            child_job = self.jobs.get(child_id)
+                            if child_job and child_job.status == JobStatus.PENDING:
+                                self._schedule_job(child_job, front=True)
                         
                         self.queue.task_done()
                         continue # Continue to the next iteration to process the first child job
 
-                    # If we're already processing a job, wait for it to complete
-                    if self.is_processing:
-                        # Check if this is the job that's already marked as running
-                        # This can happen if the job was marked as running but not yet processed
-                        if job.status == JobStatus.RUNNING and self.current_job and self.current_job.id == job_id:
-                            print(f"Job {job_id} is already marked as running, processing it now")
-                            # We'll process this job now
-                            pass
-                        else:
-                            # Put the job back in the queue
-                            self.queue.put(job_id)
-                            self.queue.task_done()
-                            time.sleep(0.1)  # Small delay to prevent busy waiting
-                            continue
-                    
                     # Check if there's a previously running job that was interrupted
+                    # (running jobs held by another device are not interrupted)
                     previously_running_job = None
+                    held_job_ids = {j.id for j in self.running_jobs.values()}
                     for j in self.jobs.values():
-                        if j.status == JobStatus.RUNNING and j.id != job_id:
+                        if j.status == JobStatus.RUNNING and j.id != job_id and j.id not in held_job_ids \
+                                and j.job_type != JobType.GRID:
                             previously_running_job = j
                             break
                     
                     # If there's a previously running job, process it first
                     if previously_running_job:
                         print(f"Found previously running job {previously_running_job.id}, processing it first")
-                        # Put the current job back in the queue
-                        self.queue.put(job_id)
+                        # Put the current job back at the front of the queue
+                        self._schedule_job(job, front=True)
                         self.queue.task_done()
                         # Process the previously running job
                         job = previously_running_job
@@ -1434,12 +1376,14 @@ class VideoJobQueue:
                         from diffusers_helper.gradio.progress_bar import make_progress_bar_html
                         job.stream.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Resuming job...'))))
                     
-                    print(f"Starting job {job_id}, current job was {self.current_job.id if self.current_job else 'None'}")
+                    print(f"Starting job {job_id} on worker {worker_name}")
                     job.status = JobStatus.RUNNING
                     job.started_at = time.time()
-                    self.current_job = job
-                    self.is_processing = True
+                    job.error = None
+                    self.running_jobs[worker_name] = job
                 
+                # A crash from here on leaves the job as running, it is re-queued on the next start
+                self.persist_job(job)
                 job_completed = False
                 
                 try:
@@ -1447,7 +1391,6 @@ class VideoJobQueue:
                         raise ValueError("Worker function not set. Call set_worker_function() first.")
                     
                     # Start the worker function with the job parameters
-                    from diffusers_helper.thread_utils import async_run
                     print(f"Starting worker function for job {job_id}")
                     
                     # Clean up params for the worker function
@@ -1457,12 +1400,25 @@ class VideoJobQueue:
                     if 'end_frame_strength_original' in worker_params:
                         del worker_params['end_frame_strength_original']
 
-                    async_run(
-                        self.worker_function,
-                        **worker_params,
-                        job_stream=job.stream
-                    )
+                    device_context = None
+                    if self.device_pool is not None:
+                        # Models of additional devices are loaded on their first job, from this worker
+                        device_context = worker_params['device_context'] = self.device_pool.get(device)
+
+                    if self.prefetcher is not None:
+                        worker_params['prepared_inputs'] = self.prefetcher.take(job_id)
+
+                    # Each worker runs its job on its own thread so devices make progress in parallel
+                    threading.Thread(
+                        target=self.worker_function,
+                        kwargs={**worker_params, 'job_stream': job.stream},
+                        name=f"job-{job_id}",
+                        daemon=True
+                    ).start()
                     print(f"Worker function started for job {job_id}")
+
+                    # Prepare the next job while this one runs
+                    self._prefetch_next_job(device_context)
                     
                     # Process the results from the stream
                     output_filename = None
@@ -1487,11 +1443,12 @@ class VideoJobQueue:
                             # Just a periodic check, don't break yet
                         
                         try:
-                            # Try to get data from the queue with a non-blocking approach
-                            flag, data = job.stream.output_queue.next()
+                            # Wait for the next event, waking up periodically to check for cancellation
+                            flag, data = job.stream.output_queue.next(timeout=1.0)
                             
                             # Update activity time since we got some data
                             last_activity_time = time.time()
+                            job.stream.event_queue.push((flag, data))
                             
                             if flag == 'file':
                                 output_filename = data
@@ -1506,6 +1463,13 @@ class VideoJobQueue:
                                         'desc': desc,
                                         'html': html
                                     }
+                                self.persist_job_progress(job, desc)
+                            
+                            elif flag == 'error':
+                                # The worker still sends 'end' afterwards, the job is then marked as failed
+                                print(f"Job {job_id} reported an error")
+                                with self.lock:
+                                    job.error = data
                             
                             elif flag == 'end':
                                 print(f"Received end signal for job {job_id}")
@@ -1513,8 +1477,7 @@ class VideoJobQueue:
                                 break
                                 
                         except IndexError:
-                            # Queue is empty, wait a bit and try again
-                            time.sleep(0.1)
+                            # No event within the timeout, check the job state again
                             continue
                         except Exception as e:
                             print(f"Error processing job output: {e}")
@@ -1535,7 +1498,9 @@ class VideoJobQueue:
                     with self.lock:
                         # Make sure we properly clean up the job state
                         if job.status == JobStatus.RUNNING:
-                            if job_completed:
+                            if job_completed and job.error:
+                                job.status = JobStatus.FAILED
+                            elif job_completed:
                                 job.status = JobStatus.COMPLETED
                             else:
                                 # Something went wrong but we didn't mark it as completed
@@ -1545,42 +1510,22 @@ class VideoJobQueue:
                             job.completed_at = time.time()
                     
                     print(f"Finishing job {job_id} with status {job.status}")
-                    self.is_processing = False
                     
-                    # Check if there's another job in the queue before setting current_job to None
-                    # This helps prevent UI flashing when a job is cancelled
-                    next_job_id = None
-                    try:
-                        # Peek at the next job without removing it from the queue
-                        if not self.queue.empty():
-                            # We can't peek with the standard Queue, so we'll have to get creative
-                            # Store the queue items temporarily
-                            temp_queue = []
-                            while not self.queue.empty():
-                                item = self.queue.get()
-                                temp_queue.append(item)
-                                if next_job_id is None:
-                                    next_job_id = item
-                            
-                            # Put everything back
-                            for item in temp_queue:
-                                self.queue.put(item)
-                    except Exception as e:
-                        print(f"Error checking for next job: {e}")
+                    next_job_id = self.queue.peek()
+                    if next_job_id:
+                        print(f"Next scheduled job: {next_job_id}")
                     
-                    # After a job completes or is cancelled, always set current_job to None
-                    self.current_job = None
+                    # After a job completes or is cancelled, the worker is free again
+                    self.running_jobs.pop(worker_name, None)
                     
                     # The main loop's self.queue.get() will pick up the next available job.
                     # No need to explicitly find and start the next job here.
                     
                     self.queue.task_done()
                     
-                    # Save the queue to JSON after job completion (outside the lock)
-                    try:
-                        self.save_queue_to_json()
-                    except Exception as e:
-                        print(f"Error saving queue to JSON after job completion: {e}")
+                    # Persist the finished job (outside the lock)
+                    self.persist_job(job)
+                    self.progress_persisted_at.pop(job_id, None)
                 
             except Exception as e:
                 import traceback
@@ -1589,12 +1534,11 @@ class VideoJobQueue:
                 
                 # Make sure we reset processing state if there was an error
                 with self.lock:
-                    self.is_processing = False
-                    if self.current_job:
-                        self.current_job.status = JobStatus.FAILED
-                        self.current_job.error = f"Worker loop error: {str(e)}"
-                        self.current_job.completed_at = time.time()
-                        self.current_job = None
+                    failed_job = self.running_jobs.pop(worker_name, None)
+                    if failed_job:
+                        failed_job.status = JobStatus.FAILED
+                        failed_job.error = f"Worker loop error: {str(e)}"
+                        failed_job.completed_at = time.time()
                 
                 time.sleep(0.5)  # Prevent tight loop on error
 
@@ -1652,4 +1596,4 @@ class VideoJobQueue:
                         grid_job.error = f"Grid assembly failed: {e}"
 
                     grid_job.completed_at = time.time()
-                    self.save_queue_to_json()
+                    self.persist_job(grid_job)
@@ -0,0 +1,291 @@
+"""
+Baked weight snapshots: each model component in its runtime dtype, in one aligned file mapped straight into the module.
+
+    python -m modules.weight_snapshot bake              # every component
+    python -m modules.weight_snapshot bake vae text_encoder
+    python -m modules.weight_snapshot list
+
+A snapshot is a folder under FRAMEPACK_SNAPSHOT_DIR (default `<FRAMEPACK_HOME>/snapshots`) holding `weights.bin`,
+the raw tensor bytes each aligned to a page, and `manifest.json` with the class, config, dtype, shape and offset
+of every parameter and buffer. Loading builds the module on the meta device and points its parameters at a
+copy-on-write memory map of `weights.bin`: nothing is read until a weight is used, and processes on the same
+node share the page cache instead of each holding its own copy of the weights.
+"""
+import argparse
+import importlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import numpy as np
+import torch
+
+
+FORMAT_VERSION = 1
+ALIGNMENT = 4096
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "weights.bin"
+
+# Name -> (module, class, repo, subfolder, runtime dtype), as loaded by engine.load_device_models and the generators
+COMPONENTS = {
+    "text_encoder": ("transformers", "LlamaModel", "hunyuanvideo-community/HunyuanVideo", "text_encoder", torch.float16),
+    "text_encoder_2": ("transformers", "CLIPTextModel", "hunyuanvideo-community/HunyuanVideo", "text_encoder_2", torch.float16),
+    "vae": ("diffusers", "AutoencoderKLHunyuanVideo", "hunyuanvideo-community/HunyuanVideo", "vae", torch.float16),
+    "image_encoder": ("transformers", "SiglipVisionModel", "lllyasviel/flux_redux_bfl", "image_encoder", torch.float16),
+}
+TRANSFORMER_REPOS = ["lllyasviel/FramePackI2V_HY", "lllyasviel/FramePack_F1_I2V_HY_20250503"]
+for _repo in TRANSFORMER_REPOS:
+    COMPONENTS[f"transformer--{_repo.replace('/', '--')}"] = (
+        "diffusers_helper.models.hunyuan_video_packed", "HunyuanVideoTransformer3DModelPacked", _repo, None, torch.bfloat16)
+
+
+def get_snapshot_dir():
+    """Where the snapshots are stored, FRAMEPACK_SNAPSHOT_DIR"""
+    default_dir = os.path.join(os.environ.get("FRAMEPACK_HOME", os.path.expanduser("~/.cache/framepack")), "snapshots")
+    return os.environ.get("FRAMEPACK_SNAPSHOT_DIR", default_dir)
+
+
+def snapshots_enabled():
+    """FRAMEPACK_USE_SNAPSHOTS=0 always loads with from_pretrained"""
+    return os.environ.get("FRAMEPACK_USE_SNAPSHOTS", "1").lower() in ("1", "true", "yes")
+
+
+def transformer_component(model_path):
+    """Component name of the transformer of a model repo"""
+    return f"transformer--{model_path.replace('/', '--')}"
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace("torch.", "")
+
+
+def _config_dict(model):
+    """(kind, JSON config) to rebuild the module, transformers and diffusers configs are restored differently"""
+    if hasattr(model.config, "to_dict"):
+        return "transformers", json.loads(model.config.to_json_string(use_diff=False))
+    return "diffusers", json.loads(json.dumps({k: v for k, v in dict(model.config).items() if not k.startswith("_")}, default=str))
+
+
+def _tensor_key(tensor):
+    return (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape), tuple(tensor.stride()), tensor.dtype)
+
+
+def save_snapshot(model, directory, source=None):
+    """
+    Writes the parameters and buffers of a module into a snapshot folder, replacing it atomically.
+
+    Tensors are written as they are, so the model should already be in its runtime dtype. Non-persistent
+    buffers are included since they are not rebuilt on the meta device, tied parameters are stored once.
+
+    Args:
+        model: The module to bake
+        directory: The snapshot folder
+        source: Recorded in the manifest, e.g. the repo the weights come from
+
+    Returns:
+        Size of the weights file in bytes
+    """
+    kind, config = _config_dict(model)
+    cls = type(model)
+    entries = []
+    written = {}  # tensor key -> index of the entry holding its bytes
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = os.path.join(parent, f".{os.path.basename(directory)}.{uuid.uuid4().hex}.tmp")
+    os.makedirs(tmp_dir)
+    try:
+        offset = 0
+        with open(os.path.join(tmp_dir, WEIGHTS_NAME), "wb") as f:
+            named_tensors = [(name, "parameter", p) for name, p in model.named_parameters(remove_duplicate=False)]
+            named_tensors += [(name, "buffer", b) for name, b in model.named_buffers(remove_duplicate=False) if b is not None]
+            for name, tensor_kind, tensor in named_tensors:
+                tensor = tensor.detach()
+                entry = {"name": name, "kind": tensor_kind, "dtype": _dtype_name(tensor.dtype), "shape": list(tensor.shape)}
+                key = _tensor_key(tensor)
+                if key in written:
+                    entry["alias_of"] = written[key]
+                    entries.append(entry)
+                    continue
+
+                data = tensor.to("cpu").contiguous()
+                nbytes = data.numel() * data.element_size()
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                if nbytes:
+                    data.reshape(-1).view(torch.uint8).numpy().tofile(f)
+                entry.update(offset=offset, nbytes=nbytes)
+                offset += nbytes
+                written[key] = len(entries)
+                entries.append(entry)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "class": f"{cls.__module__}.{cls.__qualname__}",
+            "config_kind": kind,
+            "config": config,
+            "source": source,
+            "alignment": ALIGNMENT,
+            "size": offset,
+            "created": time.time(),
+            "tensors": entries,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_dir, directory)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return offset
+
+
+def _build_empty(manifest):
+    """The module of a manifest with its tensors on the meta device"""
+    module_name, _, class_name = manifest["class"].rpartition(".")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    with torch.device("meta"):
+        if manifest["config_kind"] == "transformers":
+            # _from_config picks the attention implementation like from_pretrained does
+            return cls._from_config(cls.config_class.from_dict(manifest["config"]))
+        return cls.from_config(manifest["config"])
+
+
+def load_snapshot_from(directory):
+    """
+    Maps a snapshot folder into a new module.
+
+    The weights file is mapped copy-on-write: pages are read on first access and shared with every other
+    process mapping the same file, writes to a tensor (e.g. fused LoRAs) stay private and never reach the file.
+
+    Returns:
+        The module in eval mode with requires_grad off
+    """
+    with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {directory}")
+
+    model = _build_empty(manifest)
+    weights_path = os.path.join(directory, WEIGHTS_NAME)
+    if manifest["size"]:
+        data = torch.from_numpy(np.memmap(weights_path, dtype=np.uint8, mode="c", shape=(manifest["size"],)))
+    else:
+        data = torch.empty(0, dtype=torch.uint8)
+
+    tensors = []
+    for entry in manifest["tensors"]:
+        if "alias_of" in entry:
+            tensor = tensors[entry["alias_of"]]
+        else:
+            dtype = getattr(torch, entry["dtype"])
+            tensor = data[entry["offset"]:entry["offset"] + entry["nbytes"]].view(dtype).view(entry["shape"])
+            if entry["kind"] == "parameter":
+                tensor = torch.nn.Parameter(tensor, requires_grad=False)
+        tensors.append(tensor)
+
+        module_path, _, attr = entry["name"].rpartition(".")
+        module = model.get_submodule(module_path) if module_path else model
+        if entry["kind"] == "parameter":
+            module._parameters[attr] = tensor
+        else:
+            module._buffers[attr] = tensor
+
+    missing = [name for name, t in [*model.named_parameters(), *model.named_buffers()] if t.is_meta]
+    if missing:
+        raise ValueError(f"Snapshot {directory} is missing {len(missing)} tensors, e.g. {missing[:3]}")
+
+    model.eval()
+    model.requires_grad_(False)
+    return model
+
+
+def has_snapshot(name):
+    """Whether load_snapshot maps the component"""
+    return snapshots_enabled() and os.path.isfile(os.path.join(get_snapshot_dir(), name, MANIFEST_NAME))
+
+
+def load_snapshot(name):
+    """The module of a baked component, or None when there is no usable snapshot"""
+    if not snapshots_enabled():
+        return None
+    directory = os.path.join(get_snapshot_dir(), name)
+    if not os.path.isfile(os.path.join(directory, MANIFEST_NAME)):
+        return None
+    start_time = time.perf_counter()
+    try:
+        model = load_snapshot_from(directory)
+    except Exception as e:
+        print(f"Could not load the {name} snapshot, loading from the model repo instead: {e}")
+        return None
+    print(f"Mapped {name} from its snapshot in {time.perf_counter() - start_time:.2f}s")
+    return model
+
+
+def load_pretrained(name, path=None):
+    """Loads a component with from_pretrained in its runtime dtype, from path instead of its repo if given"""
+    module_name, class_name, repo, subfolder, dtype = COMPONENTS[name]
+    cls = getattr(importlib.import_module(module_name), class_name)
+    kwargs = {"subfolder": subfolder} if subfolder else {}
+    return cls.from_pretrained(path or repo, torch_dtype=dtype, low_cpu_mem_usage=True, **kwargs)
+
+
+def load_component(name, path=None):
+    """A component from its snapshot when baked, otherwise with from_pretrained"""
+    model = load_snapshot(name)
+    if model is None:
+        model = load_pretrained(name, path)
+    return model
+
+
+def bake(names=None, output_dir=None):
+    """Writes the snapshot of each component (all of them by default)"""
+    output_dir = output_dir or get_snapshot_dir()
+    for name in names or list(COMPONENTS):
+        if name not in COMPONENTS:
+            raise ValueError(f"Unknown component '{name}', expected one of {', '.join(COMPONENTS)}")
+        start_time = time.perf_counter()
+        print(f"Baking {name}...")
+        model = load_pretrained(name)
+        size = save_snapshot(model, os.path.join(output_dir, name), source=COMPONENTS[name][2])
+        del model
+        print(f"Baked {name}: {size / (1024 ** 3):.2f} GB in {time.perf_counter() - start_time:.2f}s")
+
+
+def list_snapshots(output_dir=None):
+    output_dir = output_dir or get_snapshot_dir()
+    for name in COMPONENTS:
+        manifest_path = os.path.join(output_dir, name, MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            print(f"{name}: {manifest['size'] / (1024 ** 3):.2f} GB, {len(manifest['tensors'])} tensors, baked {time.ctime(manifest['created'])}")
+        else:
+            print(f"{name}: not baked")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bake the FramePack model components into memory-mappable snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bake_parser = subparsers.add_parser("bake", help="Write the snapshots")
+    bake_parser.add_argument("components", nargs="*", help=f"Components to bake (default: all of {', '.join(COMPONENTS)})")
+    bake_parser.add_argument("--output", default=None, help="Snapshot folder (default: FRAMEPACK_SNAPSHOT_DIR)")
+    list_parser = subparsers.add_parser("list", help="Show the baked snapshots")
+    list_parser.add_argument("--output", default=None, help="Snapshot folder (default: FRAMEPACK_SNAPSHOT_DIR)")
+    args = parser.parse_args()
+
+    if args.command == "bake":
+        import diffusers_helper.hf_login  # noqa: F401, logs in with HF_TOKEN like the app does
+        bake(args.components, args.output)
+    else:
+        list_snapshots(args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
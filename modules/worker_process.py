@@ -0,0 +1,275 @@
+import os
+import sys
+import subprocess
+import threading
+import traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+
+def get_worker_mode():
+    """"thread" runs worker() inside this process, "process" runs it in a supervised subprocess per device"""
+    return os.environ.get("FRAMEPACK_WORKER_MODE", "thread").lower()
+
+
+def is_worker_process():
+    return os.environ.get("FRAMEPACK_WORKER_CHILD") == "1"
+
+
+# Arrays are passed through shared memory, only this small handle goes through the pipe
+_SHM_TAG = "__shared_array__"
+
+
+def share_array(array):
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    name = shm.name
+    shm.close()
+    try:
+        # The receiver unlinks the block, stop the resource tracker of this process from cleaning it up too
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(f"/{name}" if not name.startswith("/") else name, "shared_memory")
+    except Exception:
+        pass
+    return (_SHM_TAG, name, array.shape, array.dtype.str)
+
+
+def receive_array(handle):
+    _, name, shape, dtype = handle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def pack(obj):
+    """Replaces numpy arrays nested in tuples, lists and dicts with shared memory handles"""
+    if isinstance(obj, np.ndarray):
+        return share_array(obj)
+    if isinstance(obj, tuple):
+        return tuple(pack(x) for x in obj)
+    if isinstance(obj, list):
+        return [pack(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: pack(v) for k, v in obj.items()}
+    return obj
+
+
+def unpack(obj):
+    if isinstance(obj, tuple):
+        if len(obj) == 4 and obj[0] == _SHM_TAG:
+            return receive_array(obj)
+        return tuple(unpack(x) for x in obj)
+    if isinstance(obj, list):
+        return [unpack(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: unpack(v) for k, v in obj.items()}
+    return obj
+
+
+def _run_worker(worker, params, stream):
+    try:
+        worker(**params, job_stream=stream)
+    except Exception:
+        traceback.print_exc()
+        stream.output_queue.push(('error', f"Error during generation: {traceback.format_exc()}"))
+        stream.output_queue.push(('end', None))
+
+
+def get_worker_process_env(device_name, authkey):
+    env = dict(os.environ)
+    env["FRAMEPACK_WORKER_CHILD"] = "1"
+    env["FRAMEPACK_RESTORE_QUEUE"] = "false"
+    env["FRAMEPACK_WORKER_AUTHKEY"] = authkey.hex()
+    # Pin the process to its device before torch initializes CUDA
+    if device_name.startswith("cuda"):
+        env["CUDA_VISIBLE_DEVICES"] = device_name.split(":")[1] if ":" in device_name else "0"
+        env["FRAMEPACK_DEVICES"] = "cuda:0"
+    else:
+        env["FRAMEPACK_DEVICES"] = device_name
+    return env
+
+
+def worker_process_main(conn, device_name):
+    """
+    Loads the models for one device and runs the jobs received from the supervisor.
+
+    Messages from the supervisor: ('run', params), ('cancel',), ('stop',)
+    Messages to the supervisor: ('ready',), ('event', (flag, data)), ('done',)
+    """
+    import engine  # noqa: F401, loads the models of this device
+    from diffusers_helper.thread_utils import AsyncStream
+    from modules.pipelines.worker import worker
+
+    conn.send(('ready',))
+    print(f"Worker process for {device_name} is ready (pid {os.getpid()})")
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+
+        if message[0] == 'stop':
+            return
+        if message[0] != 'run':
+            continue
+
+        stream = AsyncStream()
+        thread = threading.Thread(target=_run_worker, args=(worker, unpack(message[1]), stream), daemon=True)
+        thread.start()
+
+        while True:
+            while conn.poll():
+                if conn.recv()[0] == 'cancel':
+                    stream.input_queue.push('end')
+            try:
+                event = stream.output_queue.next(timeout=0.1)
+            except IndexError:
+                if not thread.is_alive():
+                    break
+                continue
+            conn.send(('event', pack(event)))
+
+        conn.send(('done',))
+
+
+class ProcessWorkerSupervisor:
+    """
+    Runs worker() for one device in a dedicated subprocess and restarts it when needed.
+
+    Progress events come back over a pipe, preview frames and other arrays through shared memory.
+    When the subprocess dies or a job fails with a CUDA out of memory error, the job is reported as
+    failed and a fresh subprocess is started, the UI and the serverless handler keep running.
+    """
+
+    def __init__(self, device):
+        self.device_name = str(device)
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.start()
+
+    @property
+    def name(self):
+        return self.device_name
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        # A fresh interpreter running this module, so the parent's __main__ (studio.py) is not re-executed
+        authkey = os.urandom(32)
+        listener = Listener(('127.0.0.1', 0), authkey=authkey)
+        host, port = listener.address
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "modules.worker_process", self.device_name, f"{host}:{port}"],
+            cwd=project_root,
+            env=get_worker_process_env(self.device_name, authkey),
+        )
+
+        accepted = {}
+        accept_thread = threading.Thread(target=lambda: accepted.setdefault('conn', listener.accept()), daemon=True)
+        accept_thread.start()
+        while accept_thread.is_alive():
+            accept_thread.join(0.5)
+            if not self.is_alive():
+                break
+        listener.close()
+
+        if 'conn' not in accepted:
+            raise RuntimeError(f"Worker process for {self.device_name} exited with code {self.process.returncode} before connecting")
+        self.conn = accepted['conn']
+        self.ready = False
+        print(f"Started worker process for {self.device_name} (pid {self.process.pid})")
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(('stop',))
+        except Exception:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def restart(self, reason):
+        print(f"Restarting worker process for {self.device_name}: {reason}")
+        self.restarts += 1
+        self.stop()
+        self.start()
+
+    def _wait_until_ready(self, job_stream):
+        from diffusers_helper.gradio.progress_bar import make_progress_bar_html
+
+        job_stream.output_queue.push(('progress', (None, '', make_progress_bar_html(0, 'Waiting for the worker process to load models...'))))
+        while not self.ready:
+            if self.conn.poll(0.5):
+                if self.conn.recv()[0] == 'ready':
+                    self.ready = True
+            elif not self.is_alive():
+                raise RuntimeError(f"Worker process for {self.device_name} exited with code {self.process.returncode} while loading")
+
+    def run(self, job_stream, **params):
+        """Runs one job in the subprocess, forwarding its events to job_stream. Same contract as worker()."""
+        with self.lock:
+            restart_reason = None
+            try:
+                if not self.is_alive():
+                    self.stop()
+                    self.start()
+                self._wait_until_ready(job_stream)
+                self.conn.send(('run', pack(params)))
+
+                cancel_sent = False
+                while True:
+                    if not cancel_sent and job_stream.input_queue.top() == 'end':
+                        self.conn.send(('cancel',))
+                        cancel_sent = True
+
+                    if self.conn.poll(0.1):
+                        message = self.conn.recv()
+                        if message[0] == 'done':
+                            break
+                        if message[0] == 'event':
+                            flag, data = unpack(message[1])
+                            if flag == 'error' and 'out of memory' in str(data).lower():
+                                restart_reason = "CUDA out of memory"
+                            job_stream.output_queue.push((flag, data))
+                    elif not self.is_alive():
+                        raise RuntimeError(f"Worker process for {self.device_name} exited with code {self.process.returncode}")
+            except (EOFError, BrokenPipeError, RuntimeError) as e:
+                traceback.print_exc()
+                restart_reason = str(e)
+                job_stream.output_queue.push(('error', f"Worker process failed: {e}"))
+                job_stream.output_queue.push(('end', None))
+
+            if restart_reason is not None:
+                self.restart(restart_reason)
+
+
+def run_in_worker_process(device_context=None, job_stream=None, **params):
+    """Worker function for VideoJobQueue in process mode, device_context is the ProcessWorkerSupervisor of the device"""
+    device_context.run(job_stream, **params)
+
+
+if __name__ == "__main__":
+    device_name, address = sys.argv[1], sys.argv[2]
+    host, port = address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ["FRAMEPACK_WORKER_AUTHKEY"]))
+    worker_process_main(conn, device_name)
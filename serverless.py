@@ -3,10 +3,10 @@ import runpod
 
 import time
 import re
-import numpy as np
 import os
-from studio import process, job_queue, settings, lora_names
-from utils.image import image_fetch, image_numpy_to_base64
+from engine import process, job_queue, settings, lora_names
+from utils.image import image_fetch, image_numpy_to_base64, image_to_bucket
+from utils.image_fetcher import get_image_fetcher
 from utils.args import load_precision
 from utils.uploader import uploader
 from utils.crypto import decrypt, encrypt
@@ -15,13 +15,31 @@ from local_types.runpod_job import JobInput
 from typing import Optional, Dict
 from modules.video_queue import JobStatus, Job
 from modules.lora_manager import lora_manager
+from modules.cost_model import get_cost_model
 from runpod.serverless.utils.rp_cleanup import clean
     
-def upload_result(filepath: Optional[str], storage_path: str):
+def upload_result(filepath: Optional[str], storage_path: str, job: Optional[Job] = None):
+    started_at = time.perf_counter()
     file_url = uploader.upload_file(filepath, target_path=storage_path)
+    
+    # The upload is part of the job runtime seen by the caller
+    if job is not None:
+        try:
+            get_cost_model().record(job.params, {"upload": time.perf_counter() - started_at})
+        except Exception as e:
+            logger.warning(f"Error recording upload time: {e}")
+    
     file_url = encrypt(file_url).decode()
     return file_url
 
+def get_job_estimate(job_id: str):
+    """Predicted runtime and queue wait in seconds, rounded to 10s so pending jobs are not flooded with updates"""
+    estimate = job_queue.get_job_estimate(job_id) or {}
+    return {
+        key: None if estimate.get(key) is None else int(round(estimate[key], -1))
+        for key in ("predicted_runtime", "queue_wait")
+    }
+
 def cleanup_outputs():
     outputs_path = settings.get("output_dir")
     
@@ -62,13 +80,21 @@ async def handler(job):
     job_input = JobInput.model_validate(job["input"])
     logger.info(f"Received job: {job_input}")
     
-    job_image = image_fetch(decrypt(job_input.image_url).decode())
+    image_url = decrypt(job_input.image_url).decode()
+    
+    # Download the input image while the LoRAs are installed, image_fetch then waits for it
+    if image_url.startswith(('http://', 'https://')):
+        get_image_fetcher().prefetch([image_url])
     
     selected_loras: list[str] = []
     lora_values: list[str] = []
     
+    # Download the job's LoRAs concurrently
+    lora_manager.install_models_if_needed(job_input.loras)
+    
+    job_image = image_fetch(image_url)
+    
     for lora in job_input.loras:
-        lora_manager.install_model_if_needed(lora)
         lora_name, _ = os.path.splitext(lora.name)
         
         if lora_name not in lora_names:
@@ -79,7 +105,8 @@ async def handler(job):
         
     job_args = {
         **job_input.config.model_dump(),
-        "input_image": np.array(job_image),
+        # Decoded straight at the bucket size, the pipeline then skips its full resolution resize
+        "input_image": image_to_bucket(job_image, job_input.config.resolutionW),
         "end_frame_image": None,
         "end_frame_strength": None,
         "clean_up_videos": True,
@@ -125,8 +152,7 @@ async def handler(job):
         *lora_values
     ]
     
-    response = process(*all_args)
-    job_id = response[1]
+    job_id = process(*all_args)
     
     if not job_id:
         raise Exception("Job ID is none.")
@@ -139,6 +165,7 @@ async def handler(job):
     last_job_status = None  # Track the previous job status to detect status changes
     last_progress_percentage = -99
     last_progress_message = None
+    last_estimate = None
     current_second = 1
     
     PROGRESS_UPDATE_RATE = 10
@@ -155,12 +182,14 @@ async def handler(job):
         if last_job_status != job.status:
             logger.info(f"-> {job.status}")
             
+            last_estimate = get_job_estimate(job_id)
             yield {
                 "name": "update",
                 "payload": {
                     "status": job.status.value,
                     "error": job.error,
-                    "result": upload_result(job.result, storage_path) if job.status == JobStatus.COMPLETED else None,
+                    "result": upload_result(job.result, storage_path, job) if job.status == JobStatus.COMPLETED else None,
+                    **last_estimate,
                 }
             }
 
@@ -168,6 +197,20 @@ async def handler(job):
         if job.status == JobStatus.PENDING:
             position = job_queue.get_queue_position(job_id)
             logger.debug(f"Job {job_id} is pending, position in queue: {position}")
+            
+            # The wait changes as the jobs ahead progress or new jobs overtake this one
+            estimate = get_job_estimate(job_id)
+            if last_job_status == job.status and estimate != last_estimate:
+                last_estimate = estimate
+                yield {
+                    "name": "update",
+                    "payload": {
+                        "status": job.status.value,
+                        "error": job.error,
+                        "result": None,
+                        **estimate,
+                    }
+                }
 
         elif job.status == JobStatus.RUNNING:
             if job.progress_data and 'preview' in job.progress_data:
@@ -222,8 +265,11 @@ async def handler(job):
         # Update last_job_status for the next iteration
         last_job_status = job.status
         
-        # Wait a bit before checking again
-        time.sleep(0.5)
+        # Wait for the next job event without blocking the event loop, re-check the status at least every 0.5s
+        try:
+            await job.stream.event_queue.async_next(timeout=0.5)
+        except IndexError:
+            pass
         
     # Clean the outputs.        
     cleanup_outputs()
@@ -1,57 +1,25 @@
-from diffusers_helper.hf_login import login
-
-import json
 import os
-import shutil
-from pathlib import PurePath, Path
 import time
-import argparse
-import traceback
-import einops
-import numpy as np
+from pathlib import PurePath
 import torch
-import datetime
 
 # Version information
 from modules.version import APP_VERSION
 
-# Set environment variables
-# os.environ['HF_HOME'] = os.path.abspath(os.path.realpath(os.path.join(os.path.dirname(__file__), './hf_download')))
-os.environ['TOKENIZERS_PARALLELISM'] = 'false'  # Prevent tokenizers parallelism warning
-
-
+# The models, the job queue and the workers live in the engine, this module adds the Gradio UI
+import engine
+from engine import (
+    settings, job_queue, device_pool, primary_device_context, prompt_embedding_cache, high_vram,
+    lora_names, lora_values, lora_dir, stream,
+)
 
 import gradio as gr
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
-from diffusers import AutoencoderKLHunyuanVideo
-from transformers import LlamaModel, CLIPTextModel, LlamaTokenizerFast, CLIPTokenizer
-from diffusers_helper.hunyuan import encode_prompt_conds, vae_decode, vae_encode, vae_decode_fake
-from diffusers_helper.utils import save_bcthw_as_mp4, crop_or_pad_yield_mask, soft_append_bcthw, resize_and_center_crop, generate_timestamp
-from diffusers_helper.models.hunyuan_video_packed import HunyuanVideoTransformer3DModelPacked
-from diffusers_helper.pipelines.k_diffusion_hunyuan import sample_hunyuan
-from diffusers_helper.memory import cpu, gpu, get_cuda_free_memory_gb, move_model_to_device_with_memory_preservation, offload_model_from_device_for_memory_preservation, fake_diffusers_current_device, DynamicSwapInstaller, unload_complete_models, load_model_as_complete
-from diffusers_helper.thread_utils import AsyncStream
+from diffusers_helper.hunyuan import encode_prompt_conds
+from diffusers_helper.utils import crop_or_pad_yield_mask
 from diffusers_helper.gradio.progress_bar import make_progress_bar_html
-from transformers import SiglipImageProcessor, SiglipVisionModel
-from diffusers_helper.clip_vision import hf_clip_vision_encode
-from diffusers_helper.bucket_tools import find_nearest_bucket
-from diffusers_helper import lora_utils
-from diffusers_helper.lora_utils import load_lora, unload_all_loras
-
-# Import model generators
-from modules.generators import create_model_generator
-
-# Global cache for prompt embeddings
-prompt_embedding_cache = {}
-# Import from modules
-from modules.video_queue import VideoJobQueue, JobStatus
-from modules.prompt_handler import parse_timestamped_prompt
+from modules.video_queue import JobStatus
 from modules.interface import create_interface, format_queue_status
-from modules.settings import Settings
-from modules import DUMMY_LORA_NAME # Import the constant
-from modules.pipelines.metadata_utils import create_metadata
-from modules.pipelines.worker import worker
+from utils.args import get_args
 
 # Try to suppress annoyingly persistent Windows asyncio proactor errors
 if os.name == 'nt':  # Windows only
@@ -108,99 +76,6 @@ def verify_lora_state(transformer, label=""):
         print(f"[{label}] No LoRA components found in transformer")
 
 
-# parser = argparse.ArgumentParser()
-# parser.add_argument('--share', action='store_true')
-# parser.add_argument("--server", type=str, default='0.0.0.0')
-# parser.add_argument("--port", type=int, required=False)
-# parser.add_argument("--inbrowser", action='store_true')
-# parser.add_argument("--lora", type=str, default=None, help="Lora path (comma separated for multiple)")
-# parser.add_argument("--offline", action='store_true', help="Run in offline mode")
-# args = parser.parse_args()
-
-from utils.args import get_args
-
-# print(args)
-
-# if args.offline:
-#     print("Offline mode enabled.")
-#     os.environ['HF_HUB_OFFLINE'] = '1'
-# else:
-#     if 'HF_HUB_OFFLINE' in os.environ:
-#         del os.environ['HF_HUB_OFFLINE']
-
-free_mem_gb = get_cuda_free_memory_gb(gpu)
-high_vram = free_mem_gb > 60
-
-print(f'Free VRAM {free_mem_gb} GB')
-print(f'High-VRAM Mode: {high_vram}')
-
-# Load models
-text_encoder = LlamaModel.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='text_encoder', torch_dtype=torch.float16).cpu()
-text_encoder_2 = CLIPTextModel.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='text_encoder_2', torch_dtype=torch.float16).cpu()
-tokenizer = LlamaTokenizerFast.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='tokenizer')
-tokenizer_2 = CLIPTokenizer.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='tokenizer_2')
-vae = AutoencoderKLHunyuanVideo.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='vae', torch_dtype=torch.float16).cpu()
-
-feature_extractor = SiglipImageProcessor.from_pretrained("lllyasviel/flux_redux_bfl", subfolder='feature_extractor')
-image_encoder = SiglipVisionModel.from_pretrained("lllyasviel/flux_redux_bfl", subfolder='image_encoder', torch_dtype=torch.float16).cpu()
-
-# Initialize model generator placeholder
-current_generator = None # Will hold the currently active model generator
-
-# Load models based on VRAM availability later
- 
-# Configure models
-vae.eval()
-text_encoder.eval()
-text_encoder_2.eval()
-image_encoder.eval()
-
-if not high_vram:
-   vae.enable_slicing()
-   vae.enable_tiling()
-
-
-vae.to(dtype=torch.float16)
-image_encoder.to(dtype=torch.float16)
-text_encoder.to(dtype=torch.float16)
-text_encoder_2.to(dtype=torch.float16)
-
-vae.requires_grad_(False)
-text_encoder.requires_grad_(False)
-text_encoder_2.requires_grad_(False)
-image_encoder.requires_grad_(False)
-
-# Create lora directory if it doesn't exist
-#lora_dir = os.path.join(os.path.dirname(__file__), 'loras')
-#os.makedirs(lora_dir, exist_ok=True)
-
-# Initialize LoRA support - moved scanning after settings load
-lora_names = []
-lora_values = [] # This seems unused for population, might be related to weights later
-
-script_dir = os.path.dirname(os.path.abspath(__file__))
-
-# Define default LoRA folder path relative to the script directory (used if setting is missing)
-#default_lora_folder = os.path.join(script_dir, "loras")
-#os.makedirs(default_lora_folder, exist_ok=True) # Ensure default exists
-
-if not high_vram:
-    # DynamicSwapInstaller is same as huggingface's enable_sequential_offload but 3x faster
-    DynamicSwapInstaller.install_model(text_encoder, device=gpu)
-else:
-    text_encoder.to(gpu)
-    text_encoder_2.to(gpu)
-    image_encoder.to(gpu)
-    vae.to(gpu)
-
-stream = AsyncStream()
-
-#outputs_folder = './outputs/'
-#os.makedirs(outputs_folder, exist_ok=True)
-
-# Initialize settings
-settings = Settings()
-
 # NEW: auto-cleanup on start-up option in Settings
 if settings.get("auto_cleanup_on_startup", False):
     print("--- Running Automatic Startup Cleanup ---")
@@ -213,32 +88,6 @@ if settings.get("auto_cleanup_on_startup", False):
     print(f"{cleanup_summary}") # This cleaner print handles the multiline string well
     
     print("--- Startup Cleanup Complete ---")
-        
-# --- Populate LoRA names AFTER settings are loaded ---
-lora_folder_from_settings: str = settings.get("lora_dir") # Use setting, fallback to default
-lora_dir = lora_folder_from_settings
-print(f"Scanning for LoRAs in: {lora_folder_from_settings}")
-if os.path.isdir(lora_folder_from_settings):
-    try:
-        for root, _, files in os.walk(lora_folder_from_settings):
-            for file in files:
-                if file.endswith('.safetensors') or file.endswith('.pt'):
-                    lora_relative_path = os.path.relpath(os.path.join(root, file), lora_folder_from_settings)
-                    lora_name = str(PurePath(lora_relative_path).with_suffix(''))
-                    lora_names.append(lora_name)
-        print(f"Found LoRAs: {lora_names}")
-        # Temp solution for only 1 lora
-        if len(lora_names) == 1:
-            lora_names.append(DUMMY_LORA_NAME)
-    except Exception as e:
-        print(f"Error scanning LoRA directory '{lora_folder_from_settings}': {e}")
-else:
-    print(f"LoRA directory not found: {lora_folder_from_settings}")
-# --- End LoRA population ---
-
-# Create job queue
-job_queue = VideoJobQueue()
-
 
 
 # Function to load a LoRA file
@@ -257,7 +106,7 @@ def load_lora_file(lora_file: str | PurePath):
         # shutil.copy(lora_file, lora_dest)
         
         # Load the LoRA
-        global current_generator, lora_names
+        current_generator = engine.current_generator
         if current_generator is None:
             return None, "Error: No model loaded to apply LoRA to. Generate something first."
         
@@ -312,165 +161,9 @@ def get_cached_or_encode_prompt(prompt, text_encoder, text_encoder_2, tokenizer,
         # Return embeddings already on the target device (as encode_prompt_conds uses the model's device)
         return llama_vec, llama_attention_mask, clip_l_pooler
 
-# Set the worker function for the job queue - using the imported worker from modules/pipelines/worker.py
-job_queue.set_worker_function(worker)
-
-
-def process(
-        model_type,
-        input_image,
-        end_frame_image,     # NEW
-        end_frame_strength,  # NEW        
-        prompt_text,
-        n_prompt,
-        seed, 
-        total_second_length, 
-        latent_window_size, 
-        steps, 
-        cfg, 
-        gs, 
-        rs, 
-        use_teacache, 
-        teacache_num_steps, 
-        teacache_rel_l1_thresh,
-        use_magcache,
-        magcache_threshold,
-        magcache_max_consecutive_skips,
-        magcache_retention_ratio,
-        blend_sections, 
-        latent_type,
-        clean_up_videos,
-        selected_loras,
-        resolutionW,
-        resolutionH,
-        input_image_path,
-        combine_with_source,
-        num_cleaned_frames,
-        *lora_args,
-        save_metadata_checked=True,  # NEW: Parameter to control metadata saving
-    ):
-       
-    # Create a blank black image if no 
-    # Create a default image based on the selected latent_type
-    has_input_image = True
-    if input_image is None:
-        has_input_image = False
-        default_height, default_width = resolutionH, resolutionW
-        if latent_type == "White":
-            # Create a white image
-            input_image = np.ones((default_height, default_width, 3), dtype=np.uint8) * 255
-            print("No input image provided. Using a blank white image.")
-
-        elif latent_type == "Noise":
-            # Create a noise image
-            input_image = np.random.randint(0, 256, (default_height, default_width, 3), dtype=np.uint8)
-            print("No input image provided. Using a random noise image.")
-
-        elif latent_type == "Green Screen":
-            # Create a green screen image with standard chroma key green (0, 177, 64)
-            input_image = np.zeros((default_height, default_width, 3), dtype=np.uint8)
-            input_image[:, :, 1] = 177  # Green channel
-            input_image[:, :, 2] = 64   # Blue channel
-            # Red channel remains 0
-            print("No input image provided. Using a standard chroma key green screen.")
-
-        else:  # Default to "Black" or any other value
-            # Create a black image
-            input_image = np.zeros((default_height, default_width, 3), dtype=np.uint8)
-            print(f"No input image provided. Using a blank black image (latent_type: {latent_type}).")
-
-    
-    # Handle input files - copy to input_files_dir to prevent them from being deleted by temp cleanup
-    input_files_dir = settings.get("input_files_dir")
-    os.makedirs(input_files_dir, exist_ok=True)
-    
-    # Process input image (if it's a file path)
-    input_image_path = None
-    if isinstance(input_image, str) and os.path.exists(input_image):
-        # It's a file path, copy it to input_files_dir
-        filename = os.path.basename(input_image)
-        input_image_path = os.path.join(input_files_dir, f"{generate_timestamp()}_{filename}")
-        try:
-            shutil.copy2(input_image, input_image_path)
-            print(f"Copied input image to {input_image_path}")
-            # For Video model, we'll use the path
-            if model_type == "Video":
-                input_image = input_image_path
-        except Exception as e:
-            print(f"Error copying input image: {e}")
-    
-    # Process end frame image (if it's a file path)
-    end_frame_image_path = None
-    if isinstance(end_frame_image, str) and os.path.exists(end_frame_image):
-        # It's a file path, copy it to input_files_dir
-        filename = os.path.basename(end_frame_image)
-        end_frame_image_path = os.path.join(input_files_dir, f"{generate_timestamp()}_{filename}")
-        try:
-            shutil.copy2(end_frame_image, end_frame_image_path)
-            print(f"Copied end frame image to {end_frame_image_path}")
-        except Exception as e:
-            print(f"Error copying end frame image: {e}")
-    
-    # Extract lora_loaded_names from lora_args
-    lora_loaded_names = lora_args[0] if lora_args and len(lora_args) > 0 else []
-    lora_values = lora_args[1:] if lora_args and len(lora_args) > 1 else []
-    
-    # Create job parameters
-    job_params = {
-        'model_type': model_type,
-        'input_image': input_image.copy() if hasattr(input_image, 'copy') else input_image,  # Handle both image arrays and video paths
-        'end_frame_image': end_frame_image.copy() if end_frame_image is not None else None,
-        'end_frame_strength': end_frame_strength,        
-        'prompt_text': prompt_text,
-        'n_prompt': n_prompt,
-        'seed': seed,
-        'total_second_length': total_second_length,
-        'latent_window_size': latent_window_size,
-        'latent_type': latent_type,
-        'steps': steps,
-        'cfg': cfg,
-        'gs': gs,
-        'rs': rs,
-        'blend_sections': blend_sections,
-        'use_teacache': use_teacache,
-        'teacache_num_steps': teacache_num_steps,
-        'teacache_rel_l1_thresh': teacache_rel_l1_thresh,
-        'use_magcache': use_magcache,
-        'magcache_threshold': magcache_threshold,
-        'magcache_max_consecutive_skips': magcache_max_consecutive_skips,
-        'magcache_retention_ratio': magcache_retention_ratio,
-        'selected_loras': selected_loras,
-        'has_input_image': has_input_image,
-        'output_dir': settings.get("output_dir"),
-        'metadata_dir': settings.get("metadata_dir"),
-        'input_files_dir': input_files_dir,  # Add input_files_dir to job parameters
-        'input_image_path': input_image_path,  # Add the path to the copied input image
-        'end_frame_image_path': end_frame_image_path,  # Add the path to the copied end frame image
-        'resolutionW': resolutionW, # Add resolution parameter
-        'resolutionH': resolutionH,
-        'lora_loaded_names': lora_loaded_names,
-        'combine_with_source': combine_with_source,  # Add combine_with_source parameter
-        'num_cleaned_frames': num_cleaned_frames,
-        'save_metadata_checked': save_metadata_checked,  # NEW: Add save_metadata_checked parameter
-    }
-    
-    # Print teacache parameters for debugging
-    print(f"Teacache parameters: use_teacache={use_teacache}, teacache_num_steps={teacache_num_steps}, teacache_rel_l1_thresh={teacache_rel_l1_thresh}")
-    
-    # Add LoRA values if provided - extract them from the tuple
-    if lora_values:
-        # Convert tuple to list
-        lora_values_list = list(lora_values)
-        job_params['lora_values'] = lora_values_list
-    
-    # Add job to queue
-    job_id = job_queue.add_job(job_params)
-    
-    # Set the generation_type attribute on the job object directly
-    job = job_queue.get_job(job_id)
-    if job:
-        job.generation_type = model_type  # Set generation_type to model_type for display in queue
-    print(f"Added job {job_id} to queue")
+def process(*args, **kwargs):
+    """Adds a job from the UI, see engine.process for the parameters"""
+    job_id = engine.process(*args, **kwargs)
     
     queue_status = update_queue_status()
     # Return immediately after adding to queue
@@ -478,7 +171,6 @@ def process(
     return None, job_id, None, '', f'Job added to queue. Job ID: {job_id}', gr.update(value="🚀 Add to Queue", interactive=True), gr.update(value="❌ Cancel Current Job", interactive=True)
 
 
-
 def end_process():
     """Cancel the current running job and update the queue status"""
     print("Cancelling current job")
@@ -502,9 +194,10 @@ def end_process():
 def update_queue_status():
     """Update queue status and refresh job positions"""
     jobs = job_queue.get_all_jobs()
+    positions = job_queue.get_queue_positions()
     for job in jobs:
         if job.status == JobStatus.PENDING:
-            job.queue_position = job_queue.get_queue_position(job.id)
+            job.queue_position = job_queue.get_queue_position(job.id, positions)
     
     # Make sure to update current running job info
     if job_queue.current_job:
@@ -0,0 +1,92 @@
+import unittest
+
+from modules.admission import MODULE_SIZES_GB, admit_job, estimate_job_memory
+
+
+def make_params(seconds=5, resolution=640, latent_window_size=9):
+    return {
+        'model_type': "Original",
+        'resolutionW': resolution,
+        'resolutionH': resolution,
+        'total_second_length': seconds,
+        'latent_window_size': latent_window_size,
+    }
+
+
+def make_plan(latent_window_size=9):
+    return {
+        "chunked_execution": False,
+        "chunked_attention": False,
+        "deferred_decode": False,
+        "decode_chunk_latent_frames": latent_window_size * 2,
+    }
+
+
+class EstimateJobMemoryTest(unittest.TestCase):
+    def test_high_vram_keeps_no_models_on_host(self):
+        estimate = estimate_job_memory(make_params(), make_plan(), high_vram=True, device_memory_gb=80)
+        self.assertEqual(estimate.breakdown["host_models"], 0.0)
+        self.assertLess(estimate.host_gb, 8)
+
+    def test_offloaded_models_stay_on_host(self):
+        estimate = estimate_job_memory(make_params(), make_plan(), high_vram=False, device_memory_gb=24)
+        self.assertAlmostEqual(estimate.breakdown["host_models"], sum(MODULE_SIZES_GB.values()))
+
+    def test_mapped_snapshots_are_not_counted(self):
+        estimate = estimate_job_memory(make_params(), make_plan(), high_vram=False, device_memory_gb=24,
+                                       mapped_modules={"transformer", "text_encoder"})
+        expected = sum(size for name, size in MODULE_SIZES_GB.items() if name not in ("transformer", "text_encoder"))
+        self.assertAlmostEqual(estimate.breakdown["host_models"], expected)
+
+    def test_history_grows_with_length(self):
+        short = estimate_job_memory(make_params(seconds=5), make_plan(), high_vram=True, device_memory_gb=80)
+        long = estimate_job_memory(make_params(seconds=60), make_plan(), high_vram=True, device_memory_gb=80)
+        self.assertGreater(long.breakdown["host_history"], short.breakdown["host_history"])
+        self.assertEqual(long.device_gb, short.device_gb)
+
+
+class AdmitJobTest(unittest.TestCase):
+    def test_accepts_short_job_on_small_hosts(self):
+        for host_memory_gb in (32, 48):
+            for high_vram, device_memory_gb in ((True, 80), (False, 24)):
+                decision = admit_job(make_params(), make_plan(), high_vram, device_memory_gb, host_memory_gb,
+                                     mapped_modules=set(MODULE_SIZES_GB))
+                self.assertEqual(decision.action, "accept")
+                self.assertEqual(decision.warning, "")
+
+    def test_host_overcommit_only_warns_in_adjust_mode(self):
+        decision = admit_job(make_params(), make_plan(), False, 24, 32)
+        self.assertEqual(decision.action, "accept")
+        self.assertIn("host memory", decision.warning)
+
+    def test_host_overcommit_rejects_in_strict_mode(self):
+        decision = admit_job(make_params(), make_plan(), False, 24, 32, mode="strict")
+        self.assertEqual(decision.action, "reject")
+        self.assertIn("host memory", decision.reason)
+
+    def test_adjusts_wide_window(self):
+        params, plan = make_params(latent_window_size=16), make_plan(16)
+        decision = admit_job(params, plan, False, 24, 48, mapped_modules=set(MODULE_SIZES_GB))
+        self.assertEqual(decision.action, "adjust")
+        self.assertTrue(decision.plan["chunked_execution"])
+        self.assertLessEqual(decision.estimate.device_gb, 24)
+
+    def test_strict_mode_rejects_instead_of_adjusting(self):
+        params, plan = make_params(latent_window_size=16), make_plan(16)
+        decision = admit_job(params, plan, False, 24, 48, mode="strict", mapped_modules=set(MODULE_SIZES_GB))
+        self.assertEqual(decision.action, "reject")
+
+    def test_rejects_job_that_never_fits(self):
+        params, plan = make_params(latent_window_size=33), make_plan(33)
+        decision = admit_job(params, plan, False, 24, 48, mapped_modules=set(MODULE_SIZES_GB))
+        self.assertEqual(decision.action, "reject")
+        self.assertIn("on device", decision.reason)
+
+    def test_off_mode_accepts_everything(self):
+        params, plan = make_params(latent_window_size=33), make_plan(33)
+        decision = admit_job(params, plan, False, 24, 16, mode="off")
+        self.assertEqual(decision.action, "accept")
+
+
+if __name__ == "__main__":
+    unittest.main()
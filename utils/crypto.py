@@ -1,6 +1,8 @@
 import os
 import base64
-from typing import Optional, Union
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Optional, Tuple, Union
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
@@ -17,8 +19,16 @@ AES_IV_LENGTH: int = 16
 AES_BLOCK_SIZE_BITS: int = algorithms.AES.block_size  # type: ignore
 SALT_LENGTH: int = 16
 
+# Streaming reads, a multiple of 3 and 4 so base64 chunks concatenate into the same text as a one shot encoding
+STREAM_CHUNK_SIZE: int = 3 * 4 * 64 * 1024
+DERIVED_KEY_CACHE_SIZE: int = int(os.environ.get("APP_CRYPTO_KEY_CACHE_SIZE", "256"))
 
-def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
+_derived_keys: "OrderedDict[Tuple[str, bytes, int], bytes]" = OrderedDict()
+_session_keys: dict = {}
+_keys_lock = threading.Lock()
+
+
+def _derive_key_uncached(password: str, salt: bytes, iterations: int) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=PBKDF2_HASH_ALGORITHM,
         length=PBKDF2_KEY_LENGTH,
@@ -29,20 +39,74 @@ def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS)
     return kdf.derive(password.encode('utf-8'))
 
 
-def encrypt(data: Union[bytes, str], password: Optional[str] = None) -> bytes:
+def derive_key(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
+    """PBKDF2 key for (password, salt), the most recently used keys are cached so repeated tokens skip the derivation"""
+    cache_key = (password, bytes(salt), iterations)
+    with _keys_lock:
+        key = _derived_keys.get(cache_key)
+        if key is not None:
+            _derived_keys.move_to_end(cache_key)
+            return key
+
+    key = _derive_key_uncached(password, salt, iterations)
+
+    if DERIVED_KEY_CACHE_SIZE > 0:
+        with _keys_lock:
+            _derived_keys[cache_key] = key
+            while len(_derived_keys) > DERIVED_KEY_CACHE_SIZE:
+                _derived_keys.popitem(last=False)
+    return key
+
+
+def _resolve_password(password: Optional[str], action: str) -> str:
     if password is None:
         password = os.environ.get("APP_CRYPTO_PASSWORD", None)
 
     if password is None:
         raise Exception(
-            "Encryption password not provided and APP_CRYPTO_PASSWORD environment variable not set."
+            f"{action} password not provided and APP_CRYPTO_PASSWORD environment variable not set."
         )
-
+    return password
+
+
+def get_session_key(password: Optional[str] = None) -> Tuple[bytes, bytes]:
+    """
+    The (salt, key) of this process for a password, derived once.
+
+    Every token encrypted with it carries the salt as usual, so it decrypts like any other token.
+    Each encryption still uses a random IV.
+    """
+    password = _resolve_password(password, "Encryption")
+    with _keys_lock:
+        session = _session_keys.get(password)
+    if session is None:
+        salt = os.urandom(SALT_LENGTH)
+        session = (salt, derive_key(password, salt))
+        with _keys_lock:
+            session = _session_keys.setdefault(password, session)
+    return session
+
+
+def _encryption_key(password: Optional[str], fresh_salt: bool) -> Tuple[bytes, bytes]:
+    if fresh_salt:
+        salt = os.urandom(SALT_LENGTH)
+        return salt, _derive_key_uncached(_resolve_password(password, "Encryption"), salt, PBKDF2_ITERATIONS)
+    return get_session_key(password)
+
+
+def encrypt(data: Union[bytes, str], password: Optional[str] = None, fresh_salt: bool = False) -> bytes:
+    """
+    Encrypts data into a Base64 token of salt + IV + AES-256-CBC ciphertext.
+
+    Args:
+        data: The bytes or text to encrypt
+        password: Defaults to APP_CRYPTO_PASSWORD
+        fresh_salt: Derive a key from a new salt instead of using the session key of the password
+    """
     if isinstance(data, str):
         data = data.encode('utf-8')
 
-    salt = os.urandom(SALT_LENGTH)
-    key = derive_key(password, salt)
+    salt, key = _encryption_key(password, fresh_salt)
     iv = os.urandom(AES_IV_LENGTH)
 
     aes_algorithm = algorithms.AES(key)
@@ -60,13 +124,7 @@ def encrypt(data: Union[bytes, str], password: Optional[str] = None) -> bytes:
 
 
 def decrypt(token: Union[bytes, str], password: Optional[str] = None) -> bytes:
-    if password is None:
-        password = os.environ.get("APP_CRYPTO_PASSWORD", None)
-
-    if password is None:
-        raise Exception(
-            "Decryption password not provided and APP_CRYPTO_PASSWORD environment variable not set."
-        )
+    password = _resolve_password(password, "Decryption")
 
     decoded_payload = base64.b64decode(token)
 
@@ -87,3 +145,90 @@ def decrypt(token: Union[bytes, str], password: Optional[str] = None) -> bytes:
     decrypted = unpadder.update(decrypted_padded) + unpadder.finalize()
 
     return decrypted
+
+
+def encrypt_stream(source: BinaryIO, target: BinaryIO, password: Optional[str] = None,
+                   fresh_salt: bool = False, chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """
+    Encrypts a binary stream chunk by chunk, writing the same Base64 token encrypt() returns for its content.
+
+    Returns:
+        The number of bytes written
+    """
+    salt, key = _encryption_key(password, fresh_salt)
+    iv = os.urandom(AES_IV_LENGTH)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).encryptor()
+    padder = padding.PKCS7(AES_BLOCK_SIZE_BITS).padder()
+
+    written = 0
+    pending = salt + iv  # Raw bytes not yet Base64 encoded, kept to a multiple of 3 between writes
+
+    def write(raw: bytes, final: bool = False) -> None:
+        nonlocal pending, written
+        pending += raw
+        cut = len(pending) if final else len(pending) - len(pending) % 3
+        if cut:
+            encoded = base64.b64encode(pending[:cut])
+            target.write(encoded)
+            written += len(encoded)
+            pending = pending[cut:]
+
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        write(encryptor.update(padder.update(chunk)))
+    write(encryptor.update(padder.finalize()) + encryptor.finalize(), final=True)
+    return written
+
+
+def decrypt_stream(source: BinaryIO, target: BinaryIO, password: Optional[str] = None,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """
+    Decrypts a Base64 token read from a binary stream chunk by chunk.
+
+    Returns:
+        The number of plaintext bytes written
+    """
+    password = _resolve_password(password, "Decryption")
+    header_length = SALT_LENGTH + AES_IV_LENGTH
+    encoded = b""  # Base64 text not yet decoded, decoded in multiples of 4 characters
+    header = b""
+    decryptor = None
+    unpadder = padding.PKCS7(AES_BLOCK_SIZE_BITS).unpadder()
+    written = 0
+
+    def consume(raw: bytes) -> None:
+        nonlocal header, decryptor, written
+        if decryptor is None:
+            header += raw
+            if len(header) < header_length:
+                return
+            salt, iv, raw = header[:SALT_LENGTH], header[SALT_LENGTH:header_length], header[header_length:]
+            key = derive_key(password, salt)
+            decryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+        plain = unpadder.update(decryptor.update(raw))
+        target.write(plain)
+        written += len(plain)
+
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        encoded += b"".join(chunk.split())
+        cut = len(encoded) - len(encoded) % 4
+        consume(base64.b64decode(encoded[:cut]))
+        encoded = encoded[cut:]
+    consume(base64.b64decode(encoded))
+
+    if decryptor is None:
+        raise ValueError("Encrypted stream is shorter than its salt and IV")
+    plain = unpadder.update(decryptor.finalize()) + unpadder.finalize()
+    target.write(plain)
+    return written + len(plain)
+
+
+def encrypt_file(source_path: str, target_path: str, password: Optional[str] = None, fresh_salt: bool = False) -> int:
+    """Encrypts a file into a Base64 token file without holding either in memory, returns the token size"""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        return encrypt_stream(source, target, password, fresh_salt)
+
+
+def decrypt_file(source_path: str, target_path: str, password: Optional[str] = None) -> int:
+    """Decrypts a token file written by encrypt_file or encrypt(), returns the plaintext size"""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        return decrypt_stream(source, target, password)
@@ -1,29 +1,24 @@
 import base64
-import requests
 import os
-import logging
 import numpy as np
 from PIL import Image
 from io import BytesIO
-from tenacity import before_sleep_log, retry, stop_after_attempt, wait_fixed
+from diffusers_helper.bucket_tools import find_nearest_bucket
+from .image_fetcher import get_image_fetcher
 from .logging import logger
 
 logger = logger.getChild("image")
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_fixed(0.2),
-    before_sleep=before_sleep_log(logger, logging.WARNING)
-)
 def image_fetch(input: str) -> Image.Image:
     """
     Converts an image input (File, URL or base64) to a PIL Image.
+
+    URLs are fetched through the image cache, which retries and resumes the download itself.
     """
     try:
         if input.startswith(('http://', 'https://')):
-            logger.info(f"Downloading image: {os.path.basename(input)}")
-            response = requests.get(input, stream=True)
-            output = response.content
+            logger.info(f"Fetching image: {os.path.basename(input.split('?')[0])}")
+            return Image.open(get_image_fetcher().fetch(input))
         elif os.path.isfile(input):
             logger.info(f"Opening image from: {input}")
             return Image.open(input)
@@ -35,6 +30,46 @@ def image_fetch(input: str) -> Image.Image:
     except Exception as e:
         raise ValueError(f"Error fetching image: {e}")
 
+def image_to_bucket(image: Image.Image, resolution: int) -> np.ndarray:
+    """
+    Decodes an image straight to the bucket the pipelines resize it to.
+
+    Gives the same result as `resize_and_center_crop(np.array(image), *bucket)` within resampling noise,
+    without decoding and resampling the full resolution: the bucket is chosen from the size in the header,
+    JPEGs are decoded with DCT scaling to the smallest size still covering the resized image, and the
+    crop and the resize are one LANCZOS resample of the source box. The pipelines then find the image
+    already at its bucket size and skip their own resize.
+
+    Args:
+        image: An opened, not yet decoded image
+        resolution: The resolutionW of the job
+
+    Returns:
+        The RGB image as an (height, width, 3) uint8 array
+    """
+    width, height = image.size
+    bucket_height, bucket_width = find_nearest_bucket(height, width, resolution=resolution)
+
+    # Same geometry as resize_and_center_crop: scale to cover the bucket, then crop the center (rounded like PIL's crop)
+    scale = max(bucket_width / width, bucket_height / height)
+    resized_width = int(round(width * scale))
+    resized_height = int(round(height * scale))
+    left = round((resized_width - bucket_width) / 2)
+    top = round((resized_height - bucket_height) / 2)
+
+    if image.format == "JPEG":
+        image.draft("RGB", (resized_width, resized_height))
+    image = image.convert("RGB")
+
+    # Crop box in the coordinates of the decoded (possibly reduced) image
+    scale_x = image.width / resized_width
+    scale_y = image.height / resized_height
+    box = (left * scale_x, top * scale_y, (left + bucket_width) * scale_x, (top + bucket_height) * scale_y)
+    if image.size == (bucket_width, bucket_height) and box == (0, 0, bucket_width, bucket_height):
+        return np.array(image)
+    return np.array(image.resize((bucket_width, bucket_height), Image.LANCZOS, box=box))
+
+
 def image_numpy_to_base64(array: np.ndarray) -> str:
     image = Image.fromarray(array)
     buffered = BytesIO()
@@ -0,0 +1,373 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .logging import logger
+from .paths import get_local_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows, the index is merged without a lock there
+    fcntl = None
+
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# Partial downloads left by processes that died are removed after this long
+PARTIAL_MAX_AGE_SECONDS = 24 * 3600
+
+
+class ImageFetcher:
+    """
+    Downloads input images through a pooled HTTP session into a local, content-addressed disk cache.
+
+    Files are stored once under `<cache_dir>/objects/<sha256>`. Each URL records the digest and the
+    validators (ETag, Last-Modified) of its last download, so fetching it again is a conditional request
+    answered with 304 when the image did not change. URLs without validators are downloaded again, into
+    the same object when the content is the same. Interrupted downloads resume with a range request
+    guarded by If-Range, so a part of an older version of the file is never completed with the new one.
+    The cache is kept under `max_bytes` by evicting the least recently used files.
+
+    Several processes may share a cache folder: each one downloads into its own partial files, and the
+    index is re-read under a file lock before this process's changes are written into it.
+
+    prefetch() starts downloads on a small thread pool, fetch() of a URL already in flight waits for it.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0, connect_timeout=5.0, read_timeout=30.0, attempts=3,
+                 max_workers=4, max_pending=16, pool_size=16):
+        """
+        Args:
+            cache_dir: Folder of the cache
+            max_bytes: Size budget of the cache, 0 for no limit
+            connect_timeout: Seconds to connect to the server
+            read_timeout: Seconds without receiving data before the download fails
+            attempts: Tries per fetch, later tries resume the partial download
+            max_workers: Prefetches downloaded at the same time
+            max_pending: Prefetches queued or running, further prefetches are ignored
+            pool_size: Connections kept open per host
+        """
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.partial_dir = os.path.join(cache_dir, "partial")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._remove_stale_parts()
+
+        self.max_bytes = max_bytes
+        self.timeout = (connect_timeout, read_timeout)
+        self.attempts = attempts
+        self.max_pending = max_pending
+        self.logger = logger.getChild("image_fetcher")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-prefetch")
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.prefetching = set()  # URLs queued or running on the prefetch pool
+        self.index = self._load_index()
+        # Entries changed since the index was last saved, None for the removed ones
+        self.pending_urls = {}
+        self.pending_objects = {}
+
+    def _remove_stale_parts(self):
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > PARTIAL_MAX_AGE_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # --- Index ---
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                return {"objects": index.get("objects", {}), "urls": index.get("urls", {})}
+            except Exception as e:
+                self.logger.warning(f"Could not read the image cache index, starting empty: {e}")
+        return {"objects": {}, "urls": {}}
+
+    @contextmanager
+    def _index_file_lock(self):
+        with open(f"{self.index_path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _save_index(self):
+        """
+        Called with self.lock held. The pending changes are applied to the index on disk, which may have
+        been updated by another process since it was read, instead of overwriting it.
+        """
+        with self._index_file_lock():
+            index = self._load_index()
+            for key, pending in (("urls", self.pending_urls), ("objects", self.pending_objects)):
+                for name, entry in pending.items():
+                    if entry is None:
+                        index[key].pop(name, None)
+                    elif key == "objects" and name in index[key]:
+                        index[key][name]["last_used"] = max(index[key][name].get("last_used", 0), entry.get("last_used", 0))
+                    else:
+                        index[key][name] = entry
+            tmp_path = f"{self.index_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        self.index = index
+        self.pending_urls.clear()
+        self.pending_objects.clear()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest)
+
+    def _record(self, url, digest, response=None):
+        """Marks an object as used and remembers the validators of its URL"""
+        with self.lock:
+            entry = self.index["urls"].setdefault(url, {})
+            entry["digest"] = digest
+            if response is not None and response.status_code != 304:
+                entry["etag"] = response.headers.get("ETag")
+                entry["last_modified"] = response.headers.get("Last-Modified")
+            obj = self.index["objects"].setdefault(digest, {"size": os.path.getsize(self._object_path(digest))})
+            obj["last_used"] = time.time()
+            self.pending_urls[url] = entry
+            self.pending_objects[digest] = obj
+            self._save_index()
+
+    # --- Download ---
+
+    def _download(self, url, headers):
+        """
+        GETs a URL into the cache, resuming a partial download from an earlier attempt.
+
+        Returns:
+            Tuple of (digest or None when the server answered 304, response)
+        """
+        # Each process downloads into its own part, other processes sharing the cache may fetch the same URL
+        part_path = os.path.join(self.partial_dir, f"{hashlib.sha1(url.encode()).hexdigest()}.{os.getpid()}")
+        validator_path = f"{part_path}.validator"
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if have and os.path.exists(validator_path):
+            with open(validator_path, "r") as f:
+                validator = f.read().strip() or None
+        request_headers = dict(headers)
+        if have and validator:
+            # The server only sends the range when the resource still matches the part, the whole file otherwise
+            request_headers["Range"] = f"bytes={have}-"
+            request_headers["If-Range"] = validator
+        else:
+            have = 0  # A part without a validator cannot be safely resumed
+
+        with self.session.get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return None, response
+            if response.status_code == 416:
+                os.remove(part_path)  # The partial file does not match the resource anymore
+                if os.path.exists(validator_path):
+                    os.remove(validator_path)
+                raise IOError(f"Range not satisfiable for {url}, restarting the download")
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The whole file, the part is discarded and the validator of this version kept for a later resume
+                have = 0
+                etag = response.headers.get("ETag")
+                validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+                if validator:
+                    with open(validator_path, "w") as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            with open(part_path, "ab" if have else "wb") as f:
+                for chunk in response.iter_content(COPY_BUFFER_SIZE):
+                    f.write(chunk)
+
+        content_length = response.headers.get("Content-Length")
+        # Content-Length is the encoded size when the body is compressed
+        if content_length is not None and not response.headers.get("Content-Encoding") and os.path.getsize(part_path) - have != int(content_length):
+            raise IOError(f"Incomplete download of {url}: {os.path.getsize(part_path) - have} of {content_length} bytes")
+
+        h = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        if os.path.exists(self._object_path(digest)):
+            os.remove(part_path)  # Same content already cached under another URL
+        else:
+            os.replace(part_path, self._object_path(digest))
+        return digest, response
+
+    def _fetch(self, url):
+        with self.lock:
+            entry = dict(self.index["urls"].get(url, {}))
+        digest = entry.get("digest")
+        cached = digest is not None and os.path.isfile(self._object_path(digest))
+
+        headers = {}
+        if cached:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        started_at = time.perf_counter()
+        last_error = None
+        for attempt in range(self.attempts):
+            try:
+                new_digest, response = self._download(url, headers)
+                break
+            except (requests.RequestException, IOError) as e:
+                last_error = e
+                self.logger.warning(f"Fetching {os.path.basename(url.split('?')[0])} failed (attempt {attempt + 1}/{self.attempts}): {e}")
+                time.sleep(0.2)
+        else:
+            raise last_error
+
+        if new_digest is None:
+            self.logger.info(f"Image not modified, using the cache ({digest[:12]})")
+        else:
+            digest = new_digest
+            self.logger.info(f"Downloaded image {digest[:12]} in {time.perf_counter() - started_at:.2f}s")
+        self._record(url, digest, response)
+        self.evict(keep={digest})
+        return self._object_path(digest)
+
+    # --- Public API ---
+
+    def _claim(self, url):
+        """(future, True) when the caller has to fetch the URL, (future of the fetch in flight, False) otherwise"""
+        with self.lock:
+            future = self.in_flight.get(url)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.in_flight[url] = future
+            return future, True
+
+    def _run(self, url, future):
+        try:
+            path = self._fetch(url)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(url, None)
+
+    def fetch(self, url):
+        """
+        Returns the path of the cached file of a URL, downloading it if needed.
+        """
+        future, owner = self._claim(url)
+        return self._run(url, future) if owner else future.result()
+
+    def prefetch(self, urls: Iterable[str]) -> List[Future]:
+        """
+        Starts downloading URLs in the background, for the inputs of jobs that are not running yet.
+
+        URLs already being fetched are not requested twice. At most max_pending prefetches are queued or
+        running, URLs over that are skipped and downloaded by fetch() when they are needed.
+
+        Returns:
+            The futures of the prefetches started, resolving to the cached paths
+        """
+        futures = []
+        for url in urls:
+            with self.lock:
+                if len(self.prefetching) >= self.max_pending:
+                    break
+            future, owner = self._claim(url)
+            if not owner:
+                continue
+            with self.lock:
+                self.prefetching.add(url)
+            self.executor.submit(self._prefetch_one, url, future)
+            futures.append(future)
+        return futures
+
+    def _prefetch_one(self, url, future):
+        try:
+            self._run(url, future)
+        except Exception as e:
+            self.logger.warning(f"Prefetching an image failed: {e}")
+        finally:
+            with self.lock:
+                self.prefetching.discard(url)
+
+    def evict(self, keep=()):
+        """Removes the least recently used files until the cache fits in max_bytes"""
+        if not self.max_bytes:
+            return []
+        with self.lock:
+            objects = self.index["objects"]
+            total = sum(entry.get("size", 0) for entry in objects.values())
+            evicted = []
+            for digest, entry in sorted(objects.items(), key=lambda item: item[1].get("last_used", 0)):
+                if total <= self.max_bytes:
+                    break
+                if digest in keep:
+                    continue
+                for url, url_entry in list(self.index["urls"].items()):
+                    if url_entry.get("digest") == digest:
+                        del self.index["urls"][url]
+                        self.pending_urls[url] = None
+                if os.path.isfile(self._object_path(digest)):
+                    os.remove(self._object_path(digest))
+                total -= entry.get("size", 0)
+                evicted.append(digest)
+            for digest in evicted:
+                del objects[digest]
+                self.pending_objects[digest] = None
+            if evicted:
+                self._save_index()
+        if evicted:
+            self.logger.debug(f"Evicted {len(evicted)} image(s) from the cache")
+        return evicted
+
+
+def get_image_cache_dir():
+    """Where fetched input images are cached, FRAMEPACK_IMAGE_CACHE_DIR, by default on the local disk of the node"""
+    default_dir = os.path.join(get_local_dir(), "image_cache")
+    return os.environ.get("FRAMEPACK_IMAGE_CACHE_DIR", default_dir)
+
+
+_image_fetcher: Optional[ImageFetcher] = None
+_image_fetcher_lock = threading.Lock()
+
+
+def get_image_fetcher() -> ImageFetcher:
+    global _image_fetcher
+    with _image_fetcher_lock:
+        if _image_fetcher is None:
+            _image_fetcher = ImageFetcher(
+                get_image_cache_dir(),
+                max_bytes=int(float(os.environ.get("FRAMEPACK_IMAGE_CACHE_MB", "2048")) * 1024 * 1024),
+                connect_timeout=float(os.environ.get("FRAMEPACK_IMAGE_CONNECT_TIMEOUT", "5")),
+                read_timeout=float(os.environ.get("FRAMEPACK_IMAGE_READ_TIMEOUT", "30")),
+                max_workers=int(os.environ.get("FRAMEPACK_IMAGE_PREFETCH_WORKERS", "4")),
+                max_pending=int(os.environ.get("FRAMEPACK_IMAGE_PREFETCH_MAX_PENDING", "16")),
+            )
+        return _image_fetcher
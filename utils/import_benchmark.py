@@ -0,0 +1,80 @@
+"""
+Measures how long importing an entry point takes, each one in a fresh interpreter.
+
+    python -m utils.import_benchmark engine studio
+
+Prints the wall time of the import and, from `python -X importtime`, the modules it imports directly
+with the highest cumulative import time. Model loading started by the import runs in the background and
+is not waited for, the subprocess exits right after the import.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+BENCHMARK_CODE = """
+import os, sys, time
+started_at = time.perf_counter()
+import {module}
+print(f"__import_seconds__ {{time.perf_counter() - started_at:.3f}}", flush=True)
+sys.stderr.flush()
+os._exit(0)
+"""
+
+
+def benchmark_import(module, top=15):
+    """
+    Imports a module in a subprocess.
+
+    Returns:
+        Tuple of (seconds, [(cumulative seconds, module name)] of its slowest direct imports)
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BENCHMARK_CODE.format(module=module)],
+        cwd=project_root, capture_output=True, text=True,
+    )
+    seconds = None
+    for line in result.stdout.splitlines():
+        if line.startswith("__import_seconds__"):
+            seconds = float(line.split()[1])
+    if seconds is None:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    slowest = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        # Nested imports are indented by two spaces per level, the module itself is at one space
+        if match and len(match.group(3)) == 3:
+            cumulative_us, name = int(match.group(2)), match.group(4)
+            slowest.append((cumulative_us / 1e6, name))
+    slowest.sort(reverse=True)
+    return seconds, slowest[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the FramePack entry points")
+    parser.add_argument("modules", nargs="*", default=["engine", "studio"])
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list per module")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        seconds, slowest = benchmark_import(module, args.top)
+        results[module] = seconds
+        print(f"{module}: {seconds:.2f}s")
+        for cumulative, name in slowest:
+            print(f"    {cumulative:8.3f}s  {name}")
+
+    if len(results) > 1:
+        fastest = min(results, key=results.get)
+        for module, seconds in results.items():
+            if module != fastest:
+                print(f"{fastest} imports {seconds - results[fastest]:.2f}s faster than {module}")
+
+
+if __name__ == "__main__":
+    main()
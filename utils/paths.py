@@ -0,0 +1,16 @@
+import os
+
+
+def get_home_dir():
+    """FRAMEPACK_HOME, a network volume shared by every worker under RunPod"""
+    return os.environ.get("FRAMEPACK_HOME", os.path.expanduser("~/.cache/framepack"))
+
+
+def get_local_dir():
+    """
+    Folder for state that must stay on this node: SQLite databases, caches and partial downloads, which are
+    not safe to share between hosts. FRAMEPACK_LOCAL_HOME, by default FRAMEPACK_HOME except under RunPod
+    serverless, where FRAMEPACK_HOME is the shared volume and the container disk is used instead.
+    """
+    default_dir = os.path.expanduser("~/.cache/framepack") if os.environ.get("RUNPOD_WEBHOOK_GET_JOB") else get_home_dir()
+    return os.environ.get("FRAMEPACK_LOCAL_HOME", default_dir)
@@ -1,13 +1,14 @@
 import os
 import uuid
 import time
+import shutil
 import boto3
 import multiprocessing
 from typing import Optional, Tuple
 from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from runpod.serverless.utils.rp_upload import extract_region_from_url
-from utils.crypto import encrypt
+from utils import crypto
 
 def get_boto_client(
     bucket_creds: Optional[dict] = None,
@@ -106,33 +107,37 @@ def upload_video(
     file_extension = os.path.splitext(file_location)[1]
     content_type = "video/" + file_extension.lstrip(".")
     
-    with open(file_location, "rb") as input_file:
-        output = input_file.read()
-    
+    upload_location = file_location
     if encrypt_file:
         content_type = "application/x-encrypted"
         file_extension = f"{file_extension}.enc"
-        output = encrypt(output)
-
-    if boto_client is None:
-        # Save the output to a file
-        print("No bucket endpoint set, saving to disk folder 'simulated_uploaded'")
-
-        os.makedirs("simulated_uploaded", exist_ok=True)
-        sim_upload_location = f"simulated_uploaded/{file_name}{file_extension}"
-
-        with open(sim_upload_location, "wb") as file_output:
-            file_output.write(output)
-
-        return sim_upload_location
-
-    bucket = bucket_name if bucket_name else time.strftime("%m-%y")
-    boto_client.put_object(
-        Bucket=f"{bucket}",
-        Key=f"{job_id}/{file_name}{file_extension}",
-        Body=output,
-        ContentType=content_type,
-    )
+        # Encrypted chunk by chunk next to the video, neither the video nor the token is held in memory
+        upload_location = f"{file_location}.{uuid.uuid4().hex}.enc"
+        crypto.encrypt_file(file_location, upload_location)
+
+    try:
+        if boto_client is None:
+            # Save the output to a file
+            print("No bucket endpoint set, saving to disk folder 'simulated_uploaded'")
+
+            os.makedirs("simulated_uploaded", exist_ok=True)
+            sim_upload_location = f"simulated_uploaded/{file_name}{file_extension}"
+
+            shutil.copyfile(upload_location, sim_upload_location)
+
+            return sim_upload_location
+
+        bucket = bucket_name if bucket_name else time.strftime("%m-%y")
+        with open(upload_location, "rb") as body:
+            boto_client.put_object(
+                Bucket=f"{bucket}",
+                Key=f"{job_id}/{file_name}{file_extension}",
+                Body=body,
+                ContentType=content_type,
+            )
+    finally:
+        if upload_location != file_location and os.path.exists(upload_location):
+            os.remove(upload_location)
 
     presigned_url: str = boto_client.generate_presigned_url(
         "get_object",